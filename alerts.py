@@ -0,0 +1,132 @@
+import numpy as np
+
+import profiling
+import timeseries
+
+# Vectorized range checks
+#
+# Each mode is compiled once into aligned low/high arrays; a tank's reading
+# columns (see timeseries.py) are then checked in a single NumPy pass.
+# NaN readings and parameters a tank never logged are never out of range.
+
+HIGHLIGHT = "background-color: #ffcccc"
+
+
+def compile_mode(ranges):
+    params = list(ranges)
+    bounds = np.array([ranges[p] for p in params], dtype=np.float64).reshape(len(params), 2)
+    return {"params": params, "low": bounds[:, 0], "high": bounds[:, 1], "ranges": ranges}
+
+
+def compile_modes(modes):
+    return {name: compile_mode(ranges) for name, ranges in modes.items()}
+
+
+def _matrix(cols, compiled):
+    return np.array([timeseries.series(cols, p) for p in compiled["params"]]).reshape(
+        len(compiled["params"]), len(cols["timestamps"])
+    )
+
+
+def _edges(mask, timestamps):
+    # First/last breach timestamp per parameter, NAT where there is none
+    hit = mask.any(axis=1)
+    n = mask.shape[1]
+    first = np.where(hit, timestamps[mask.argmax(axis=1)] if n else timeseries.NAT, timeseries.NAT)
+    last = np.where(hit, timestamps[n - 1 - mask[:, ::-1].argmax(axis=1)] if n else timeseries.NAT, timeseries.NAT)
+    return first, last
+
+
+def out_of_range(values, low, high):
+    # values is (params, readings); comparisons with NaN are False
+    with np.errstate(invalid="ignore"):
+        return (values < low[:, None]) | (values > high[:, None])
+
+
+def scan(cols, compiled):
+    timestamps = np.asarray(cols["timestamps"])
+    mask = out_of_range(_matrix(cols, compiled), compiled["low"], compiled["high"])
+    first, last = _edges(mask, timestamps)
+    return {
+        "params": compiled["params"],
+        "mask": mask,
+        "counts": mask.sum(axis=1),
+        "first": first,
+        "last": last
+    }
+
+
+@profiling.profiled()
+def check_alerts(cols, compiled):
+    # Alerts for the latest reading only
+    if not len(cols["timestamps"]):
+        return []
+    latest = _matrix(cols, compiled)[:, -1]
+    breached = out_of_range(latest[:, None], compiled["low"], compiled["high"])[:, 0]
+    alerts = []
+    for i in np.flatnonzero(breached):
+        param = compiled["params"][i]
+        low, high = compiled["ranges"][param]
+        alerts.append(f"{param}: {latest[i]} (Expected: {low}-{high})")
+    return alerts
+
+
+@profiling.profiled()
+def highlight_outliers(df, compiled):
+    # For Styler.apply(axis=None): one CSS string per cell of df
+    import pandas as pd
+
+    styles = pd.DataFrame("", index=df.index, columns=df.columns)
+    idx = [i for i, p in enumerate(compiled["params"]) if p in df.columns]
+    if idx:
+        params = [compiled["params"][i] for i in idx]
+        values = df[params].to_numpy(dtype=np.float64, na_value=np.nan).T
+        mask = out_of_range(values, compiled["low"][idx], compiled["high"][idx])
+        styles[params] = np.where(mask.T, HIGHLIGHT, "")
+    return styles
+
+
+@profiling.profiled()
+def fleet_scan(columns, tank_modes, compiled_modes):
+    # columns: {tank: cols}, tank_modes: {tank: mode name}. Every tank's
+    # readings are laid side by side with per-tank bounds repeated across
+    # its readings, so the whole fleet is checked in one comparison.
+    tanks = [t for t in columns if tank_modes.get(t) in compiled_modes]
+    params = []
+    for t in tanks:
+        for p in compiled_modes[tank_modes[t]]["params"]:
+            if p not in params:
+                params.append(p)
+    sizes = np.array([len(columns[t]["timestamps"]) for t in tanks], dtype=np.int64)
+    total = int(sizes.sum())
+    values = np.full((len(params), total), np.nan)
+    low = np.full((len(params), len(tanks)), np.nan)
+    high = np.full((len(params), len(tanks)), np.nan)
+    timestamps = np.empty(total, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    for k, t in enumerate(tanks):
+        cols, compiled = columns[t], compiled_modes[tank_modes[t]]
+        start, end = offsets[k], offsets[k + 1]
+        timestamps[start:end] = cols["timestamps"]
+        for i, p in enumerate(compiled["params"]):
+            row = params.index(p)
+            values[row, start:end] = timeseries.series(cols, p)
+            low[row, k], high[row, k] = compiled["low"][i], compiled["high"][i]
+    with np.errstate(invalid="ignore"):
+        mask = (values < np.repeat(low, sizes, axis=1)) | (values > np.repeat(high, sizes, axis=1))
+
+    results = {}
+    for k, t in enumerate(tanks):
+        start, end = offsets[k], offsets[k + 1]
+        rows = [params.index(p) for p in compiled_modes[tank_modes[t]]["params"]]
+        tank_mask = mask[rows, start:end]
+        first, last = _edges(tank_mask, timestamps[start:end])
+        results[t] = {
+            "params": compiled_modes[tank_modes[t]]["params"],
+            "mask": tank_mask,
+            "counts": tank_mask.sum(axis=1),
+            "first": first,
+            "last": last,
+            "latest": tank_mask[:, -1] if end > start else np.zeros(len(rows), dtype=bool)
+        }
+    return results
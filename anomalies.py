@@ -0,0 +1,279 @@
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import profiling
+import timeseries
+
+# Anomaly and drift detection
+#
+# alerts.py checks readings against each mode's fixed ranges; this catches
+# what those miss, for every parameter across a tank's whole history in one
+# set of NumPy array operations:
+#
+# - spikes: a reading more than Z_LIMIT standard deviations from the mean of
+#   the WINDOW readings of that parameter before it (rolling z-score)
+# - drift: a two-sided CUSUM of each parameter's daily means against their
+#   median over the history, in units of their robust spread; an alarm means
+#   the level has moved by more than CUSUM_K sigma for long enough to add up
+#   past CUSUM_H, e.g. alkalinity creeping down while still inside the band.
+#   Daily means keep a probe logging every few seconds from tripping it on
+#   noise alone; at these settings that takes ~20,000 days of a steady level
+# - rate of change: a step between consecutive readings faster than the
+#   parameter's RATE_LIMITS per day (steps under a day count as a day)
+#
+# Readings of all parameters are flattened into one array (row by row, NaN
+# readings dropped), so the rolling windows and steps are computed for the
+# whole tank at once. fleet_scan() runs the tanks in a process pool.
+
+WINDOW = 30
+MIN_PERIODS = 10
+Z_LIMIT = 4.0
+# A window this flat (relative to its mean) is treated as this noisy, so
+# quantized test kit readings do not turn every change into a spike
+MIN_SPREAD = 0.001
+CUSUM_K = 0.5
+CUSUM_H = 8.0
+CUSUM_CLIP = 3.0
+RATE_MIN_DAYS = 1.0
+# Largest safe change per day
+RATE_LIMITS = {
+    "Temperature (°C)": 2.0,
+    "Salinity (SG)": 0.002,
+    "pH": 0.5,
+    "Alkalinity (dKH)": 1.0,
+    "Calcium (ppm)": 25.0,
+    "Magnesium (ppm)": 100.0,
+}
+# Parameters not logged this many days before the tank's latest reading are
+# not reported
+STALE_DAYS = 30
+# Fleets smaller than this are scanned in-process; spawning workers costs more
+POOL_MIN_READINGS = 200000
+
+def _sorted(cols):
+    ts = np.asarray(cols["timestamps"])
+    keep = ts != timeseries.NAT
+    order = np.argsort(ts[keep], kind="stable")
+    return ts[keep][order], np.asarray(cols["values"], dtype=np.float64)[:, keep][:, order]
+
+
+def _daily(ts, values, valid):
+    # Day start times and the mean of each row per day (NaN where it has no
+    # reading); ts is sorted, so each day's readings are contiguous
+    day = ts // 86400
+    if not len(day):
+        return day, values
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=1)
+    counts = np.add.reduceat(valid.astype(np.int64), starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return day[starts] * 86400, means
+
+
+def _rolling(flat, rows, starts, window):
+    # Mean, standard deviation and count of the window readings of the same
+    # row before each reading; flat is centred per row so the sums stay accurate
+    g = np.arange(len(flat))
+    lo = np.maximum(g - window, starts[rows])
+    n = g - lo
+    s = np.concatenate([[0.0], np.cumsum(flat)])
+    ss = np.concatenate([[0.0], np.cumsum(flat * flat)])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (s[g] - s[lo]) / n
+        std = np.sqrt(np.maximum((ss[g] - ss[lo]) / n - mean * mean, 0.0))
+    return mean, std, n
+
+
+def detect(cols, rate_limits=RATE_LIMITS, window=WINDOW, z_limit=Z_LIMIT, k=CUSUM_K, h=CUSUM_H):
+    ts, values = _sorted(cols)
+    params = list(cols["params"])
+    P, N = values.shape
+    valid = ~np.isnan(values)
+    # Row-major flat indices of the readings, so scatters back into (P, N)
+    # arrays are single-index
+    idx = np.flatnonzero(valid)
+    rows = idx // max(N, 1)
+    positions = idx - rows * N
+    flat = values.ravel()[idx]
+    counts = valid.sum(axis=1)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+    # Rolling z-scores
+    with np.errstate(invalid="ignore"):
+        centre = np.nanmean(values, axis=1) if N else np.zeros(P)
+    centre = np.nan_to_num(centre)
+    centred = flat - centre[rows]
+    mean, std, n = _rolling(centred, rows, starts, window)
+    std = np.maximum(std, MIN_SPREAD * np.abs(mean + centre[rows]))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z_flat = np.where((n >= MIN_PERIODS) & (std > 0), (centred - mean) / std, np.nan)
+    z = np.full((P, N), np.nan)
+    z.ravel()[idx] = z_flat
+    with np.errstate(invalid="ignore"):
+        spikes = np.abs(z) > z_limit
+
+    # CUSUM of daily means against each row's median and robust spread
+    days, daily = _daily(ts, values, valid)
+    D = len(days)
+    daily_valid = ~np.isnan(daily)
+    with np.errstate(invalid="ignore"):
+        median = np.nanmedian(daily, axis=1) if D else np.zeros(P)
+        spread = 1.4826 * np.nanmedian(np.abs(daily - median[:, None]), axis=1) if D else np.zeros(P)
+    spread = np.maximum(np.nan_to_num(spread), MIN_SPREAD * np.abs(np.nan_to_num(median)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        u = (daily - median[:, None]) / spread[:, None]
+    # Clipped, so a single outlier is reported as a spike rather than a drift
+    u = np.where(daily_valid & (spread[:, None] > 0), np.clip(u, -CUSUM_CLIP, CUSUM_CLIP), 0.0)
+    drift = np.zeros(P, dtype=np.int64)
+    since = np.full(P, timeseries.NAT, dtype=np.int64)
+    episodes = np.zeros(P, dtype=np.int64)
+    for sign in (1, -1):
+        # Lindley form of S = max(0, S + u - k): the cumulative sum less its
+        # running minimum, computed for every row at once
+        c = np.cumsum(np.where(daily_valid, sign * u - k, 0.0), axis=1)
+        s = c - np.minimum(np.minimum.accumulate(c, axis=1), 0.0) if D else c
+        alarm = s > h
+        episodes += (alarm[:, 1:] & ~alarm[:, :-1]).sum(axis=1) + (alarm[:, 0] if D else 0)
+        current = alarm[:, -1] if D else np.zeros(P, dtype=bool)
+        # The change began the day after the last one where the sum was zero
+        zero = s <= 0
+        last_zero = np.where(zero.any(axis=1), D - 1 - zero[:, ::-1].argmax(axis=1), -1) if D else np.full(P, -1)
+        begin = np.minimum(last_zero + 1, max(D - 1, 0))
+        drift = np.where(current & (drift == 0), sign, drift)
+        since = np.where(current & (since == timeseries.NAT), days[begin] if D else timeseries.NAT, since)
+
+    # Rate of change between consecutive readings of a parameter
+    limits = np.array([rate_limits.get(p, np.inf) for p in params], dtype=np.float64)
+    flat_ts = ts[positions]
+    same = rows[1:] == rows[:-1]
+    step_days = np.maximum((flat_ts[1:] - flat_ts[:-1]) / 86400.0, RATE_MIN_DAYS)
+    rate_flat = np.where(same, (flat[1:] - flat[:-1]) / step_days, np.nan)
+    rates = np.full((P, N), np.nan)
+    rates.ravel()[idx[1:]] = rate_flat
+    with np.errstate(invalid="ignore"):
+        rate_breaches = np.abs(rates) > limits[:, None]
+
+    last = np.where(counts > 0, N - 1 - valid[:, ::-1].argmax(axis=1), -1) if N else np.full(P, -1)
+    return {
+        "params": params,
+        "timestamps": ts,
+        "values": values,
+        "z": z,
+        "spikes": spikes,
+        "rates": rates,
+        "rate_breaches": rate_breaches,
+        "limits": limits,
+        "drift": drift,
+        "since": since,
+        "episodes": episodes,
+        "last": last,
+    }
+
+
+def _date(epoch):
+    return str(np.datetime64(int(epoch), "s").astype("datetime64[D]"))
+
+
+def findings(result):
+    # What is anomalous now: the latest reading of each parameter and any
+    # drift still under way, as {"param", "kind", "direction", "since", "message"}
+    out = []
+    ts = result["timestamps"]
+    for i, p in enumerate(result["params"]):
+        j = result["last"][i]
+        if j < 0 or ts[j] < ts[-1] - STALE_DAYS * 86400:
+            continue
+        value = result["values"][i, j]
+        if result["drift"][i]:
+            direction = "up" if result["drift"][i] > 0 else "down"
+            since = _date(result["since"][i])
+            out.append({
+                "param": p, "kind": "drift", "direction": direction, "since": since,
+                "message": f"{p}: trending {direction} since {since} (now {value:g})"
+            })
+        if result["spikes"][i, j]:
+            z = result["z"][i, j]
+            out.append({
+                "param": p, "kind": "spike", "direction": "up" if z > 0 else "down", "since": _date(ts[j]),
+                "message": f"{p}: {value:g} is {abs(z):.1f} standard deviations {'above' if z > 0 else 'below'} its recent readings"
+            })
+        if result["rate_breaches"][i, j]:
+            rate = result["rates"][i, j]
+            out.append({
+                "param": p, "kind": "rate", "direction": "up" if rate > 0 else "down", "since": _date(ts[j]),
+                "message": f"{p}: changing {rate:+g} per day (limit {result['limits'][i]:g})"
+            })
+    return out
+
+
+def summary(result):
+    # Small enough to send back from a worker process
+    return {
+        "params": result["params"],
+        "spikes": result["spikes"].sum(axis=1),
+        "rate_breaches": result["rate_breaches"].sum(axis=1),
+        "drift_episodes": result["episodes"],
+        "findings": findings(result),
+    }
+
+
+@profiling.profiled()
+def tank_findings(tank_name, columns, revision, cache):
+    # findings(detect(columns())), kept in cache (one entry per tank, e.g. in
+    # the session's state) until the tank's revision changes; columns is
+    # only called, and the history read, when it has
+    cached = cache.get(tank_name)
+    if cached and cached[0] == revision:
+        return list(cached[1])
+    result = findings(detect(columns()))
+    cache[tank_name] = (revision, result)
+    return list(result)
+
+
+def _scan_job(job):
+    name, cols = job
+    return name, summary(detect(cols))
+
+
+@profiling.profiled()
+def fleet_scan(columns, workers=None):
+    # columns: {tank: cols}; returns {tank: summary}. Workers are spawned
+    # rather than forked from the (threaded) Streamlit server.
+    jobs = [
+        (name, {"params": list(c["params"]), "timestamps": np.asarray(c["timestamps"]), "values": np.asarray(c["values"])})
+        for name, c in columns.items()
+    ]
+    total = sum(len(c["timestamps"]) for _, c in jobs)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1 or total < POOL_MIN_READINGS:
+        return dict(_scan_job(job) for job in jobs)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return dict(pool.map(_scan_job, jobs))
+
+
+if __name__ == "__main__":
+    # python anomalies.py [reef_data.json | reef_data.db | reef_shards/manifest.json]
+    import probe_service
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    backend = probe_service.backend_for(path)
+    lazy = hasattr(backend, "history")
+    tanks, _ = backend.load(path, with_history=False) if lazy else backend.load(path)
+    columns = {
+        name: timeseries.from_records(backend.history(path, name, "data") if lazy else tank.get("data", []))
+        for name, tank in tanks.items()
+    }
+    start = time.perf_counter()
+    results = fleet_scan(columns)
+    for name, result in results.items():
+        print(f"{name}: {int(result['spikes'].sum())} spikes, {int(result['rate_breaches'].sum())} fast changes, "
+              f"{int(result['drift_episodes'].sum())} drifts in history")
+        for finding in result["findings"]:
+            print(f"  {finding['message']}")
+    print(f"Scanned {sum(len(c['timestamps']) for c in columns.values())} readings in {time.perf_counter() - start:.2f}s")
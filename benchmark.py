@@ -0,0 +1,249 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import alerts
+import stats
+import storage
+import timeseries
+import utils
+
+# Benchmark suite on synthetic data
+#
+# generate() builds N tanks x M readings shaped like reef_data.json (tank
+# metadata, readings for every parameter of the tank's mode with noise,
+# drift and the odd out-of-range spike, maintenance and diary entries, and
+# a custom mode). Each scenario runs against that data REPEAT times and the
+# timings are written as JSON, so two runs can be compared with --compare.
+
+SIZES = [10, 1000, 100000, 1000000]
+SCENARIOS = [
+    "load_tanks", "save_tanks", "check_alerts", "highlight_outliers",
+    "suggest_maintenance", "trends_frame", "pdf_export",
+]
+CUSTOM_MODES = {
+    "Softie": {
+        "Temperature (°C)": [24, 27],
+        "Salinity (SG)": [1.023, 1.026],
+        "pH": [7.9, 8.4],
+        "Nitrate (ppm)": [2, 25],
+        "Phosphate (ppm)": [0.02, 0.15],
+    }
+}
+TASKS = ["Water change 20%", "Clean skimmer cup", "Swap GFO", "Replace filter sock", "Check heater", "Calibrate pH probe"]
+EQUIPMENT = ["Heater", "LED Light", "Skimmer", "Auto Top-Off"]
+
+
+def _reading(rng, stamp, ranges, drift):
+    record = {"Date": stamp.strftime("%Y-%m-%d %H:%M:%S")}
+    for param, (low, high) in ranges.items():
+        span = (high - low) or max(abs(high), 1) * 0.1
+        value = (low + high) / 2 + span * (drift + rng.gauss(0, 0.25))
+        if rng.random() < 0.01:
+            value += span * rng.choice((-2, 2))
+        record[param] = round(max(value, 0.0), 4)
+    return record
+
+
+def generate(tanks=4, readings=1000, seed=0, interval_hours=None):
+    # readings is the total across all tanks; returns (tanks, custom_modes)
+    rng = random.Random(seed)
+    modes = {**utils.default_modes, **CUSTOM_MODES}
+    mode_names = list(modes)
+    per_tank = [readings // tanks + (1 if i < readings % tanks else 0) for i in range(tanks)]
+    result = {}
+    for i, count in enumerate(per_tank):
+        mode = mode_names[i % len(mode_names)]
+        # One reading a day for small tanks, denser controller logging for big ones
+        hours = interval_hours or (24 if count <= 1000 else 1 if count <= 100000 else 0.1)
+        start = datetime(2025, 1, 1) - timedelta(hours=hours * count)
+        data = []
+        for n in range(count):
+            drift = 0.5 * math.sin(n / max(count, 1) * 2 * math.pi)
+            data.append(_reading(rng, start + timedelta(hours=hours * n), modes[mode], drift))
+        days = max(int(hours * count / 24), 1)
+        maintenance = [
+            {"Date": (start + timedelta(days=d)).strftime("%Y-%m-%d"), "Task": rng.choice(TASKS), "Notes": ""}
+            for d in range(0, days, 7)
+        ]
+        diary = [
+            {"Date": (start + timedelta(days=d)).strftime("%Y-%m-%d"), "Entry": f"Week {d // 7} notes"}
+            for d in range(0, days, 14)
+        ]
+        result[f"Tank {i + 1}"] = {
+            "display_capacity": 100 + 60 * i,
+            "sump_capacity": 40,
+            "theme": f"Reefscape {i + 1}",
+            "livestock": "Clownfish, Coral, Cleaner Shrimp",
+            "equipment": EQUIPMENT[:2 + i % 3],
+            "selected_equipment": {},
+            "mode": mode,
+            "data": data,
+            "maintenance": maintenance,
+            "diary": diary,
+            "profile_image": None
+        }
+    return result, {k: dict(v) for k, v in CUSTOM_MODES.items()}
+
+
+def _timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def scenarios(tanks, custom_modes, workdir, fmt="json"):
+    # {scenario: callable}, each working on the whole fleet the way the app does
+    path = os.path.join(workdir, "reef_data.reef" if fmt == "packed" else "reef_data.json")
+    storage.save(path, tanks, custom_modes)
+    compiled = alerts.compile_modes({**utils.default_modes, **custom_modes})
+    columns = {name: timeseries.from_records(t["data"]) for name, t in tanks.items()}
+    frames = {name: timeseries.frame(cols) for name, cols in columns.items()}
+    biggest = max(tanks, key=lambda name: len(tanks[name]["data"]))
+
+    def load_tanks():
+        loaded, _ = storage.load(path)
+        for t in loaded.values():
+            utils.ensure_maintenance_index(t)
+            stats.ensure(t)
+
+    def save_tanks():
+        storage.save(path, tanks, custom_modes)
+
+    def check_alerts():
+        for name, cols in columns.items():
+            alerts.check_alerts(cols, compiled[tanks[name]["mode"]])
+
+    def highlight_outliers():
+        for name, df in frames.items():
+            alerts.highlight_outliers(df, compiled[tanks[name]["mode"]])
+
+    def suggest_maintenance():
+        # Cold: no cache, so every tank is evaluated
+        for name, t in tanks.items():
+            utils.suggest_maintenance(t, name)
+
+    def trends_frame():
+        for t in tanks.values():
+            cols = timeseries.from_records(t["data"])
+            timeseries.frame(cols)
+            timeseries.frame(timeseries.downsample(cols, 500))
+
+    def pdf_export():
+        # Fresh chart cache each time, so charts are rendered too
+        shutil.rmtree(os.path.join(workdir, "chart_cache"), ignore_errors=True)
+        t = tanks[biggest]
+        utils.generate_pdf_report(
+            biggest, t, cols=columns[biggest], suggestions=utils.suggest_maintenance(t, biggest),
+            ranges={**utils.default_modes, **custom_modes}.get(t["mode"])
+        )
+
+    return {
+        "load_tanks": load_tanks,
+        "save_tanks": save_tanks,
+        "check_alerts": check_alerts,
+        "highlight_outliers": highlight_outliers,
+        "suggest_maintenance": suggest_maintenance,
+        "trends_frame": trends_frame,
+        "pdf_export": pdf_export,
+    }
+
+
+def run(sizes=SIZES, tanks=4, repeat=3, selected=SCENARIOS, seed=0, log=print, fmt="json"):
+    results = []
+    cwd = os.getcwd()
+    for size in sizes:
+        fleet, custom_modes = generate(tanks, size, seed)
+        workdir = tempfile.mkdtemp(prefix="reef-bench-")
+        try:
+            # chart_cache writes relative to the working directory
+            os.chdir(workdir)
+            cases = scenarios(fleet, custom_modes, workdir, fmt)
+            for name in selected:
+                # The largest sizes are slow enough that one run is representative
+                times = _timed(cases[name], repeat if size <= 100000 else 1)
+                row = {
+                    "scenario": name,
+                    "readings": size,
+                    "tanks": tanks,
+                    "runs": len(times),
+                    "best_s": min(times),
+                    "median_s": statistics.median(times),
+                }
+                if name in ("load_tanks", "save_tanks"):
+                    row["file_bytes"] = os.path.getsize(os.path.join(workdir, "reef_data.reef" if fmt == "packed" else "reef_data.json"))
+                results.append(row)
+                log(f"{name:<20} {size:>9} readings  best {row['best_s'] * 1000:10.2f} ms  median {row['median_s'] * 1000:10.2f} ms")
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+        del fleet
+    return results
+
+
+def environment():
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(old, new):
+    # (scenario, readings, old best, new best, new/old) for rows in both runs
+    before = {(r["scenario"], r["readings"]): r for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        prev = before.get((r["scenario"], r["readings"]))
+        if prev:
+            rows.append((r["scenario"], r["readings"], prev["best_s"], r["best_s"], r["best_s"] / prev["best_s"] if prev["best_s"] else float("inf")))
+    return rows
+
+
+if __name__ == "__main__":
+    # python benchmark.py --sizes 10,1000 --output bench.json [--compare old.json]
+    parser = argparse.ArgumentParser(description="Benchmark storage, alerts, trends and reports on synthetic data")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="total readings per run, comma separated")
+    parser.add_argument("--tanks", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["json", "packed"], default="json", help="snapshot format for load/save")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    selected = [s for s in args.scenarios.split(",") if s]
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    report = {
+        "environment": environment(),
+        "settings": {"sizes": sizes, "tanks": args.tanks, "repeat": args.repeat, "seed": args.seed, "format": args.format},
+        "results": run(sizes, args.tanks, args.repeat, selected, args.seed, fmt=args.format),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for name, size, before, after, ratio in compare(old, report):
+            print(f"{name:<20} {size:>9} readings  {before * 1000:10.2f} -> {after * 1000:10.2f} ms  ({ratio:.2f}x)")
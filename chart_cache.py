@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+# On-disk cache of rendered charts
+#
+# A chart is stored under a hash of everything that determines its pixels
+# (tank, parameters, window, data hash, range, format), so an unchanged
+# chart is read back instead of re-plotted and a changed one simply gets a
+# new key. Reads refresh the file's mtime; once a render is done and the
+# cache has grown past MAX_BYTES, the least recently used files other than
+# the ones that render used are removed.
+
+CACHE_DIR = "chart_cache"
+MAX_BYTES = 64 * 1024 * 1024
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+# Running size of each cache directory in this process, from one walk plus
+# the files written since
+_sizes = {}
+
+
+def data_hash(cols):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(cols["params"]).encode())
+    h.update(np.ascontiguousarray(cols["timestamps"]).tobytes())
+    h.update(np.ascontiguousarray(cols["values"]).tobytes())
+    return h.hexdigest()
+
+
+def chart_key(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+def _path(key, ext, cache_dir):
+    return os.path.join(cache_dir, key[:2], f"{key}.{ext}")
+
+
+def _files(cache_dir):
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+    return files
+
+
+def cache_size(cache_dir=CACHE_DIR):
+    if cache_dir not in _sizes:
+        _sizes[cache_dir] = sum(size for _, size, _ in _files(cache_dir))
+    return _sizes[cache_dir]
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, keep=()):
+    # Called once a render is done, with the paths it used in keep. The
+    # directory is only walked when the running size is over max_bytes.
+    if cache_size(cache_dir) <= max_bytes:
+        return
+    files = _files(cache_dir)
+    total = sum(size for _, size, _ in files)
+    keep = {os.path.abspath(path) for path in keep}
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        cache_stats["evictions"] += 1
+    _sizes[cache_dir] = total
+
+
+def file_for(key, ext, render, cache_dir=CACHE_DIR, used=None):
+    # Path of the cached chart, rendering it first on a miss; the path is
+    # added to used, to be passed to evict() once the render is done
+    path = _path(key, ext, cache_dir)
+    if used is not None:
+        used.append(path)
+    if os.path.exists(path):
+        try:
+            os.utime(path)
+            cache_stats["hits"] += 1
+            return path
+        except FileNotFoundError:
+            pass
+    cache_stats["misses"] += 1
+    size = cache_size(cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(render())
+    os.replace(tmp, path)
+    _sizes[cache_dir] = size + os.path.getsize(path)
+    return path
+
+
+def get_or_render(key, ext, render, cache_dir=CACHE_DIR, used=None):
+    path = file_for(key, ext, render, cache_dir, used)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        # Evicted by another process in between
+        return render()
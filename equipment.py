@@ -0,0 +1,250 @@
+import bisect
+import heapq
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+# Equipment catalog and compatibility index
+#
+# equipment_model_lookup.json and bundled_systems.json are read once per
+# change on disk and turned into per-category spec arrays. Each model's
+# capacity becomes a volume band (heaters at LITRES_PER_WATT, skimmers at
+# their rated volume), and pump/overflow compatibility is precomputed as a
+# pumps x overflows matrix, so a volume or mode query is a handful of
+# NumPy comparisons.
+#
+# dropdown_models.json is indexed for type-ahead search: every model name is
+# split into lowercase tokens (brand and model words, plus "300w", "400l",
+# "5000lph" style tokens from its specs) and each token keeps the ids of
+# the models it appears in. A query is answered by a bisect over the sorted
+# tokens per search word, so only the top SEARCH_LIMIT matches are ever
+# handed to a selectbox.
+
+LOOKUP_FILE = "equipment_model_lookup.json"
+BUNDLED_FILE = "bundled_systems.json"
+DROPDOWN_FILE = "dropdown_models.json"
+LITRES_PER_WATT = 3  # Rough guide: 1W per 3L
+VOLUME_TOLERANCE = 0.15
+SEARCH_LIMIT = 25
+# Equipment type -> category in dropdown_models.json
+CATEGORIES = {
+    "Heater": "Heaters",
+    "LED Light": "LED Lights",
+    "Skimmer": "Skimmers",
+    "ATO System": "ATO Systems",
+    "Return Pump": "Return Pumps",
+    "Overflow Type": "Overflows",
+}
+# Equipment type -> spec key in the model lookup
+SPECS = {
+    "Heater": "wattage",
+    "Skimmer": "rated_tank_l",
+    "Return Pump": "flow_lph",
+    "Overflow Type": "recommended_flow_lph",
+}
+SPEC_SUFFIXES = {"wattage": "w", "rated_tank_l": "l", "flow_lph": "lph", "recommended_flow_lph": "lph"}
+
+_catalogs = {}
+_model_indexes = {}
+
+
+def _category(lookup, spec):
+    names = [name for name, specs in lookup.items() if specs.get(spec) is not None]
+    return {
+        "names": names,
+        "position": {n: i for i, n in enumerate(names)},
+        "values": np.array([lookup[n][spec] for n in names], dtype=np.float64),
+    }
+
+
+def build(lookup, bundled):
+    categories = {eq_type: _category(lookup, spec) for eq_type, spec in SPECS.items()}
+    pumps, overflows = categories["Return Pump"], categories["Overflow Type"]
+    return {
+        "lookup": lookup,
+        "categories": categories,
+        # Largest total volume (L) each heater / skimmer is suited to
+        "max_volume": {
+            "Heater": categories["Heater"]["values"] * LITRES_PER_WATT,
+            "Skimmer": categories["Skimmer"]["values"],
+        },
+        # pump_overflow[i, j]: pump i's flow is within overflow j's recommended flow
+        "pump_overflow": pumps["values"][:, None] <= overflows["values"][None, :],
+        "bundled": bundled,
+        "bundled_volume": np.array(
+            [(s.get("display_capacity") or 0) + (s.get("sump_capacity") or 0) for s in bundled], dtype=np.float64
+        ),
+        "bundled_mode": np.array([s.get("recommended_mode", "") for s in bundled], dtype=str),
+    }
+
+
+def _read(path, default, errors=None):
+    # Problems other than a missing file are added to errors, if given
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        if errors is not None and not isinstance(e, FileNotFoundError):
+            errors.append(f"{path}: {e}")
+        return default
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load(lookup_path=LOOKUP_FILE, bundled_path=BUNDLED_FILE):
+    # Cached until either file changes on disk
+    key = (lookup_path, bundled_path)
+    stamp = (_mtime(lookup_path), _mtime(bundled_path))
+    cached = _catalogs.get(key)
+    if cached is None or cached[0] != stamp:
+        cached = _catalogs[key] = (stamp, build(_read(lookup_path, {}), _read(bundled_path, [])))
+    return cached[1]
+
+
+def _tokens(text):
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+
+def build_model_index(names, lookup=None):
+    lookup = lookup or {}
+    postings = {}
+    for i, name in enumerate(names):
+        terms = _tokens(name)
+        for spec, value in lookup.get(name, {}).items():
+            if spec in SPEC_SUFFIXES and isinstance(value, (int, float)):
+                terms.append(f"{value:g}{SPEC_SUFFIXES[spec]}")
+        for term in set(terms):
+            postings.setdefault(term, []).append(i)
+    tokens = sorted(postings)
+    return {
+        "names": list(names),
+        "position": {n: i for i, n in enumerate(names)},
+        "lower": [str(n).lower() for n in names],
+        "tokens": tokens,
+        "postings": [postings[t] for t in tokens],
+    }
+
+
+def load_models(path=DROPDOWN_FILE, lookup_path=LOOKUP_FILE):
+    # {equipment type: model index}, cached until either file changes
+    key = (path, lookup_path)
+    stamp = (_mtime(path), _mtime(lookup_path))
+    cached = _model_indexes.get(key)
+    if cached is None or cached[0] != stamp:
+        errors = []
+        models, lookup = _read(path, {}, errors), _read(lookup_path, {}, errors)
+        indexes = {eq_type: build_model_index(models.get(c, []), lookup) for eq_type, c in CATEGORIES.items()}
+        cached = _model_indexes[key] = (stamp, indexes, errors)
+    return cached[1]
+
+
+def model_errors(path=DROPDOWN_FILE, lookup_path=LOOKUP_FILE):
+    # Why load_models() found no models in a file that exists, e.g. invalid JSON
+    load_models(path, lookup_path)
+    return list(_model_indexes[(path, lookup_path)][2])
+
+
+def search(index, query, limit=SEARCH_LIMIT):
+    # Models matching every word of query as a token prefix; names that
+    # start with the query come first, then catalog order
+    terms = _tokens(query)
+    if not terms:
+        return index["names"][:limit]
+    tokens, postings = index["tokens"], index["postings"]
+    ids = None
+    for term in sorted(set(terms), key=len, reverse=True):
+        lo = bisect.bisect_left(tokens, term)
+        hi = bisect.bisect_left(tokens, term + "\x7f")
+        hits = set().union(*postings[lo:hi])
+        ids = hits if ids is None else ids & hits
+        if not ids:
+            return []
+    prefix = str(query).strip().lower()
+    best = heapq.nsmallest(limit, ids, key=lambda i: (not index["lower"][i].startswith(prefix), i))
+    return [index["names"][i] for i in best]
+
+
+def compatible(catalog, volume):
+    # Models of each sized category that cover volume litres, plus every
+    # compatible (pump, overflow) pair
+    fits = {
+        eq_type: [n for n, ok in zip(catalog["categories"][eq_type]["names"], max_volume >= volume) if ok]
+        for eq_type, max_volume in catalog["max_volume"].items()
+    }
+    pumps, overflows = catalog["categories"]["Return Pump"], catalog["categories"]["Overflow Type"]
+    fits["Return Pump + Overflow Type"] = [
+        (pumps["names"][i], overflows["names"][j]) for i, j in zip(*np.nonzero(catalog["pump_overflow"]))
+    ]
+    return fits
+
+
+def combinations(catalog, volume):
+    # Every heater x skimmer x (pump, overflow) combination suited to volume
+    fits = compatible(catalog, volume)
+    return [
+        {"Heater": h, "Skimmer": s, "Return Pump": p, "Overflow Type": o}
+        for h in fits["Heater"] for s in fits["Skimmer"] for p, o in fits["Return Pump + Overflow Type"]
+    ]
+
+
+def check(catalog, selected, volume):
+    # Mismatch notes for a tank's selected equipment; models without specs pass
+    notes = []
+    categories = catalog["categories"]
+
+    def find(eq_type):
+        model = selected.get(eq_type)
+        return model, categories[eq_type]["position"].get(model)
+
+    heater, i = find("Heater")
+    if i is not None and volume > catalog["max_volume"]["Heater"][i]:
+        notes.append(f"Heater '{heater}' may be underpowered for {volume}L.")
+    skimmer, i = find("Skimmer")
+    if i is not None and volume > catalog["max_volume"]["Skimmer"][i]:
+        rated = categories["Skimmer"]["values"][i]
+        notes.append(f"Skimmer '{skimmer}' is rated for {rated:g}L, which is under your tank volume.")
+    (pump, i), (overflow, j) = find("Return Pump"), find("Overflow Type")
+    if i is not None and j is not None and not catalog["pump_overflow"][i, j]:
+        limit = categories["Overflow Type"]["values"][j]
+        notes.append(f"Pump '{pump}' may exceed overflow capacity '{overflow}' ({limit:g} L/h).")
+    return notes
+
+
+def bundled_matches(catalog, mode=None, volume=None, tolerance=VOLUME_TOLERANCE):
+    # Bundled systems recommended for mode whose display + sump volume is
+    # within tolerance of volume, closest volume first
+    mask = np.ones(len(catalog["bundled"]), dtype=bool)
+    if mode:
+        mask &= catalog["bundled_mode"] == mode
+    if volume:
+        mask &= np.abs(catalog["bundled_volume"] - volume) <= volume * tolerance
+    order = np.flatnonzero(mask)
+    if volume:
+        order = order[np.argsort(np.abs(catalog["bundled_volume"][order] - volume), kind="stable")]
+    return [dict(catalog["bundled"][i], total_volume=float(catalog["bundled_volume"][i])) for i in order]
+
+
+if __name__ == "__main__":
+    # python equipment.py 280 [SPS] | python equipment.py search Heater "eheim 300"
+    if len(sys.argv) < 2 or (sys.argv[1] == "search" and len(sys.argv) < 3):
+        sys.exit('usage: python equipment.py VOLUME_L [MODE] | python equipment.py search TYPE "QUERY"')
+    if sys.argv[1] == "search":
+        for name in search(load_models()[sys.argv[2]], " ".join(sys.argv[3:])):
+            print(name)
+        sys.exit()
+    volume = float(sys.argv[1])
+    mode = sys.argv[2] if len(sys.argv) > 2 else None
+    catalog = load()
+    for eq_type, models in compatible(catalog, volume).items():
+        print(f"{eq_type}: {', '.join(map(str, models)) or 'none'}")
+    print(f"{len(combinations(catalog, volume))} compatible combinations for {volume:g} L")
+    for system in bundled_matches(catalog, mode, volume):
+        print(f"{system['brand']} {system['model']}: {system['total_volume']:g} L, {system['recommended_mode']}")
@@ -0,0 +1,103 @@
+import csv
+import io
+import os
+import tempfile
+
+import numpy as np
+
+import timeseries
+
+# Streaming export of tank history
+#
+# Exports are produced as generators of text chunks (CSV) or written array
+# by array (columnar .npz) into an anonymous temporary file, so large
+# histories are never built up as one string in memory. The app hands
+# st.download_button a callable that spools the file, so on Streamlit
+# versions with deferred downloads nothing is exported until the click.
+
+CHUNK_ROWS = 10000
+RECORD_FIELDS = {
+    "maintenance": ["Date", "Task", "Notes"],
+    "diary": ["Date", "Entry", "Image"],
+}
+
+
+def _csv_chunk(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue()
+
+
+def readings_csv(columns, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    # columns: {tank: reading columns}; one header over every tank's parameters
+    params = []
+    for cols in columns.values():
+        params += [p for p in cols["params"] if p not in params]
+    yield _csv_chunk([["Tank", "Date"] + params])
+    for tank, cols in columns.items():
+        cols = timeseries.window(cols, start, end)
+        dates = np.datetime_as_string(cols["timestamps"].astype("datetime64[s]"))
+        values = np.array([timeseries.series(cols, p) for p in params]).reshape(len(params), len(dates))
+        for lo in range(0, len(dates), chunk_rows):
+            block = values[:, lo:lo + chunk_rows].T.astype(object)
+            block[np.isnan(block.astype(np.float64))] = None
+            stamps = [d.replace("T", " ") for d in dates[lo:lo + chunk_rows]]
+            yield _csv_chunk([tank, stamp] + row for stamp, row in zip(stamps, block.tolist()))
+
+
+def _in_range(record, start, end):
+    stamp = str(record.get("Date", ""))
+    return (start is None or stamp >= str(start)) and (end is None or stamp[:len(str(end))] <= str(end))
+
+
+def records_csv(histories, collection, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    # histories: {tank: iterable of maintenance or diary records}
+    fields = RECORD_FIELDS[collection]
+    yield _csv_chunk([["Tank"] + fields])
+    rows = []
+    for tank, records in histories.items():
+        for record in records:
+            if not _in_range(record, start, end):
+                continue
+            rows.append([tank] + [record.get(f, "") for f in fields])
+            if len(rows) >= chunk_rows:
+                yield _csv_chunk(rows)
+                rows = []
+    if rows:
+        yield _csv_chunk(rows)
+
+
+def readings_npz(f, columns, start=None, end=None):
+    # Per tank: "<tank>/timestamps" (int64 epoch seconds), "<tank>/values"
+    # (float64, one row per parameter) and "<tank>/params"
+    arrays = {}
+    for tank, cols in columns.items():
+        cols = timeseries.window(cols, start, end)
+        arrays[f"{tank}/timestamps"] = cols["timestamps"]
+        arrays[f"{tank}/values"] = cols["values"]
+        arrays[f"{tank}/params"] = np.array(cols["params"], dtype=str)
+    np.savez_compressed(f, **arrays)
+
+
+def _reader(f):
+    # The finished temp file as a rewound read-only BufferedReader, a file
+    # type st.download_button takes directly
+    f.flush()
+    reader = os.fdopen(os.dup(f.fileno()), "rb")
+    f.close()
+    reader.seek(0)
+    return reader
+
+
+def spool(chunks):
+    # Collect text chunks into a binary temp file
+    f = tempfile.TemporaryFile()
+    for chunk in chunks:
+        f.write(chunk.encode("utf-8"))
+    return _reader(f)
+
+
+def spool_npz(columns, start=None, end=None):
+    f = tempfile.TemporaryFile()
+    readings_npz(f, columns, start, end)
+    return _reader(f)
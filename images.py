@@ -0,0 +1,85 @@
+import hashlib
+import os
+import threading
+
+# Image ingestion for profile and diary photos
+#
+# Uploads are copied to disk CHUNK_BYTES at a time while being hashed, and
+# stored as <sha256 prefix>.<ext>, so uploading the same photo twice keeps
+# one file and two different photos with the same name no longer collide.
+# Downscaled JPEG thumbnails live in <image dir>/thumbs and are what the
+# Overview and Diary show.
+
+CHUNK_BYTES = 1024 * 1024
+THUMB_DIR = "thumbs"
+PROFILE_SIZE = 1024
+DIARY_SIZE = 320
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+
+
+def _extension(name, path):
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            return EXTENSIONS.get(img.format, img.format.lower())
+    except (OSError, Image.DecompressionBombError):
+        ext = os.path.splitext(name or "")[1].lower().lstrip(".")
+        return "jpg" if ext == "jpeg" else ext or "bin"
+
+
+def ingest(upload, image_dir, thumb_sizes=(DIARY_SIZE,)):
+    # upload is any binary file object (e.g. st.file_uploader's result);
+    # returns the stored filename
+    os.makedirs(image_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp = os.path.join(image_dir, f".upload-{os.getpid()}-{id(upload)}.tmp")
+    with open(tmp, "wb") as f:
+        while True:
+            chunk = upload.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    filename = f"{digest.hexdigest()[:32]}.{_extension(getattr(upload, 'name', ''), tmp)}"
+    path = os.path.join(image_dir, filename)
+    if os.path.exists(path):
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+    for size in thumb_sizes:
+        thumbnail(filename, image_dir, size)
+    return filename
+
+
+def thumbnail_path(filename, image_dir, size):
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(image_dir, THUMB_DIR, f"{stem}_{size}.jpg")
+
+
+def thumbnail(filename, image_dir, size=DIARY_SIZE):
+    # Path of a JPEG no larger than size x size, created on first use. Falls
+    # back to the original if it cannot be decoded, or None if it is missing
+    # or too large to decode safely.
+    from PIL import Image, ImageOps
+
+    thumb = thumbnail_path(filename, image_dir, size)
+    if os.path.exists(thumb):
+        return thumb
+    original = os.path.join(image_dir, filename)
+    try:
+        with Image.open(original) as img:
+            # Let the JPEG decoder skip detail we are about to throw away
+            img.draft("RGB", (size, size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size))
+            os.makedirs(os.path.dirname(thumb), exist_ok=True)
+            tmp = f"{thumb}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.convert("RGB").save(tmp, "JPEG", quality=85)
+            os.replace(tmp, thumb)
+    except Image.DecompressionBombError:
+        # Too many pixels to decode safely, here or in the browser
+        return None
+    except (OSError, ValueError):
+        return original if os.path.exists(original) else None
+    return thumb
@@ -0,0 +1,204 @@
+import csv
+import io
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+# Streaming CSV import of parameter readings
+#
+# Rows are read CHUNK_ROWS at a time, so the file never has to fit in
+# memory. Each column is mapped once to a parameter name, each cell is
+# parsed once, rows whose timestamp is already logged (or repeated in the
+# file) are dropped, and the whole import is handed to the backend's
+# append_many() as one batch.
+
+CHUNK_ROWS = 5000
+DATE_COLUMNS = ("date", "datetime", "date time", "timestamp", "time")
+DATE_FORMATS = (
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%Y/%m/%d %H:%M:%S", "%Y/%m/%d",
+)
+# Common controller / test-kit column names, keyed by normalised name
+ALIASES = {
+    "temp": "Temperature (°C)",
+    "tmp": "Temperature (°C)",
+    "sg": "Salinity (SG)",
+    "salt": "Salinity (SG)",
+    "nh3": "Ammonia (ppm)",
+    "nh4": "Ammonia (ppm)",
+    "no2": "Nitrite (ppm)",
+    "no3": "Nitrate (ppm)",
+    "po4": "Phosphate (ppm)",
+    "ca": "Calcium (ppm)",
+    "alk": "Alkalinity (dKH)",
+    "kh": "Alkalinity (dKH)",
+    "dkh": "Alkalinity (dKH)",
+    "mg": "Magnesium (ppm)",
+}
+
+
+def _normalise(name):
+    # "Temperature (°C)" -> "temperature", " Alk_dKH " -> "alk dkh"
+    name = re.sub(r"\(.*?\)", "", str(name)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name).split())
+
+
+def map_columns(header, params, column_map=None):
+    # Returns (date column index, {column index: parameter}, unmapped names)
+    column_map = column_map or {}
+    by_name = {_normalise(p): p for p in params}
+    date_index, mapping, unmapped = None, {}, []
+    for i, column in enumerate(header):
+        key = _normalise(column)
+        if column in column_map:
+            mapping[i] = column_map[column]
+        elif column in params:
+            mapping[i] = column
+        elif key in DATE_COLUMNS and date_index is None:
+            date_index = i
+        elif key in by_name:
+            mapping[i] = by_name[key]
+        elif key in ALIASES and ALIASES[key] in params:
+            mapping[i] = ALIASES[key]
+        elif key.split(" ")[0] in ALIASES and ALIASES[key.split(" ")[0]] in params:
+            mapping[i] = ALIASES[key.split(" ")[0]]
+        else:
+            unmapped.append(column)
+    if date_index is None:
+        raise ValueError("CSV has no date/timestamp column")
+    return date_index, mapping, unmapped
+
+
+def _date_parser():
+    # Remembers the last format that worked, so a file is usually parsed
+    # with a single strptime per row
+    last = [DATE_FORMATS[0]]
+
+    def parse(text):
+        text = text.strip()
+        try:
+            return datetime.strptime(text, last[0]).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            pass
+        for fmt in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            last[0] = fmt
+            return parsed.strftime("%Y-%m-%d %H:%M:%S")
+        return None
+    return parse
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def read_chunks(f, params, column_map=None, existing=(), report=None, chunk_rows=CHUNK_ROWS):
+    # Yields lists of reading records; report (a dict) collects counts
+    report = report if report is not None else {}
+    report.update({"rows": 0, "imported": 0, "duplicates": 0, "skipped": 0})
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    date_index, mapping, report["unmapped"] = map_columns(header, params, column_map)
+    parse_date = _date_parser()
+    seen = set(existing)
+    chunk = []
+    for row in reader:
+        report["rows"] += 1
+        stamp = parse_date(row[date_index]) if date_index < len(row) else None
+        if stamp is None:
+            report["skipped"] += 1
+            continue
+        if stamp in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(stamp)
+        record = {"Date": stamp}
+        for i, param in mapping.items():
+            if i < len(row) and row[i].strip():
+                value = _number(row[i])
+                if value is not None:
+                    record[param] = value
+        if len(record) == 1:
+            report["skipped"] += 1
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_rows:
+            chunk.sort(key=lambda r: r["Date"])
+            report["imported"] += len(chunk)
+            yield chunk
+            chunk = []
+    if chunk:
+        chunk.sort(key=lambda r: r["Date"])
+        report["imported"] += len(chunk)
+        yield chunk
+
+
+def import_csv(f, tank_name, params, backend, path, existing=(), column_map=None, chunk_rows=CHUNK_ROWS):
+    # f is a text file object or a path; returns the import report
+    if isinstance(f, str):
+        with open(f, "r", newline="", encoding="utf-8-sig") as fh:
+            return import_csv(fh, tank_name, params, backend, path, existing, column_map, chunk_rows)
+    if isinstance(f, (io.BufferedIOBase, io.RawIOBase)):
+        f = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+    report = {}
+    start = time.perf_counter()
+    chunks = read_chunks(f, params, column_map, existing, report, chunk_rows)
+    backend.append_many(path, tank_name, "data", (record for chunk in chunks for record in chunk))
+    report["seconds"] = time.perf_counter() - start
+    report["rows_per_sec"] = report["rows"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+
+if __name__ == "__main__":
+    # python importer.py readings.csv "Tank 1" [reef_data.json | reef_data.db | reef_shards/manifest.json]
+    import storage
+    import timeseries
+
+    src, tank_name = sys.argv[1], sys.argv[2]
+    path = sys.argv[3] if len(sys.argv) > 3 else "reef_data.json"
+    if path.endswith(".db") or os.path.basename(path) == "manifest.json":
+        if path.endswith(".db"):
+            import sqlite_store as backend
+        else:
+            import shard_store as backend
+        if tank_name not in backend.load(path, with_history=False)[0]:
+            sys.exit(f"No tank named {tank_name!r} in {path}")
+        existing = backend.timestamps(path, tank_name)
+        params = {p for r in backend.readings(path, tank_name) for p in r if p != "Date"}
+    else:
+        backend = storage
+        tanks, _ = storage.load(path)
+        if tank_name not in tanks:
+            sys.exit(f"No tank named {tank_name!r} in {path}")
+        data = tanks.get(tank_name, {}).get("data", [])
+        existing = {str(r.get("Date")) for r in data}
+        params = {p for r in data for p in r if p != "Date"}
+    params |= set(ALIASES.values())
+    report = import_csv(src, tank_name, sorted(params), backend, path, existing)
+    # Imported rows can land anywhere in the history; the app's columns are
+    # rebuilt from the store on its next read
+    if report["imported"]:
+        timeseries.discard(timeseries.COLUMNS_DIR, tank_name)
+    if backend is storage and report["imported"]:
+        # Imported rows were journaled after the existing ones; store the
+        # tank in date order, as the app does
+        tanks, custom_modes = storage.load(path)
+        tanks[tank_name]["data"].sort(key=lambda r: str(r.get("Date")))
+        storage.save(path, tanks, custom_modes)
+    print(
+        f"{report['imported']} of {report['rows']} rows imported into {tank_name} "
+        f"({report['duplicates']} duplicates, {report['skipped']} skipped) "
+        f"at {report['rows_per_sec']:.0f} rows/s"
+    )
+    if report.get("unmapped"):
+        print("Unmapped columns: " + ", ".join(report["unmapped"]))
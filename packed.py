@@ -0,0 +1,321 @@
+import json
+import lzma
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+# Compact binary format for tank documents (reef_data.reef)
+#
+# Holds the same {"tanks", "custom_modes"} document as reef_data.json.
+# A fixed header (magic, format version, compression, body length) is
+# followed by the body, optionally zlib or lzma compressed. The body is a
+# compact JSON header plus 8-byte aligned arrays:
+#
+# - readings become one int64 timestamp per row (or a string id when a
+#   tank's dates are not all "YYYY-MM-DD[ HH:MM:SS]"), a presence bitmap
+#   and a float64 column per parameter. A tank whose readings hold text, as
+#   the app's form stores them ("8.1", ""), is flagged as such: numbers
+#   that format back to the same text go in the columns and a second bitmap
+#   marks the blanks
+# - parameter names, record keys and free-form dates are interned in a
+#   single string table
+# - maintenance and diary entries are stored as rows of values under
+#   their tank's shared keys
+#
+# Records that do not fit (a reading whose Date is not its first, text
+# value, or whose values are not all floats, or all numeric / blank text in
+# a text tank; an entry whose keys differ from the first entry's) are kept
+# whole in the header at their position, so every document round-trips
+# exactly.
+
+MAGIC = b"REEFPACK"
+# 2 added text-valued readings; version 1 files still read
+VERSION = 2
+EXTENSION = ".reef"
+# none, zlib or lzma for new files; reading handles all three
+COMPRESSION = os.environ.get("REEF_COMPRESSION", "zlib")
+CODECS = {"none": 0, "zlib": 1, "lzma": 2}
+FIXED = struct.Struct("<HBxQ")  # version, codec, body length
+COLLECTIONS = ("data", "maintenance", "diary")
+DATE_FORMATS = {"datetime": ("s", 19), "date": ("D", 10)}
+FLOAT = {float}
+
+
+def _intern(strings, value):
+    # strings is {"table": [...], "ids": {value: index}}
+    if value not in strings["ids"]:
+        strings["ids"][value] = len(strings["table"])
+        strings["table"].append(value)
+    return strings["ids"][value]
+
+
+def _align(chunks, size):
+    pad = -size % 8
+    if pad:
+        chunks.append(b"\0" * pad)
+    return size + pad
+
+
+# Encoding
+
+def _date_kind(dates):
+    # Dates as int64 when every one is an ISO date or timestamp that
+    # formats back to exactly the same text
+    for kind, (unit, length) in DATE_FORMATS.items():
+        if any(len(d) != length for d in dates):
+            continue
+        try:
+            stamps = np.array(dates, dtype=f"datetime64[{unit}]")
+        except ValueError:
+            continue
+        text = np.char.replace(np.datetime_as_string(stamps, unit=unit), "T", " ")
+        if (text == np.array(dates)).all():
+            return kind, stamps.astype(np.int64)
+    return None, None
+
+
+def _text(value):
+    # The text a number is written back as; "8.1", "8", "1.025"
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def _numbers(values):
+    # Text values as floats (NaN for blanks), or None unless each one is
+    # blank or formats back to exactly the same text
+    out = []
+    for v in values:
+        if type(v) is not str:
+            return None
+        if v == "":
+            out.append(np.nan)
+            continue
+        try:
+            number = float(v)
+        except ValueError:
+            return None
+        # NaN is kept for blanks
+        if number != number or _text(number) != v:
+            return None
+        out.append(number)
+    return out
+
+
+def _text_valued(records):
+    # A tank is text-valued when its first reading with values holds text
+    for record in records:
+        values = list(record.values())[1:]
+        if values:
+            return type(values[0]) is str
+    return False
+
+
+def _pack_readings(records, strings, chunks, offset):
+    # Rows are grouped by their parameter keys, so each group's values go
+    # into the columns with one array conversion
+    groups, dates, irregular = {}, [], []
+    text = _text_valued(records)
+    for i, record in enumerate(records):
+        keys = tuple(record)
+        values = list(record.values())
+        # Date first, as text, and every other value a float (or in a text
+        # tank, numeric or blank text)
+        if not keys or keys[0] != "Date" or type(values[0]) is not str:
+            irregular.append([i, record])
+            continue
+        if text:
+            numbers = _numbers(values[1:])
+        else:
+            numbers = values[1:] if set(map(type, values[1:])) <= FLOAT else None
+        if numbers is None:
+            irregular.append([i, record])
+            continue
+        group = groups.setdefault(keys[1:], ([], []))
+        group[0].append(len(dates))
+        group[1].extend(numbers)
+        dates.append(values[0])
+    index = {}
+    for keys in groups:
+        for key in keys:
+            index.setdefault(key, len(index))
+    params, rows = list(index), len(dates)
+    values = np.full((len(params), rows), np.nan)
+    present = np.zeros((len(params), rows), dtype=bool)
+    for keys, (positions, flat) in groups.items():
+        cells = np.ix_([index[k] for k in keys], positions)
+        values[cells] = np.array(flat, dtype=np.float64).reshape(len(positions), len(keys)).T
+        present[cells] = True
+    kind, stamps = _date_kind(dates) if rows else ("datetime", np.empty(0, dtype=np.int64))
+    if kind is None:
+        kind, stamps = "text", np.array([_intern(strings, d) for d in dates], dtype=np.int64)
+    arrays = [stamps.astype("<i8"), np.packbits(present.ravel())]
+    if text:
+        arrays.append(np.packbits((present & np.isnan(values)).ravel()))
+    arrays.append(values.astype("<f8"))
+    start = offset
+    for array in arrays:
+        data = array.tobytes()
+        chunks.append(data)
+        offset = _align(chunks, offset + len(data))
+    return {
+        "rows": rows,
+        "params": [_intern(strings, p) for p in params],
+        "dates": kind,
+        "values": "text" if text else "float",
+        "offset": start,
+        "irregular": irregular,
+    }, offset
+
+
+def _pack_records(records, strings):
+    keys = list(records[0]) if records else []
+    rows, irregular = [], []
+    for i, record in enumerate(records):
+        if list(record) == keys:
+            rows.append([record[k] for k in keys])
+        else:
+            irregular.append([i, record])
+    return {"keys": [_intern(strings, k) for k in keys], "rows": rows, "irregular": irregular}
+
+
+def encode(tanks, custom_modes, compression=COMPRESSION):
+    strings = {"table": [], "ids": {}}
+    chunks, offset = [], 0
+    packed = {}
+    for name, tank in tanks.items():
+        entry = {"meta": {k: v for k, v in tank.items() if k not in COLLECTIONS}, "collections": {}}
+        for collection in COLLECTIONS:
+            if collection not in tank:
+                continue
+            if collection == "data":
+                entry["collections"][collection], offset = _pack_readings(tank[collection], strings, chunks, offset)
+            else:
+                entry["collections"][collection] = _pack_records(tank[collection], strings)
+        packed[name] = entry
+    header = json.dumps(
+        {"strings": strings["table"], "tanks": packed, "custom_modes": custom_modes},
+        separators=(",", ":"), default=str
+    ).encode()
+    prefix = struct.pack("<I", len(header)) + header
+    body = prefix + b"\0" * (-len(prefix) % 8) + b"".join(chunks)
+    if compression == "zlib":
+        data = zlib.compress(body, 6)
+    elif compression == "lzma":
+        data = lzma.compress(body)
+    else:
+        data = body
+    return MAGIC + FIXED.pack(VERSION, CODECS[compression], len(body)) + data
+
+
+# Decoding
+
+def _bitmap(arrays, offset, bits, params, rows):
+    flags = np.unpackbits(np.frombuffer(arrays, dtype=np.uint8, count=-(-bits // 8), offset=offset))[:bits]
+    offset += -(-bits // 8)
+    return flags.reshape(params, rows).astype(bool), offset + (-offset % 8)
+
+
+def _unpack_readings(spec, strings, arrays):
+    rows, params = spec["rows"], [strings[i] for i in spec["params"]]
+    offset = spec["offset"]
+    stamps = np.frombuffer(arrays, dtype="<i8", count=rows, offset=offset)
+    offset += 8 * rows
+    bits = len(params) * rows
+    present, offset = _bitmap(arrays, offset, bits, len(params), rows)
+    text = spec.get("values") == "text"
+    if text:
+        blank, offset = _bitmap(arrays, offset, bits, len(params), rows)
+    values = np.frombuffer(arrays, dtype="<f8", count=bits, offset=offset).reshape(len(params), rows)
+    if spec["dates"] == "text":
+        dates = [strings[i] for i in stamps.tolist()]
+    else:
+        unit = DATE_FORMATS[spec["dates"]][0]
+        dates = [d.replace("T", " ") for d in np.datetime_as_string(stamps.astype(f"datetime64[{unit}]"), unit=unit).tolist()]
+    keys = ("Date", *params)
+    columns = values.tolist()
+    if text:
+        columns = [["" if b else _text(v) for v, b in zip(column, flags)] for column, flags in zip(columns, blank.tolist())]
+    records = [dict(zip(keys, row)) for row in zip(dates, *columns)]
+    if not present.all():
+        # Drop the parameters a reading did not have
+        for j in np.flatnonzero(~present.all(axis=0)).tolist():
+            records[j] = {k: v for k, v, ok in zip(keys, records[j].values(), (True, *present[:, j].tolist())) if ok}
+    return _restore(records, spec["irregular"])
+
+
+def _unpack_records(spec, strings):
+    keys = [strings[i] for i in spec["keys"]]
+    return _restore([dict(zip(keys, row)) for row in spec["rows"]], spec["irregular"])
+
+
+def _restore(records, irregular):
+    for i, record in irregular:
+        records.insert(i, record)
+    return records
+
+
+def decode(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a packed tank file")
+    version, codec, length = FIXED.unpack_from(data, len(MAGIC))
+    if version > VERSION:
+        raise ValueError(f"packed tank file version {version} is newer than supported ({VERSION})")
+    body = memoryview(data)[len(MAGIC) + FIXED.size:]
+    if codec == CODECS["zlib"]:
+        body = zlib.decompress(body)
+    elif codec == CODECS["lzma"]:
+        body = lzma.decompress(body)
+    size = struct.unpack_from("<I", body)[0]
+    header = json.loads(bytes(body[4:4 + size]))
+    start = 4 + size
+    arrays = memoryview(body)[start + (-start % 8):]
+    strings = header["strings"]
+    tanks = {}
+    for name, entry in header["tanks"].items():
+        tank = dict(entry["meta"])
+        for collection, spec in entry["collections"].items():
+            if collection == "data":
+                tank[collection] = _unpack_readings(spec, strings, arrays)
+            else:
+                tank[collection] = _unpack_records(spec, strings)
+        tanks[name] = tank
+    return tanks, header["custom_modes"]
+
+
+# Files
+
+def is_packed(path):
+    return path.endswith(EXTENSION)
+
+
+def dump(f, tanks, custom_modes, compression=COMPRESSION):
+    f.write(encode(tanks, custom_modes, compression))
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return decode(f.read())
+
+
+def convert(src, dst, compression=COMPRESSION):
+    # Either direction, by extension, including any pending journal entries
+    import storage
+
+    tanks, custom_modes = storage.load(src)
+    if is_packed(dst):
+        with storage.locked(dst):
+            storage.write_atomic(dst, lambda f: dump(f, tanks, custom_modes, compression), binary=True)
+    else:
+        storage.save(dst, tanks, custom_modes)
+    return os.path.getsize(src), os.path.getsize(dst)
+
+
+if __name__ == "__main__":
+    # python packed.py reef_data.json reef_data.reef [zlib|lzma|none]
+    src = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0] + (".json" if is_packed(src) else EXTENSION)
+    before, after = convert(src, dst, sys.argv[3] if len(sys.argv) > 3 else COMPRESSION)
+    print(f"{src} ({before:,} bytes) -> {dst} ({after:,} bytes)")
@@ -0,0 +1,504 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import importer
+import stats
+import storage
+from utils import default_modes
+
+# Probe ingestion service
+#
+# A small asyncio HTTP server on localhost for controllers that log
+# readings every few seconds:
+#
+#   POST /readings  {"tank": "Tank 1", "readings": [{"Date": "...", "Temp": 25.1, "pH": 8.2}]}
+#   GET  /metrics   throughput, batching and back-pressure counters
+#
+# Parameter names are matched to the tank's mode (default_modes plus custom
+# modes) the way importer.py matches CSV columns, so "Temp" or "alk" are
+# accepted; a request with an unknown tank, parameter or value is rejected
+# as a whole. Accepted readings are buffered in memory and written with the
+# backend's append_many() once BATCH_SIZE are pending or the oldest has
+# waited FLUSH_SECONDS. While MAX_PENDING readings are buffered, requests
+# wait for a flush to make room and get 503 after WAIT_SECONDS. A failed
+# flush keeps the readings not yet written and retries with a growing delay;
+# on shutdown, after STOP_ATTEMPTS failures the rest is dumped to a file.
+#
+# fake_controller() drives the service like a probe, and check()
+# runs both against a scratch store and confirms every reading was written.
+
+HOST = "127.0.0.1"
+PORT = 8765
+BATCH_SIZE = 500
+FLUSH_SECONDS = 2.0
+MAX_PENDING = 10000
+WAIT_SECONDS = 5.0
+MAX_BODY = 1024 * 1024
+REFRESH_SECONDS = 5.0
+# Failed flushes back off up to this long; once stopping, the buffer is
+# dumped to a file after this many failures in a row
+MAX_BACKOFF_SECONDS = 30.0
+STOP_ATTEMPTS = 3
+STATUS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+def backend_for(path):
+    # Same file naming as the app: reef_data.db, reef_shards/manifest.json,
+    # otherwise the JSON / packed snapshot
+    if path.endswith(".db"):
+        import sqlite_store
+        return sqlite_store
+    if os.path.basename(path) == "manifest.json":
+        import shard_store
+        return shard_store
+    return storage
+
+
+def _lazy(backend):
+    return backend is not storage
+
+
+# Schema and validation
+
+def _load_schema(path, backend):
+    # {tank: (mode, [allowed parameters])}
+    if _lazy(backend):
+        tanks, custom_modes = backend.load(path, with_history=False)
+    else:
+        tanks, custom_modes = backend.load(path)
+    modes = {**default_modes, **custom_modes}
+    return {name: (t.get("mode"), list(modes.get(t.get("mode"), {}))) for name, t in tanks.items()}
+
+
+async def _schema(state, tank_name):
+    # Reloaded when an unknown tank is named, at most every REFRESH_SECONDS
+    now = time.monotonic()
+    if tank_name not in state["schema"] and now - state["schema_loaded"] >= REFRESH_SECONDS:
+        state["schema"] = await asyncio.to_thread(_load_schema, state["path"], state["backend"])
+        state["schema_loaded"] = now
+        state["columns"].clear()
+    return state["schema"].get(tank_name)
+
+
+def _columns(state, tank_name, params, keys):
+    # {key: parameter} for a reading's keys, cached per tank and key set
+    cache_key = (tank_name, keys)
+    if cache_key not in state["columns"]:
+        _, mapping, unmapped = importer.map_columns(("Date",) + keys, params)
+        state["columns"][cache_key] = ({keys[i - 1]: p for i, p in mapping.items()}, unmapped)
+    return state["columns"][cache_key]
+
+
+async def validate(state, body):
+    # (tank, [records]) or raises ValueError with the reason
+    if not isinstance(body, dict) or not isinstance(body.get("tank"), str):
+        raise ValueError('expected {"tank": name, "readings": [...]}')
+    tank_name, readings = body["tank"], body.get("readings")
+    if not isinstance(readings, list) or not all(isinstance(r, dict) for r in readings):
+        raise ValueError("readings must be a list of objects")
+    schema = await _schema(state, tank_name)
+    if schema is None:
+        raise ValueError(f"unknown tank {tank_name!r}")
+    mode, params = schema
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    records = []
+    for reading in readings:
+        keys = tuple(k for k in reading if k != "Date")
+        mapping, unmapped = _columns(state, tank_name, params, keys)
+        if unmapped:
+            raise ValueError(f"{', '.join(unmapped)} not in the {mode} parameters")
+        stamp = state["parse_date"](str(reading["Date"])) if "Date" in reading else now
+        if stamp is None:
+            raise ValueError(f"unrecognised date {reading['Date']!r}")
+        record = {"Date": stamp}
+        for key in keys:
+            value = reading[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"{key} must be a number")
+            record[mapping[key]] = float(value)
+        if len(record) > 1:
+            records.append(record)
+    return tank_name, records
+
+
+# Buffering and flushing
+
+def new_state(path, backend=None):
+    return {
+        "path": path,
+        "backend": backend or backend_for(path),
+        "schema": {},
+        "schema_loaded": float("-inf"),
+        "columns": {},
+        "parse_date": importer._date_parser(),
+        "buffer": {},
+        "pending": 0,
+        "oldest": None,
+        "stale_stats": set(),
+        "failures": 0,
+        "wake": asyncio.Event(),
+        "stopping": False,
+        "drained": asyncio.Event(),
+        "started": time.monotonic(),
+        "metrics": {
+            "requests": 0, "rejected": 0, "accepted": 0, "flushed": 0, "batches": 0,
+            "flush_seconds": 0.0, "last_batch": 0, "max_pending": 0,
+            "backpressure_waits": 0, "backpressure_rejects": 0, "flush_errors": 0,
+        },
+    }
+
+
+async def add(state, tank_name, records):
+    # Buffer records, waiting while the buffer is full; False if it stays full
+    metrics = state["metrics"]
+    deadline = time.monotonic() + WAIT_SECONDS
+    while state["pending"] and state["pending"] + len(records) > MAX_PENDING:
+        metrics["backpressure_waits"] += 1
+        state["drained"].clear()
+        state["wake"].set()
+        try:
+            await asyncio.wait_for(state["drained"].wait(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            metrics["backpressure_rejects"] += 1
+            return False
+    state["buffer"].setdefault(tank_name, []).extend(records)
+    state["pending"] += len(records)
+    if state["oldest"] is None:
+        state["oldest"] = time.monotonic()
+    metrics["accepted"] += len(records)
+    metrics["max_pending"] = max(metrics["max_pending"], state["pending"])
+    if state["pending"] >= BATCH_SIZE:
+        state["wake"].set()
+    return True
+
+
+def _store_stats(path, backend, tank_name, records=None):
+    # Fold records into the tank's stored rolling statistics, or rebuild them
+    # from its stored history when records is None
+    tanks, custom_modes = backend.load(path, with_history=False)
+    tank = tanks.get(tank_name)
+    if tank is None:
+        return
+    base = storage.base_of(tanks, custom_modes)
+    if records is None:
+        tank["reading_stats"] = stats.rebuild(backend.readings(path, tank_name))
+    else:
+        reading_stats = tank.setdefault("reading_stats", stats.empty())
+        for record in records:
+            stats.update(reading_stats, record)
+    backend.put_tank(path, tank_name, tank, base=base)
+
+
+def write_batch(path, backend, batch, stale=None):
+    # One append_many per tank; lazy backends also get the tank's rolling
+    # statistics updated, as the app only rebuilds them when missing. Each
+    # tank leaves the batch once its readings are written, so after a
+    # failure the batch holds only what still needs writing. A tank stays in
+    # stale from then until its statistics are stored, and a later call
+    # rebuilds them from the stored history.
+    stale = set() if stale is None else stale
+    for tank_name in list(batch):
+        records = batch[tank_name]
+        records.sort(key=lambda r: r["Date"])
+        backend.append_many(path, tank_name, "data", records)
+        del batch[tank_name]
+        if _lazy(backend) and tank_name not in stale:
+            stale.add(tank_name)
+            _store_stats(path, backend, tank_name, records)
+            stale.discard(tank_name)
+    if _lazy(backend):
+        for tank_name in list(stale):
+            _store_stats(path, backend, tank_name)
+            stale.discard(tank_name)
+
+
+def _dump(state):
+    # Write what is still buffered to a JSON lines file next to the store;
+    # returns its path
+    dump_path = f"{state['path']}.unflushed-{int(time.time())}.jsonl"
+    with open(dump_path, "a") as f:
+        for tank_name, records in state["buffer"].items():
+            for record in records:
+                f.write(json.dumps({"tank": tank_name, "record": record}) + "\n")
+    return dump_path
+
+
+async def flush(state):
+    if not state["pending"] and not state["stale_stats"]:
+        return
+    batch, count = state["buffer"], state["pending"]
+    state["buffer"], state["pending"], state["oldest"] = {}, 0, None
+    metrics = state["metrics"]
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(write_batch, state["path"], state["backend"], batch, state["stale_stats"])
+    except Exception as e:
+        # Keep the readings not yet written for the next attempt rather than
+        # dropping them, backing off while the failures continue
+        metrics["flush_errors"] += 1
+        state["failures"] += 1
+        print(f"Flush failed, will retry: {e}", file=sys.stderr)
+        left = 0
+        for tank_name, records in batch.items():
+            state["buffer"].setdefault(tank_name, [])[:0] = records
+            left += len(records)
+        state["pending"] += left
+        metrics["flushed"] += count - left
+        state["oldest"] = state["oldest"] or time.monotonic()
+        await asyncio.sleep(min(FLUSH_SECONDS * 2 ** (state["failures"] - 1), MAX_BACKOFF_SECONDS))
+        return
+    state["failures"] = 0
+    metrics["flush_seconds"] += time.perf_counter() - start
+    metrics["flushed"] += count
+    metrics["batches"] += 1
+    metrics["last_batch"] = count
+    state["drained"].set()
+
+
+async def flusher(state):
+    # Flushes on BATCH_SIZE (or back-pressure) wake-ups and on FLUSH_SECONDS
+    # age, and everything still buffered once stopping is set; if that keeps
+    # failing, it is dumped to a file after STOP_ATTEMPTS attempts
+    while True:
+        timeout = FLUSH_SECONDS
+        if state["oldest"] is not None:
+            timeout = max(state["oldest"] + FLUSH_SECONDS - time.monotonic(), 0)
+        try:
+            await asyncio.wait_for(state["wake"].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        state["wake"].clear()
+        await flush(state)
+        if state["stopping"] and not state["pending"] and not state["stale_stats"]:
+            return
+        if state["stopping"] and state["failures"] >= STOP_ATTEMPTS:
+            # Give up rather than hang the shutdown on a store that keeps failing
+            if state["pending"]:
+                print(f"Could not write {state['pending']} readings, saved to {_dump(state)}", file=sys.stderr)
+            if state["stale_stats"]:
+                print(f"Rolling statistics not updated for {', '.join(sorted(state['stale_stats']))}", file=sys.stderr)
+            return
+
+
+def metrics(state):
+    m = dict(state["metrics"])
+    uptime = time.monotonic() - state["started"]
+    m.update({
+        "pending": state["pending"],
+        "uptime_s": uptime,
+        "accepted_per_s": m["accepted"] / uptime if uptime else 0.0,
+        "flushed_per_s": m["flushed"] / uptime if uptime else 0.0,
+        "flush_ms_per_batch": 1000 * m["flush_seconds"] / m["batches"] if m["batches"] else 0.0,
+    })
+    return m
+
+
+# HTTP
+
+async def _respond(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+
+async def _route(state, method, target, body):
+    if method == "GET" and target == "/metrics":
+        return 200, metrics(state)
+    if method != "POST" or target != "/readings":
+        return 404, {"error": f"no route for {method} {target}"}
+    state["metrics"]["requests"] += 1
+    try:
+        tank_name, records = await validate(state, json.loads(body or b"null"))
+    except ValueError as e:
+        state["metrics"]["rejected"] += 1
+        return 400, {"error": str(e)}
+    if not await add(state, tank_name, records):
+        return 503, {"error": "ingest buffer full, retry later", "pending": state["pending"]}
+    return 202, {"accepted": len(records), "pending": state["pending"]}
+
+
+async def handle(state, reader, writer):
+    # HTTP/1.1 with keep-alive, one request at a time per connection
+    try:
+        while True:
+            request = await reader.readline()
+            if not request:
+                break
+            method, target, _ = (request.decode("latin-1").split() + ["", "", ""])[:3]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = headers.get("connection", "").lower() != "close"
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                await _respond(writer, 400, {"error": "invalid Content-Length"}, keep_alive=False)
+                break
+            if length > MAX_BODY:
+                await _respond(writer, 413, {"error": f"body over {MAX_BODY} bytes"}, keep_alive=False)
+                break
+            body = await reader.readexactly(length) if length else b""
+            status, payload = await _route(state, method, target, body)
+            await _respond(writer, status, payload, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(path, host=HOST, port=PORT, ready=None):
+    # Runs until cancelled; buffered readings are flushed on the way out
+    state = new_state(path)
+    server = await asyncio.start_server(lambda r, w: handle(state, r, w), host, port)
+    task = asyncio.create_task(flusher(state))
+    if ready is not None:
+        ready.set_result((state, server.sockets[0].getsockname()[1]))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        state["stopping"] = True
+        state["wake"].set()
+        await task
+
+
+# Fake controllers
+
+async def _post(reader, writer, payload):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"POST /readings HTTP/1.1\r\nHost: {HOST}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def fake_controller(tank_name, ranges, readings, port=PORT, per_request=10, interval=0.0, seed=0):
+    # One probe logging readings for tank_name with values inside ranges,
+    # per_request at a time on one keep-alive connection; returns
+    # {"sent", "accepted", "retries"}
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(HOST, port)
+    start = datetime(2025, 1, 1) + timedelta(days=seed)
+    result = {"sent": 0, "accepted": 0, "retries": 0}
+    try:
+        for n in range(0, readings, per_request):
+            batch = [
+                {"Date": (start + timedelta(seconds=5 * i)).strftime("%Y-%m-%d %H:%M:%S"),
+                 **{p: round(rng.uniform(low, high), 3) for p, (low, high) in ranges.items()}}
+                for i in range(n, min(n + per_request, readings))
+            ]
+            while True:
+                status, payload = await _post(reader, writer, {"tank": tank_name, "readings": batch})
+                if status != 503:
+                    break
+                result["retries"] += 1
+                await asyncio.sleep(0.1)
+            if status != 202:
+                raise RuntimeError(f"{tank_name}: {status} {payload.get('error')}")
+            result["sent"] += len(batch)
+            result["accepted"] += payload["accepted"]
+            if interval:
+                await asyncio.sleep(interval)
+    finally:
+        writer.close()
+    return result
+
+
+async def _check(path, controllers, readings, per_request):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    server = asyncio.create_task(serve(path, port=0, ready=ready))
+    state, port = await ready
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        fake_controller(f"Probe {c}", default_modes["SPS"], readings, port, per_request, seed=c)
+        for c in range(controllers)
+    ))
+    elapsed = time.perf_counter() - start
+    server.cancel()
+    try:
+        await server
+    except asyncio.CancelledError:
+        pass
+    return results, metrics(state), elapsed
+
+
+def check(path, controllers=8, readings=2000, per_request=20):
+    # Runs fake controllers against a scratch store; returns (problems, metrics)
+    backend = backend_for(path)
+    tanks = {f"Probe {c}": {"mode": "SPS", "data": [], "maintenance": [], "diary": []} for c in range(controllers)}
+    backend.save(path, tanks, {})
+    results, totals, elapsed = asyncio.run(_check(path, controllers, readings, per_request))
+    totals["elapsed_s"] = elapsed
+    if _lazy(backend):
+        stored = {name: backend.readings(path, name) for name in tanks}
+    else:
+        stored = {name: t["data"] for name, t in backend.load(path)[0].items()}
+    problems = []
+    for c, result in enumerate(results):
+        name = f"Probe {c}"
+        if result["accepted"] != readings:
+            problems.append(f"{name}: {result['accepted']} of {readings} readings accepted")
+        if len(stored.get(name, [])) != readings:
+            problems.append(f"{name}: {len(stored.get(name, []))} readings stored, expected {readings}")
+    return problems, totals
+
+
+if __name__ == "__main__":
+    # python probe_service.py serve [reef_data.json | reef_data.db | reef_shards/manifest.json] [port]
+    # python probe_service.py check [journal|sqlite|sharded] [controllers] [readings per controller]
+    import tempfile
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if command == "serve":
+        path = sys.argv[2] if len(sys.argv) > 2 else "reef_data.json"
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else PORT
+        print(f"Ingesting into {path} on http://{HOST}:{port}/readings")
+        try:
+            asyncio.run(serve(path, port=port))
+        except KeyboardInterrupt:
+            pass
+    elif command == "check":
+        backend_name = sys.argv[2] if len(sys.argv) > 2 else "journal"
+        controllers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+        readings = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+        with tempfile.TemporaryDirectory() as tmp:
+            name = {"sqlite": "reef_data.db", "sharded": "reef_shards/manifest.json"}.get(backend_name, "reef_data.json")
+            problems, totals = check(os.path.join(tmp, name), controllers, readings)
+        print(
+            f"{controllers} controllers x {readings} readings into {backend_name} in {totals['elapsed_s']:.1f}s: "
+            f"{totals['accepted_per_s']:.0f} readings/s accepted, {totals['batches']} batches "
+            f"({totals['flush_ms_per_batch']:.1f} ms each), max {totals['max_pending']} pending, "
+            f"{totals['backpressure_waits']} back-pressure waits: " + ("OK" if not problems else f"{len(problems)} problems")
+        )
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1 if problems else 0)
+    else:
+        sys.exit(f"unknown command {command!r}")
@@ -0,0 +1,212 @@
+import functools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Startup and per-rerun profiling
+#
+# import_profile() runs a fresh interpreter with -X importtime and reports
+# how long each top-level import took, including everything it pulled in.
+# cold_start() runs the app once under Streamlit's AppTest in a fresh
+# process and reports the first and second script run times, plus which of
+# the deferred heavy modules that run ended up importing.
+#
+# Within the app, start_rerun() opens a record for the current script run
+# (one per session thread). timed() sections and @profiled functions add
+# wall time, call counts and bytes read/written (from /proc/self/io, so
+# process-wide) to it, and finish_rerun() returns the totals and appends
+# them to a JSON-lines log. Outside a recorded rerun they cost one
+# attribute lookup.
+
+APP = "reef_tank_tracker_app.py"
+# Imported by the app at startup
+STARTUP_MODULES = [
+    "streamlit", "numpy", "utils", "storage", "packed", "sqlite_store", "timeseries", "alerts", "stats",
+    "importer", "exporter", "equipment", "chart_cache", "images", "retention", "anomalies",
+]
+# Only imported by the tabs and actions that need them
+DEFERRED_MODULES = ["pandas", "matplotlib.figure", "fpdf", "PIL.Image"]
+LOG_FILE = os.environ.get("REEF_PROFILE_LOG", "profile_log.jsonl")
+
+_local = threading.local()
+
+
+# Per-rerun instrumentation
+
+def enabled(flag=None):
+    # REEF_PROFILE=1 for every session, or ?profile=1 in the URL for one
+    return os.environ.get("REEF_PROFILE") == "1" or flag == "1"
+
+
+def _io():
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def start_rerun():
+    _local.rerun = {"started": time.time(), "start": time.perf_counter(), "io": _io(), "sections": {}}
+
+
+def current():
+    return getattr(_local, "rerun", None)
+
+
+@contextmanager
+def timed(name):
+    rerun = current()
+    if rerun is None:
+        yield
+        return
+    read, written = _io()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        read_after, written_after = _io()
+        row = rerun["sections"].setdefault(name, {"calls": 0, "seconds": 0.0, "bytes_read": 0, "bytes_written": 0})
+        row["calls"] += 1
+        row["seconds"] += seconds
+        row["bytes_read"] += read_after - read
+        row["bytes_written"] += written_after - written
+
+
+def profiled(name=None):
+    # Decorator form of timed(), named after the function by default
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if current() is None:
+                return fn(*args, **kwargs)
+            with timed(label):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def finish_rerun(log_path=LOG_FILE, extra=None):
+    # Close the current record; sections are inclusive of nested ones and
+    # sorted slowest first
+    rerun = current()
+    if rerun is None:
+        return None
+    _local.rerun = None
+    read, written = _io()
+    report = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(rerun["started"])),
+        "total_s": time.perf_counter() - rerun["start"],
+        "bytes_read": read - rerun["io"][0],
+        "bytes_written": written - rerun["io"][1],
+        "sections": sorted(
+            ({"section": name, **row} for name, row in rerun["sections"].items()),
+            key=lambda row: row["seconds"], reverse=True
+        ),
+        **(extra or {}),
+    }
+    if log_path:
+        with open(log_path, "a") as f:
+            f.write(json.dumps(report, default=str) + "\n")
+    return report
+
+
+# Startup profile
+
+
+def _run(code, cwd=None):
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True, text=True
+    )
+
+
+def import_profile(modules, cwd=None):
+    # [{"module", "self_ms", "cumulative_ms"}] for each module as imported in
+    # order by a fresh interpreter; modules already pulled in by an earlier
+    # one report only what was left to import
+    result = _run("; ".join(f"import {m}" for m in modules), cwd)
+    rows = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue
+        name = fields[2].rstrip()
+        if name.strip() in modules and not name.startswith("  "):
+            rows[name.strip()] = {
+                "module": name.strip(),
+                "self_ms": self_us / 1000,
+                "cumulative_ms": cumulative_us / 1000
+            }
+    return [rows.get(m, {"module": m, "self_ms": 0.0, "cumulative_ms": 0.0}) for m in modules]
+
+
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+loaded = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.run()
+first = time.perf_counter()
+at.run()
+second = time.perf_counter()
+print(json.dumps({{
+    "streamlit_ms": (loaded - start) * 1000,
+    "first_run_ms": (first - loaded) * 1000,
+    "rerun_ms": (second - first) * 1000,
+    "exceptions": [e.message for e in at.exception],
+    "deferred_loaded": [m for m in {deferred!r} if m in sys.modules],
+}}))
+"""
+
+
+def cold_start(app=APP, cwd=None):
+    app = os.path.abspath(os.path.join(cwd or ".", app))
+    result = subprocess.run(
+        [sys.executable, "-c", COLD_START.format(app=app, deferred=DEFERRED_MODULES)],
+        cwd=cwd, capture_output=True, text=True
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode or not lines:
+        raise RuntimeError(result.stderr.strip() or "cold start run produced no output")
+    return json.loads(lines[-1])
+
+
+def startup_profile(cwd=None):
+    return {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "startup_imports": import_profile(STARTUP_MODULES, cwd),
+        # One interpreter each, so shared dependencies count for every module
+        "deferred_imports": [import_profile([m], cwd)[0] for m in DEFERRED_MODULES],
+        "cold_start": cold_start(cwd=cwd),
+    }
+
+
+if __name__ == "__main__":
+    # python profiling.py [profile.json] - print the startup profile and
+    # optionally save it for comparison between versions
+    profile = startup_profile()
+    for section in ("startup_imports", "deferred_imports"):
+        print(section.replace("_", " ").capitalize())
+        for row in profile[section]:
+            print(f"  {row['module']:<20} {row['cumulative_ms']:8.1f} ms")
+        print(f"  {'total':<20} {sum(r['cumulative_ms'] for r in profile[section]):8.1f} ms")
+    cold = profile["cold_start"]
+    print(f"Streamlit import {cold['streamlit_ms']:.0f} ms, first run {cold['first_run_ms']:.0f} ms, rerun {cold['rerun_ms']:.0f} ms")
+    print("Deferred modules loaded by the first run: " + (", ".join(cold["deferred_loaded"]) or "none"))
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(profile, f, indent=2)
@@ -1,169 +1,276 @@
-from utils import strip_unicode, generate_pdf_report, suggest_maintenance
-
-
-    mode = tank.get("mode", "Fish Only")
-    equipment = tank.get("equipment", [])
-    data = tank.get("data", [])
-    maintenance = tank.get("maintenance", [])
-
-    latest = data[-1] if data else {}
-    get_val = lambda x: float(latest.get(x, 0)) if latest.get(x) not in [None, '', 'N/A'] else None
-
-    nitrate = get_val("Nitrate (ppm)")
-    phosphate = get_val("Phosphate (ppm)")
-    ammonia = get_val("Ammonia (ppm)")
-    pH = get_val("pH")
-    alk = get_val("Alkalinity (dKH)")
-
-    if nitrate and nitrate > 40:
-        suggestions.append("Nitrate is high – perform 20–30% water change and clean filter media.")
-    if phosphate and phosphate > 0.1:
-        suggestions.append("Phosphate elevated – replace GFO or reduce feeding.")
-    if ammonia and ammonia > 0.25:
-        suggestions.append("Toxic ammonia detected – urgent water change recommended.")
-    if pH and pH < 7.9:
-        suggestions.append("Low pH – improve aeration or review CO₂ levels.")
-    if alk and ((mode == "SPS" and (alk < 7.5 or alk > 8.5)) or (mode == "LPS" and (alk < 7 or alk > 12))):
-        suggestions.append("Alkalinity instability – dose buffer or use auto-doser.")
-
-    if "Skimmer" in equipment:
-        from datetime import datetime
-        now = datetime.now()
-        clean_logs = [e for e in maintenance if "skimmer" in e.get("Task", "").lower()]
-        if clean_logs:
-            last_clean = max([datetime.strptime(e["Date"], "%Y-%m-%d") for e in clean_logs])
-            days = (now - last_clean).days
-            if days > 10:
-                suggestions.append(f"Skimmer last cleaned {days} days ago – clean recommended.")
-        else:
-            suggestions.append("Skimmer installed but never cleaned – log a clean soon.")
-
-    if "Heater" in equipment:
-        suggestions.append("Check heater calibration monthly to avoid temperature drift.")
-
-    if mode == "SPS":
-        suggestions.append("SPS coral requires stable parameters – test calcium, alk, mag regularly.")
-
-    return suggestions
-
-
+from utils import default_modes, suggestion_stats, generate_pdf_report, generate_fleet_reports, render_trend_chart, suggest_maintenance, index_maintenance, ensure_maintenance_index, build_maintenance_index
 
 import streamlit as st
 
-# Utility to strip non-Latin1 characters for PDF safety
-
-# Load dropdown models early
-import json
-try:
-    with open("dropdown_models.json", "r") as f:
-        dropdown_models = json.load(f)
-except FileNotFoundError:
-    dropdown_models = {}
-    import streamlit as st
-    st.error("Missing dropdown_models.json – please check your repository.")
-import pandas as pd
-import json
+import numpy as np
+import io
 import os
+import zipfile
 from datetime import datetime
-from fpdf import FPDF
-import matplotlib.pyplot as plt
+import storage
+import packed
+import timeseries
+import alerts
+import stats
+import importer
+import exporter
+import equipment
+import chart_cache
+import images
+import profiling
+import retention
+import anomalies
+
+# Opt-in timing of this rerun: REEF_PROFILE=1, or ?profile=1 in the URL
+PROFILE = profiling.enabled(st.query_params.get("profile"))
+if PROFILE:
+    profiling.start_rerun()
 
 # Initialize session state
 defaults = {
     "selected_tank": None,
     "tanks": {},
-    "custom_modes": {}
+    "custom_modes": {},
+    # Per-tank anomalies.tank_findings() and suggest_maintenance() results
+    # for this session
+    "findings_cache": {},
+    "suggestion_cache": {}
 }
 for key, value in defaults.items():
     if key not in st.session_state:
         st.session_state[key] = value
 
 SAVE_FILE = "reef_data.json"
+# REEF_FORMAT=packed keeps the snapshot in the binary reef_data.reef instead
+if os.environ.get("REEF_FORMAT") == "packed":
+    PACKED_FILE = "reef_data.reef"
+    if not os.path.exists(PACKED_FILE) and os.path.exists(SAVE_FILE):
+        packed.convert(SAVE_FILE, PACKED_FILE)
+    SAVE_FILE = PACKED_FILE
+# "journal" appends new records to reef_data.journal.jsonl, "snapshot" rewrites
+# reef_data.json on every save, "sqlite" keeps everything in reef_data.db and
+# "sharded" keeps a manifest plus one file per tank in reef_shards/
+STORAGE_MODE = os.environ.get("REEF_STORAGE_MODE", "journal")
+if STORAGE_MODE == "sqlite":
+    import sqlite_store as backend
+    DB_FILE = "reef_data.db"
+    if not os.path.exists(DB_FILE) and os.path.exists(SAVE_FILE):
+        backend.migrate(SAVE_FILE, DB_FILE)
+    SAVE_FILE = DB_FILE
+elif STORAGE_MODE == "sharded":
+    import shard_store as backend
+    MANIFEST_FILE = os.path.join("reef_shards", "manifest.json")
+    if not os.path.exists(MANIFEST_FILE) and os.path.exists(SAVE_FILE):
+        backend.migrate(SAVE_FILE, MANIFEST_FILE)
+    SAVE_FILE = MANIFEST_FILE
+else:
+    backend = storage
+# Tank history stays in the backend and is queried per tank and tab
+LAZY_HISTORY = STORAGE_MODE in ("sqlite", "sharded")
 IMAGE_DIR = "images"
+COLUMNS_DIR = timeseries.COLUMNS_DIR
+# REEF_RAW_DAYS=N keeps N days of raw readings per tank; older ones are
+# rolled into hourly/daily aggregates in rollups/ by a background thread
+ROLLUP_DIR = "rollups"
+retention.start(SAVE_FILE, backend, ROLLUP_DIR)
+# Trend chart windows (days back from the latest reading) and points per series
+TREND_WINDOWS = {"All": None, "Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "Last year": 365}
+CHART_POINTS = 500
+DIARY_PAGE_SIZE = 12
 os.makedirs(IMAGE_DIR, exist_ok=True)
 
 # Load and Save
+@profiling.profiled()
 def load_tanks():
-    if os.path.exists(SAVE_FILE):
-        with open(SAVE_FILE, "r") as f:
-            data = json.load(f)
-            st.session_state.custom_modes = data.get("custom_modes", {})
-            tanks = data.get("tanks", {})
-            for t in tanks.values():
-                img = t.get("profile_image")
-                if isinstance(img, str) and not os.path.exists(os.path.join(IMAGE_DIR, img)):
-                    t["profile_image"] = None
-            return tanks
-    return {}
-
+    if LAZY_HISTORY:
+        tanks, st.session_state.custom_modes = backend.load(SAVE_FILE, with_history=False)
+    else:
+        tanks, st.session_state.custom_modes = backend.load(SAVE_FILE)
+    # What this session loaded; saves merge only its own changes into what
+    # other sessions have written since
+    st.session_state.storage_base = storage.base_of(tanks, st.session_state.custom_modes)
+    for name, t in tanks.items():
+        index, state = t.get("maintenance_index"), t.get("reading_stats")
+        if "maintenance" in t:
+            ensure_maintenance_index(t)
+        elif "maintenance_index" not in t:
+            t["maintenance_index"] = build_maintenance_index(backend.maintenance(SAVE_FILE, name))
+        if "data" in t:
+            stats.ensure(t)
+        elif "reading_stats" not in t:
+            t["reading_stats"] = stats.rebuild(backend.readings(SAVE_FILE, name))
+        if t.get("maintenance_index") is not index or t.get("reading_stats") is not state:
+            # Stored once (e.g. for a store from before they existed), so
+            # later loads stay metadata-only
+            backend.put_tank(SAVE_FILE, name, t, base=st.session_state.storage_base)
+    # Image files are only checked when the Overview or Diary shows them
+    return tanks
+
+@profiling.profiled()
 def save_tanks():
-    with open(SAVE_FILE, "w") as f:
-        json.dump({
-            "tanks": st.session_state.tanks,
-            "custom_modes": st.session_state.custom_modes
-        }, f, indent=2, default=str)
-
-# Default modes
-default_modes = {
-    "Fish Only": {
-        "Temperature (°C)": (24, 27),
-        "Salinity (SG)": (1.020, 1.026),
-        "pH": (7.8, 8.4),
-        "Ammonia (ppm)": (0, 0.25),
-        "Nitrite (ppm)": (0, 0.5),
-        "Nitrate (ppm)": (0, 40)
-    },
-    "LPS": {
-        "Temperature (°C)": (24, 26),
-        "Salinity (SG)": (1.024, 1.026),
-        "pH": (8.0, 8.4),
-        "Ammonia (ppm)": (0, 0),
-        "Nitrite (ppm)": (0, 0),
-        "Nitrate (ppm)": (0, 20),
-        "Phosphate (ppm)": (0, 0.1),
-        "Calcium (ppm)": (380, 450),
-        "Alkalinity (dKH)": (7, 12),
-        "Magnesium (ppm)": (1200, 1400)
-    },
-    "SPS": {
-        "Temperature (°C)": (25, 26),
-        "Salinity (SG)": (1.025, 1.026),
-        "pH": (8.1, 8.4),
-        "Ammonia (ppm)": (0, 0),
-        "Nitrite (ppm)": (0, 0),
-        "Nitrate (ppm)": (0, 5),
-        "Phosphate (ppm)": (0, 0.03),
-        "Calcium (ppm)": (400, 450),
-        "Alkalinity (dKH)": (7.5, 8.5),
-        "Magnesium (ppm)": (1300, 1400)
-    }
-}
+    conflicts = backend.save(SAVE_FILE, st.session_state.tanks, st.session_state.custom_modes, base=st.session_state.storage_base)
+    for name, fields in (conflicts or {}).items():
+        st.warning(f"{name} was also changed in another session; kept your {', '.join(fields)}.")
+
+def bump_revision(tank_name):
+    tank = st.session_state.tanks[tank_name]
+    tank["revision"] = tank.get("revision", 0) + 1
+
+def log_entry(tank_name, collection, record):
+    tank = st.session_state.tanks[tank_name]
+    bump_revision(tank_name)
+    if collection in tank:
+        tank[collection].append(record)
+    if collection == "maintenance":
+        index_maintenance(tank.setdefault("maintenance_index", {}), record)
+    if collection == "data":
+        stats.update(tank.setdefault("reading_stats", stats.empty()), record)
+    if STORAGE_MODE == "snapshot":
+        save_tanks()
+    else:
+        backend.append(SAVE_FILE, tank_name, collection, record)
+        if collection in ("data", "maintenance"):
+            # The maintenance index and reading statistics live in the tank metadata
+            backend.put_tank(SAVE_FILE, tank_name, tank, base=st.session_state.storage_base)
+
+def save_modes():
+    if STORAGE_MODE == "snapshot":
+        save_tanks()
+    else:
+        backend.put_modes(SAVE_FILE, st.session_state.custom_modes, base=st.session_state.storage_base)
+
+def save_tank(tank_name):
+    bump_revision(tank_name)
+    if STORAGE_MODE == "snapshot":
+        save_tanks()
+    else:
+        backend.put_tank(SAVE_FILE, tank_name, st.session_state.tanks[tank_name], base=st.session_state.storage_base)
+
+def import_readings(tank_name, f):
+    params = sorted({p for ranges in combined_modes.values() for p in ranges})
+    if LAZY_HISTORY:
+        existing = backend.timestamps(SAVE_FILE, tank_name)
+    else:
+        existing = {str(r.get("Date")) for r in tank_history(tank_name, "data")}
+    report = importer.import_csv(f, tank_name, params, backend, SAVE_FILE, existing)
+    tank = st.session_state.tanks[tank_name]
+    if not LAZY_HISTORY:
+        # Imported rows were journaled after the existing ones; fold them in
+        # in date order with a single snapshot write. Only this tank's
+        # readings are reloaded, so unsaved edits elsewhere are kept.
+        stored = backend.load(SAVE_FILE)[0][tank_name]
+        tank["data"] = sorted(stored.get("data", []), key=lambda r: str(r.get("Date")))
+        tank["revision"] = stored.get("revision", 0)
+        # The readings are now current; metadata still merges against what
+        # the session loaded
+        described = st.session_state.storage_base["tanks"]
+        described[tank_name] = {**described.get(tank_name, storage.describe(stored)), "revision": tank["revision"]}
+    tank["reading_stats"] = stats.rebuild(tank_history(tank_name, "data"))
+    bump_revision(tank_name)
+    # Imported rows can land anywhere in the history, so the columns are rebuilt
+    timeseries.discard(COLUMNS_DIR, tank_name)
+    if LAZY_HISTORY:
+        backend.put_tank(SAVE_FILE, tank_name, tank, base=st.session_state.storage_base)
+    else:
+        save_tanks()
+    return report
+
+def tank_history(tank_name, collection, start=None, end=None, tank=None):
+    # tank is passed in when called outside the script run (deferred exports),
+    # where st.session_state is not available
+    if LAZY_HISTORY:
+        return backend.history(SAVE_FILE, tank_name, collection, start, end)
+    if tank is None:
+        tank = st.session_state.tanks[tank_name]
+    return tank.get(collection, [])
+
+def latest_reading(tank_name):
+    if LAZY_HISTORY:
+        return backend.latest_reading(SAVE_FILE, tank_name)
+    data = st.session_state.tanks[tank_name].get("data", [])
+    return data[-1] if data else {}
+
+def diary_page(tank_name, page, per_page=DIARY_PAGE_SIZE):
+    # Entries for one gallery page, newest first, and the total count
+    if LAZY_HISTORY:
+        return backend.diary_page(SAVE_FILE, tank_name, page * per_page, per_page)
+    diary = st.session_state.tanks[tank_name].get("diary", [])
+    if not per_page:
+        return [], len(diary)
+    # Newest first; entries logged on the same day keep reverse log order
+    order = sorted(range(len(diary)), key=lambda i: (str(diary[i].get("Date", "")), i), reverse=True)
+    return [diary[i] for i in order[page * per_page:(page + 1) * per_page]], len(diary)
+
+def tank_tabs(labels):
+    # Only the selected tab runs on Streamlit versions that track it, so the
+    # pandas / matplotlib / fpdf work in Trends and Export is skipped otherwise
+    try:
+        return st.tabs(labels, key="tank_tabs", on_change="rerun")
+    except TypeError:
+        return st.tabs(labels)
+
+def download_button(label, make, **kwargs):
+    # Newer Streamlit calls make() only when the button is clicked, so the
+    # export is spooled on demand; older versions need the finished file
+    try:
+        from streamlit.runtime.media_file_manager import MediaFileManager
+        deferred = hasattr(MediaFileManager, "add_deferred")
+    except ImportError:
+        deferred = False
+    if deferred:
+        return st.download_button(label, make, on_click="ignore", **kwargs)
+    return st.download_button(label, make(), **kwargs)
+
+def tab_open(tab):
+    # None when the Streamlit version cannot tell which tab is selected
+    return getattr(tab, "open", None) is not False
+
+def tank_columns(tank_name, tank=None):
+    # Columnar copy of the tank's readings, read from the store only when
+    # the tank's revision has moved and then converted from the new rows on
+    if tank is None:
+        tank = st.session_state.tanks[tank_name]
+    path = timeseries.column_path(COLUMNS_DIR, tank_name)
+    count = None if LAZY_HISTORY else len(tank.get("data", []))
+    return timeseries.sync(
+        path, tank.get("revision", 0), lambda start: tank_history(tank_name, "data", tank=tank)[start:], count, tank.get("raw_since")
+    )
+
+def tank_history_columns(tank_name, start=None, stat="mean"):
+    # Raw columns joined with the retention rollups before them, and the
+    # resolution of the rolled-up part ("raw" when there is none)
+    return retention.view(tank_columns(tank_name), retention.load_tiers(ROLLUP_DIR, tank_name), start=start, stat=stat)
+
+def tank_findings(tank_name):
+    # Spikes, drifts and fast changes in the tank's readings (anomalies.py),
+    # recomputed only after the tank is written
+    tank = st.session_state.tanks[tank_name]
+    return anomalies.tank_findings(
+        tank_name, lambda: tank_columns(tank_name), (tank.get("revision", 0), len(tank.get("data", ()))),
+        st.session_state.findings_cache
+    )
+
+def tank_suggestions(tank_name):
+    # Keyed on the session's tank, so the latest reading is only fetched on a miss
+    return suggest_maintenance(
+        st.session_state.tanks[tank_name], tank_name, tank_findings(tank_name),
+        st.session_state.suggestion_cache, lambda: suggestion_view(tank_name)
+    )
+
+def suggestion_view(tank_name):
+    # suggest_maintenance only needs the latest reading and the maintenance index
+    tank = st.session_state.tanks[tank_name]
+    if not LAZY_HISTORY:
+        return tank
+    latest = latest_reading(tank_name)
+    return {**tank, "data": [latest] if latest else []}
+
 combined_modes = {**default_modes, **st.session_state.custom_modes}
 
-def check_alerts(params, mode):
-    alerts = []
-    for param, (low, high) in combined_modes.get(mode, {}).items():
-        try:
-            val = float(params.get(param, 'N/A'))
-            if val < low or val > high:
-                alerts.append(f"{param}: {val} (Expected: {low}-{high})")
-        except:
-            continue
-    return alerts
-
-def highlight_outliers(row, mode):
-    styles = []
-    for col in row.index:
-        if col in combined_modes[mode]:
-            val = row[col]
-            low, high = combined_modes[mode][col]
-            if pd.notnull(val) and (val < low or val > high):
-                styles.append("background-color: #ffcccc")
-            else:
-                styles.append("")
-        else:
-            styles.append("")
-    return styles
+compiled_modes = alerts.compile_modes(combined_modes)
+
+def mode_ranges(mode):
+    return compiled_modes.get(mode) or alerts.compile_mode({})
 
 # Load tanks
 st.session_state.tanks = load_tanks()
@@ -171,7 +278,7 @@ if st.session_state.selected_tank not in st.session_state.tanks:
     st.session_state.selected_tank = next(iter(st.session_state.tanks), None)
 
 # Sidebar
-with st.sidebar:
+with st.sidebar, profiling.timed("Sidebar"):
     st.header("🌊 Reef Tank Tracker")
     tank_name = st.text_input("Add New Tank")
     if st.button("➕ Add Tank") and tank_name:
@@ -188,13 +295,33 @@ with st.sidebar:
             "diary": []
         }
         st.session_state.selected_tank = tank_name
-        save_tanks()
+        save_tank(tank_name)
 
     if st.session_state.tanks:
         st.session_state.selected_tank = st.selectbox("Select Tank", list(st.session_state.tanks.keys()), index=0)
 
     st.button("💾 Save All", on_click=save_tanks)
 
+    with st.expander("🚨 Fleet Alerts"):
+        if st.button("Scan All Tanks"):
+            # Rolled-up history is checked by each bucket's min and max
+            scan = alerts.fleet_scan(
+                {name: tank_history_columns(name, stat="extremes")[0] for name in st.session_state.tanks},
+                {name: t.get("mode", "Fish Only") for name, t in st.session_state.tanks.items()},
+                compiled_modes
+            )
+            # Spikes, drifts and fast changes, tanks scanned in parallel
+            unusual = anomalies.fleet_scan({name: tank_columns(name) for name in st.session_state.tanks})
+            for name, result in scan.items():
+                breached = [p for p, hit in zip(result["params"], result["latest"]) if hit]
+                total = int(result["counts"].sum())
+                if breached:
+                    st.warning(f"{name}: {', '.join(breached)} out of range ({total} out-of-range values in history)")
+                else:
+                    st.write(f"✅ {name}: latest reading in range ({total} out-of-range values in history)")
+                for finding in unusual.get(name, {}).get("findings", []):
+                    st.warning(f"{name}: {finding['message']}", icon="📈")
+
     # Add + edit custom modes
     with st.expander("➕ Create Custom Mode"):
         new_mode = st.text_input("New Mode Name")
@@ -205,7 +332,7 @@ with st.sidebar:
             st.session_state.custom_modes.setdefault(new_mode, {})[param] = (low, high)
             st.success(f"Added {param} to {new_mode}")
         if st.button("Save This Mode") and new_mode in st.session_state.custom_modes:
-            save_tanks()
+            save_modes()
             st.success(f"Saved mode: {new_mode}")
 
     with st.expander("🛠️ Manage Custom Modes"):
@@ -226,11 +353,11 @@ with st.sidebar:
                     updated[param] = (new_low, new_high)
             if st.button("💾 Save Changes"):
                 st.session_state.custom_modes[sel] = updated
-                save_tanks()
+                save_modes()
                 st.success(f"Updated mode: {sel}")
             if st.button("🗑️ Delete This Mode"):
                 del st.session_state.custom_modes[sel]
-                save_tanks()
+                save_modes()
                 st.experimental_rerun()
 
 # Main Interface
@@ -238,14 +365,14 @@ st.title("🧪 Marine Reef Tank Tracker")
 
 if st.session_state.selected_tank:
     tank = st.session_state.tanks[st.session_state.selected_tank]
-    tabs = st.tabs(["Overview", "Log Parameters", "Maintenance", "Diary", "Trends"])
+    tabs = tank_tabs(["Overview", "Log Parameters", "Maintenance", "Diary", "Trends"])
 
-    with tabs[0]:
+    with tabs[0], profiling.timed("Overview tab"):
         st.subheader("Tank Overview")
         if tank.get("profile_image"):
             img_path = os.path.join(IMAGE_DIR, tank["profile_image"])
             if os.path.exists(img_path):
-                st.image(img_path, use_container_width=True)
+                st.image(images.thumbnail(tank["profile_image"], IMAGE_DIR, images.PROFILE_SIZE), use_container_width=True)
         with st.form("tank_config"):
             tank["mode"] = st.selectbox("Mode", list(combined_modes.keys()), index=list(combined_modes).index(tank.get("mode", "Fish Only")))
             tank["theme"] = st.text_input("Theme", tank.get("theme", ""))
@@ -257,28 +384,22 @@ if st.session_state.selected_tank:
             submitted = st.form_submit_button("Submit")
 
 # Equipment Configuration - Safe, Form-Free Version
-import json
-try:
-    with open("dropdown_models.json", "r") as f:
-        dropdown_models = json.load(f)
-except Exception:
-    dropdown_models = {}
-    st.error("Failed to load 'dropdown_models.json'. Please check the file.")
-
-equipment_options = {
-    "Heater": dropdown_models.get("Heaters", []),
-    "LED Light": dropdown_models.get("LED Lights", []),
-    "Skimmer": dropdown_models.get("Skimmers", []),
-    "ATO System": dropdown_models.get("ATO Systems", []),
-    "Return Pump": dropdown_models.get("Return Pumps", []),
-    "Overflow Type": dropdown_models.get("Overflows", []),
-}
+# Model lists are indexed once; each selector only renders the top search matches
+model_indexes = equipment.load_models()
+if not os.path.exists(equipment.DROPDOWN_FILE):
+    st.error("Missing dropdown_models.json – please check your repository.")
+for problem in equipment.model_errors():
+    st.error(f"Could not read {problem} – please check your repository.")
 
 with st.expander("🔧 Equipment Configuration", expanded=True):
     tank["selected_equipment"] = tank.get("selected_equipment", {})
     updated = False
-    for eq_type, options in equipment_options.items():
+    for eq_type, model_index in model_indexes.items():
         current = tank["selected_equipment"].get(eq_type)
+        query = st.text_input(f"Search {eq_type} models", key=f"{eq_type}_search", placeholder="Brand, model, 300W, 5000LPH...")
+        options = equipment.search(model_index, query)
+        if current in model_index["position"] and current not in options:
+            options = [current] + options
         index = options.index(current) if current in options else 0 if options else 0
         selected = st.selectbox(
             f"{eq_type} Model",
@@ -286,47 +407,31 @@ with st.expander("🔧 Equipment Configuration", expanded=True):
             index=index,
             key=f"{eq_type}_select"
         )
-        if selected != current:
+        if selected is not None and selected != current:
             tank["selected_equipment"][eq_type] = selected
             updated = True
 
+    fits = equipment.bundled_matches(
+        equipment.load(), tank.get("mode"), (tank.get("display_capacity") or 0.0) + (tank.get("sump_capacity") or 0.0)
+    )
+    if fits:
+        st.caption(
+            f"Bundled systems for {tank.get('mode')} at this volume: "
+            + ", ".join(f"{s['brand']} {s['model']} ({s['total_volume']:g} L)" for s in fits)
+        )
+
     if st.button("Save Equipment Settings"):
         if updated:
+            save_tank(st.session_state.selected_tank)
             st.success("Equipment updated.")
         else:
             st.info("No changes detected.")
 
-        validation_notes = []
         display_vol = tank.get("display_capacity", 0.0)
         sump_vol = tank.get("sump_capacity", 0.0)
         total_volume = display_vol + sump_vol
 
-        from json import load as json_load
-        with open("equipment_model_lookup.json", "r") as ef:
-            model_lookup = json_load(ef)
-
-        # Heater wattage check
-        heater = tank["selected_equipment"].get("Heater")
-        if heater in model_lookup:
-            wattage = model_lookup[heater].get("wattage")
-            if wattage and (total_volume / wattage > 3):  # Rough guide: 1W per 3L
-                validation_notes.append(f"Heater '{heater}' may be underpowered for {total_volume}L.")
-
-        # Skimmer tank rating check
-        skimmer = tank["selected_equipment"].get("Skimmer")
-        if skimmer in model_lookup:
-            rated = model_lookup[skimmer].get("rated_tank_l")
-            if rated and rated < total_volume:
-                validation_notes.append(f"Skimmer '{skimmer}' is rated for {rated}L, which is under your tank volume.")
-
-        # Return pump vs overflow flow
-        pump = tank["selected_equipment"].get("Return Pump")
-        overflow = tank["selected_equipment"].get("Overflow Type")
-        if pump in model_lookup and overflow in model_lookup:
-            pump_flow = model_lookup[pump].get("flow_lph")
-            overflow_limit = model_lookup[overflow].get("recommended_flow_lph")
-            if pump_flow and overflow_limit and pump_flow > overflow_limit:
-                validation_notes.append(f"Pump '{pump}' may exceed overflow capacity '{overflow}' ({overflow_limit} L/h).")
+        validation_notes = equipment.check(equipment.load(), tank["selected_equipment"], total_volume)
 
         if validation_notes:
             st.warning("⚠️ Equipment Mismatch Detected:")
@@ -335,36 +440,45 @@ with st.expander("🔧 Equipment Configuration", expanded=True):
             profile_pic = st.file_uploader("Profile Image", type=["jpg", "png", "jpeg"])
             if st.form_submit_button("Save Tank"):
                 if profile_pic:
-                    filename = f"{st.session_state.selected_tank}_profile_{profile_pic.name}"
-                    with open(os.path.join(IMAGE_DIR, filename), "wb") as f:
-                        f.write(profile_pic.read())
+                    filename = images.ingest(profile_pic, IMAGE_DIR, (images.PROFILE_SIZE,))
                     tank["profile_image"] = filename
-                save_tanks()
+                save_tank(st.session_state.selected_tank)
                 st.success("Saved")
 
-    with tabs[1]:
+    with tabs[1], profiling.timed("Log Parameters tab"):
         st.subheader("Log Parameters")
         with st.form("log_params"):
             log = {"Date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
             for param in combined_modes[tank["mode"]].keys():
                 log[param] = st.text_input(param)
             if st.form_submit_button("Submit Log"):
-                tank["data"].append(log)
-                save_tanks()
+                log_entry(st.session_state.selected_tank, "data", log)
                 st.success("Logged")
 
-    with tabs[2]:
+        with st.expander("📥 Bulk Import CSV"):
+            st.caption("Needs a Date/Timestamp column; other columns are matched to parameter names (e.g. Temp, Alk, NO3, PO4).")
+            csv_file = st.file_uploader("Readings CSV", type=["csv"])
+            if st.button("Import Readings") and csv_file:
+                report = import_readings(st.session_state.selected_tank, csv_file)
+                st.success(
+                    f"Imported {report['imported']} of {report['rows']} rows "
+                    f"({report['duplicates']} duplicates, {report['skipped']} skipped) "
+                    f"at {report['rows_per_sec']:.0f} rows/s"
+                )
+                if report.get("unmapped"):
+                    st.info("Ignored columns: " + ", ".join(report["unmapped"]))
+
+    with tabs[2], profiling.timed("Maintenance tab"):
         st.subheader("Maintenance")
         with st.form("maintenance_form"):
             m_date = st.date_input("Date", datetime.now())
             task = st.text_input("Task")
             notes = st.text_area("Notes")
             if st.form_submit_button("Add Entry"):
-                tank["maintenance"].append({"Date": str(m_date), "Task": task, "Notes": notes})
-                save_tanks()
+                log_entry(st.session_state.selected_tank, "maintenance", {"Date": str(m_date), "Task": task, "Notes": notes})
                 st.success("Added")
 
-    with tabs[3]:
+    with tabs[3], profiling.timed("Diary tab"):
         st.subheader("Diary")
         with st.form("diary_form"):
             d_date = st.date_input("Entry Date", datetime.now())
@@ -373,89 +487,194 @@ with st.expander("🔧 Equipment Configuration", expanded=True):
             if st.form_submit_button("Add Entry"):
                 entry = {"Date": str(d_date), "Entry": d_note}
                 if d_image:
-                    img_path = os.path.join(IMAGE_DIR, d_image.name)
-                    with open(img_path, "wb") as f:
-                        f.write(d_image.read())
-                    entry["Image"] = d_image.name
-                tank["diary"].append(entry)
-                save_tanks()
+                    entry["Image"] = images.ingest(d_image, IMAGE_DIR)
+                log_entry(st.session_state.selected_tank, "diary", entry)
                 st.success("Added")
 
-    with tabs[4]:
-        if tank["data"]:
-            df = pd.DataFrame(tank["data"])
-            st.subheader("Latest Logs")
-            df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
-            numeric_df = df.drop(columns=["Date"], errors="ignore").apply(pd.to_numeric, errors="coerce")
-            styled = numeric_df.copy()
-            styled["Date"] = df["Date"]
-            styled_df = styled.style.apply(highlight_outliers, axis=1, mode=tank["mode"])
-            st.dataframe(styled_df)
-            try:
-                last = df.iloc[-1].to_dict()
-                alerts = check_alerts(last, tank["mode"])
-                if alerts:
+        # Gallery: only the visible page's images are opened, as thumbnails
+        _, total = diary_page(st.session_state.selected_tank, 0, 0)
+        if total:
+            pages = (total + DIARY_PAGE_SIZE - 1) // DIARY_PAGE_SIZE
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key="diary_page") - 1
+            entries, _ = diary_page(st.session_state.selected_tank, page)
+            st.caption(f"Entries {page * DIARY_PAGE_SIZE + 1}-{page * DIARY_PAGE_SIZE + len(entries)} of {total}, newest first")
+            for i, entry in enumerate(entries):
+                st.markdown(f"**{entry.get('Date', '')}**")
+                if entry.get("Entry"):
+                    st.write(entry["Entry"])
+                if entry.get("Image"):
+                    thumb = images.thumbnail(entry["Image"], IMAGE_DIR, images.DIARY_SIZE)
+                    if thumb is None:
+                        st.caption("Image missing")
+                    elif st.checkbox("Full size", key=f"diary_full_{page}_{i}"):
+                        st.image(os.path.join(IMAGE_DIR, entry["Image"]), use_container_width=True)
+                    else:
+                        st.image(thumb, width=images.DIARY_SIZE)
+                st.divider()
+
+    if tab_open(tabs[4]):
+        with tabs[4], profiling.timed("Trends tab"):
+            cols = tank_columns(st.session_state.selected_tank)
+            if len(cols["timestamps"]):
+                col1, col2 = st.columns(2)
+                with col1:
+                    trend_window = st.selectbox("Time Window", list(TREND_WINDOWS))
+                with col2:
+                    chart_method = st.selectbox("Chart Sampling", ["Min/Max", "LTTB"])
+                start = None
+                if TREND_WINDOWS[trend_window]:
+                    end = np.asarray(cols["timestamps"]).max().astype("datetime64[s]")
+                    start = end - np.timedelta64(TREND_WINDOWS[trend_window], "D")
+                visible, resolution = tank_history_columns(st.session_state.selected_tank, start)
+                if resolution != "raw":
+                    st.caption(f"Readings older than the retention window are shown as {resolution} averages")
+                numeric_df = timeseries.frame(visible)
+                st.subheader("Latest Logs")
+                styled = numeric_df.reset_index(drop=True)
+                styled["Date"] = numeric_df.index
+                styled_df = styled.style.apply(alerts.highlight_outliers, axis=None, compiled=mode_ranges(tank["mode"]))
+                st.dataframe(styled_df)
+                latest_alerts = alerts.check_alerts(cols, mode_ranges(tank["mode"]))
+                if latest_alerts:
                     st.toast("⚠️ Parameter Alert: Out-of-range values found.")
-                    for alert in alerts:
+                    for alert in latest_alerts:
                         st.warning(alert)
-            except:
-                pass
-            st.line_chart(numeric_df.set_index(df["Date"]))
+                for finding in tank_findings(st.session_state.selected_tank):
+                    st.warning(finding["message"], icon="📈")
+                # Keep each series' spikes while capping the points sent to the browser
+                method = "lttb" if chart_method == "LTTB" else "minmax"
+                st.line_chart(timeseries.frame(timeseries.downsample(visible, CHART_POINTS, method)))
+
+                with st.expander("🖼️ Per-Parameter Charts"):
+                    chart_params = st.multiselect("Parameters", visible["params"], default=visible["params"][:3])
+                    mode_range = combined_modes.get(tank["mode"], {})
+                    revision = chart_cache.data_hash(visible)
+                    charts_used = []
+                    for param in chart_params:
+                        # Same cache as the PDF charts; only re-plotted when the data or window changes
+                        key = chart_cache.chart_key(st.session_state.selected_tank, [param], trend_window, revision, mode_range.get(param), "png")
+                        st.image(chart_cache.get_or_render(
+                            key, "png", lambda: render_trend_chart(timeseries.downsample(visible, CHART_POINTS), param, mode_range),
+                            used=charts_used
+                        ))
+                    chart_cache.evict(keep=charts_used)
+
+                st.subheader(f"Rolling Statistics (last {stats.ROLLING_WINDOW} readings)")
+                st.dataframe(stats.frame(stats.ensure(tank)))
 
 
 # Inject suggested maintenance into Overview and Maintenance Tabs
-    with tabs[0]:
+    with tabs[0], profiling.timed("Overview tab"):
         st.subheader("Tank Overview")
         if tank.get("profile_image"):
             img_path = os.path.join(IMAGE_DIR, tank["profile_image"])
             if os.path.exists(img_path):
-                st.image(img_path, use_container_width=True)
+                st.image(images.thumbnail(tank["profile_image"], IMAGE_DIR, images.PROFILE_SIZE), use_container_width=True)
 
         # --- Suggested Overview Actions ---
-        overview_suggestions = suggest_maintenance(tank)[:2]
+        overview_suggestions = tank_suggestions(st.session_state.selected_tank)[:2]
         if overview_suggestions:
             st.markdown("### ⚠️ Suggested Actions")
             for s in overview_suggestions:
                 st.info(s)
 
-    with tabs[2]:
+    with tabs[2], profiling.timed("Maintenance tab"):
         st.subheader("Maintenance")
         with st.expander("💡 Suggested Maintenance", expanded=False):
-            full_suggestions = suggest_maintenance(tank)
+            full_suggestions = tank_suggestions(st.session_state.selected_tank)
             if full_suggestions:
                 for tip in full_suggestions:
                     st.write("• " + tip)
             else:
                 st.write("✅ No immediate suggestions – tank appears healthy.")
 
-
-        with tabs[4]:
+    if tab_open(tabs[4]):
+        with tabs[4], profiling.timed("Export tab"):
             st.subheader("Export & Trends")
-            export_suggestions = suggest_maintenance(tank)
             include_suggestions = st.checkbox("Include Suggestions in PDF Export")
 
+            # Export raw history
+            with st.expander("📤 Export Data"):
+                export_scope = st.radio("Tanks", ["This tank", "All tanks"], horizontal=True)
+                export_set = st.selectbox("Data", ["Readings", "Maintenance", "Diary"])
+                export_format = st.radio("Format", ["CSV", "Columnar (.npz)"], horizontal=True) if export_set == "Readings" else "CSV"
+                export_start = export_end = None
+                if st.checkbox("Limit to date range"):
+                    export_range = st.date_input("Date range", [])
+                    if len(export_range) == 2:
+                        export_start, export_end = str(export_range[0]), f"{export_range[1]} 23:59:59"
+                if st.button("Prepare Export"):
+                    names = [st.session_state.selected_tank] if export_scope == "This tank" else list(st.session_state.tanks)
+                    base = st.session_state.selected_tank if export_scope == "This tank" else "all_tanks"
+                    # The export runs when the download is clicked, outside this rerun
+                    tanks = {name: st.session_state.tanks[name] for name in names}
+                    if export_set == "Readings":
+                        if export_format == "CSV":
+                            download_button(
+                                "💾 Save CSV",
+                                lambda: exporter.spool(exporter.readings_csv({name: tank_columns(name, tanks[name]) for name in names}, export_start, export_end)),
+                                file_name=f"{base}_readings.csv", mime="text/csv"
+                            )
+                        else:
+                            download_button(
+                                "💾 Save NPZ",
+                                lambda: exporter.spool_npz({name: tank_columns(name, tanks[name]) for name in names}, export_start, export_end),
+                                file_name=f"{base}_readings.npz", mime="application/octet-stream"
+                            )
+                    else:
+                        collection = export_set.lower()
+                        download_button(
+                            "💾 Save CSV",
+                            lambda: exporter.spool(exporter.records_csv(
+                                {name: tank_history(name, collection, export_start, export_end, tanks[name]) for name in names},
+                                collection, export_start, export_end
+                            )),
+                            file_name=f"{base}_{collection}.csv", mime="text/csv"
+                        )
+
             # Export PDF
             if st.button("📄 Download PDF Report"):
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.set_font("Arial", size=12)
-                pdf.cell(200, 10, txt=strip_unicode(f"Tank Report: {st.session_state.selected_tank}"), ln=True)
-                pdf.cell(200, 10, txt=strip_unicode(f"Theme: {tank.get('theme', '')}"), ln=True)
-                pdf.cell(200, 10, txt=strip_unicode(f"Livestock: {tank.get('livestock', '')}"), ln=True)
-                pdf.cell(200, 10, txt=strip_unicode(f"Mode: {tank.get('mode', '')}"), ln=True)
-
-                if tank["data"]:
-                    last_log = tank["data"][-1]
-                    pdf.cell(200, 10, txt=strip_unicode("Latest Parameters:"), ln=True)
-                    for k, v in last_log.items():
-                        pdf.cell(200, 8, txt=strip_unicode(f"{k}: {v}"), ln=True)
-
-                if include_suggestions and export_suggestions:
-                    pdf.cell(200, 10, txt=strip_unicode("Suggested Maintenance:"), ln=True)
-                    for tip in export_suggestions:
-                        pdf.cell(200, 8, txt=strip_unicode(f"• {tip}"), ln=True)
-
-                pdf_output_path = "/mnt/data/tank_report.pdf"
-                pdf.output(pdf_output_path)
-                with open(pdf_output_path, "rb") as f:
-                    st.download_button("📄 Save PDF", f, file_name="tank_report.pdf")
+                pdf_bytes = generate_pdf_report(
+                    st.session_state.selected_tank,
+                    tank,
+                    latest=latest_reading(st.session_state.selected_tank),
+                    cols=tank_columns(st.session_state.selected_tank),
+                    suggestions=tank_suggestions(st.session_state.selected_tank) if include_suggestions else None,
+                    ranges=combined_modes.get(tank["mode"])
+                )
+                st.download_button("📄 Save PDF", pdf_bytes, file_name=f"{st.session_state.selected_tank}_report.pdf")
+
+            if st.button("🗂️ Download All Tank Reports"):
+                reports = generate_fleet_reports({
+                    name: {
+                        "tank": t,
+                        "latest": latest_reading(name),
+                        "cols": tank_columns(name),
+                        "suggestions": tank_suggestions(name) if include_suggestions else None,
+                        "ranges": combined_modes.get(t.get("mode"))
+                    }
+                    for name, t in st.session_state.tanks.items()
+                })
+                bundle = io.BytesIO()
+                with zipfile.ZipFile(bundle, "w") as zf:
+                    for name, pdf_bytes in reports.items():
+                        zf.writestr(f"{name}_report.pdf", pdf_bytes)
+                st.download_button("🗂️ Save Reports (ZIP)", bundle.getvalue(), file_name="tank_reports.zip")
+
+# Rerun profile (only with profiling on); times include nested sections
+if PROFILE:
+    rerun_report = profiling.finish_rerun(extra={
+        "suggestion_cache": dict(suggestion_stats),
+        "chart_cache": dict(chart_cache.cache_stats)
+    })
+    with st.sidebar.expander("⏱️ Rerun Profile"):
+        st.caption(
+            f"{rerun_report['total_s'] * 1000:.0f} ms, {rerun_report['bytes_read'] / 1024:.0f} KB read, "
+            f"{rerun_report['bytes_written'] / 1024:.0f} KB written - appended to {profiling.LOG_FILE}"
+        )
+        st.dataframe([
+            {"section": row["section"], "calls": row["calls"], "ms": round(row["seconds"] * 1000, 2),
+             "bytes read": row["bytes_read"], "bytes written": row["bytes_written"]}
+            for row in rerun_report["sections"]
+        ])
+        st.json({"suggestion_cache": rerun_report["suggestion_cache"], "chart_cache": rerun_report["chart_cache"]})
@@ -0,0 +1,279 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import timeseries
+
+# Tiered retention for tank readings
+#
+# Raw readings are kept for the last RAW_DAYS of each tank's history (up to
+# its latest reading). Older readings are rolled into hourly and daily
+# min / mean / max / count aggregates per parameter, and then pruned from the
+# store. Hourly buckets are kept for HOURLY_DAYS, daily ones for good.
+#
+# Each tier is a column file (see timeseries.py) under rollups/, with the
+# parameters expanded to "min|pH", "mean|pH", ... and the time up to which
+# readings have been rolled in its header. A run rolls the readings still in
+# the store below the new cutoff (normally those since that mark, plus any
+# backfilled under it), merging them into the existing buckets, so it is
+# incremental and safe to repeat after an interruption.
+#
+# view() joins a tier with the raw columns for a time range, picking the
+# finest tier that keeps the range within VIEW_POINTS buckets.
+
+ROLLUP_DIR = "rollups"
+RAW_DAYS = float(os.environ["REEF_RAW_DAYS"]) if os.environ.get("REEF_RAW_DAYS") else None
+HOURLY_DAYS = 365
+INTERVAL_SECONDS = 3600
+TIERS = {"hourly": 3600, "daily": 86400}
+STATS = ("min", "mean", "max", "count")
+VIEW_POINTS = 5000
+
+_worker = None
+
+
+def tier_path(directory, tank_name, tier):
+    return timeseries.column_path(os.path.join(directory, tier), tank_name)
+
+
+# Aggregation
+
+def empty(params=()):
+    params = list(params)
+    return {
+        "params": params,
+        "timestamps": np.empty(0, dtype=np.int64),
+        **{s: np.empty((len(params), 0)) for s in STATS},
+        "through": None,
+    }
+
+
+def _reduce(params, timestamps, mins, sums, maxes, counts, seconds):
+    # Combine rows that fall into the same bucket; timestamps need not be sorted
+    buckets = timestamps // seconds * seconds
+    order = np.argsort(buckets, kind="stable")
+    buckets = buckets[order]
+    if not len(buckets):
+        return empty(params)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    count = np.add.reduceat(counts[:, order], starts, axis=1)
+    total = np.add.reduceat(sums[:, order], starts, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+    return {
+        "params": list(params),
+        "timestamps": buckets[starts],
+        "min": np.fmin.reduceat(mins[:, order], starts, axis=1),
+        "mean": mean,
+        "max": np.fmax.reduceat(maxes[:, order], starts, axis=1),
+        "count": count.astype(np.float64),
+        "through": None,
+    }
+
+
+def rollup(cols, seconds):
+    # Bucketed min / mean / max / count of every parameter in cols
+    timestamps = np.asarray(cols["timestamps"])
+    values = np.asarray(cols["values"], dtype=np.float64)
+    keep = timestamps != timeseries.NAT
+    timestamps, values = timestamps[keep], values[:, keep]
+    present = ~np.isnan(values)
+    return _reduce(cols["params"], timestamps, values, np.where(present, values, 0.0), values, present.astype(np.float64), seconds)
+
+
+def _aligned(tier, params):
+    # The tier's stats laid out for params, empty where it has no column
+    n = len(tier["timestamps"])
+    out = {s: np.full((len(params), n), 0.0 if s == "count" else np.nan) for s in STATS}
+    for i, p in enumerate(tier["params"]):
+        j = params.index(p)
+        for s in STATS:
+            out[s][j] = tier[s][i]
+    return out
+
+
+def merge(a, b, seconds):
+    params = list(a["params"]) + [p for p in b["params"] if p not in a["params"]]
+    left, right = _aligned(a, params), _aligned(b, params)
+    joined = {s: np.concatenate([left[s], right[s]], axis=1) for s in STATS}
+    count = joined["count"]
+    merged = _reduce(
+        params, np.concatenate([a["timestamps"], b["timestamps"]]),
+        joined["min"], np.where(count > 0, np.nan_to_num(joined["mean"]) * count, 0.0), joined["max"], count, seconds
+    )
+    merged["through"] = max([t for t in (a["through"], b["through"]) if t is not None], default=None)
+    return merged
+
+
+# Files
+
+def load(directory, tank_name, tier):
+    path = tier_path(directory, tank_name, tier)
+    if not os.path.exists(path):
+        return empty()
+    cols = timeseries.load(path, mmap=False)
+    params = [p.split("|", 1)[1] for p in cols["params"] if p.startswith("min|")]
+    n = len(params)
+    values = np.asarray(cols["values"]).reshape(len(STATS), n, len(cols["timestamps"])) if n else None
+    tier_data = empty(params)
+    tier_data["timestamps"] = np.asarray(cols["timestamps"])
+    for k, s in enumerate(STATS):
+        tier_data[s] = values[k] if n else np.empty((0, len(cols["timestamps"])))
+    tier_data["through"] = cols["meta"].get("through")
+    return tier_data
+
+
+def save(directory, tank_name, tier, tier_data):
+    timeseries.save(tier_path(directory, tank_name, tier), {
+        "params": [f"{s}|{p}" for s in STATS for p in tier_data["params"]],
+        "timestamps": tier_data["timestamps"],
+        "values": np.concatenate([tier_data[s] for s in STATS]).reshape(
+            len(STATS) * len(tier_data["params"]), len(tier_data["timestamps"])
+        ),
+        "meta": {"through": tier_data["through"]},
+    })
+
+
+def load_tiers(directory, tank_name):
+    return {tier: load(directory, tank_name, tier) for tier in TIERS}
+
+
+# Policy
+
+def _date(epoch):
+    return str(np.datetime64(int(epoch), "s").astype("datetime64[D]"))
+
+
+def apply(records, tank_name, prune, directory=ROLLUP_DIR, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS, raw_since=None):
+    # Roll the tank's readings older than raw_days before its latest one
+    # into the tiers, then prune(before) them from the store. Cutoffs fall on
+    # midnight so no daily bucket is split between raw and rolled data.
+    # raw_since is the store's last prune (the tank's "raw_since"). Returns
+    # (readings rolled, readings pruned).
+    cols = timeseries.from_records(records)
+    ts = cols["timestamps"]
+    stamps = ts[ts != timeseries.NAT]
+    if raw_days is None or not len(stamps):
+        return 0, 0
+    tiers = load_tiers(directory, tank_name)
+    through = max([t["through"] for t in tiers.values() if t["through"] is not None], default=None)
+    cutoff = int((stamps.max() - raw_days * 86400) // 86400 * 86400)
+    if through is not None:
+        cutoff = max(cutoff, through)
+    mask = (ts != timeseries.NAT) & (ts < cutoff)
+    if not mask.any():
+        return 0, 0
+    # Everything left below the cutoff is rolled in, including readings
+    # backfilled (e.g. by a CSV import) under an earlier mark. The exception
+    # is a run interrupted between saving its tiers and pruning: its
+    # readings, from the last prune up to its mark, are in the tiers already.
+    pruned_to = timeseries._epoch(raw_since) if raw_since else None
+    if through is not None and (pruned_to is None or pruned_to < through):
+        mask &= ~((ts >= (pruned_to if pruned_to is not None else timeseries.NAT)) & (ts < through))
+    if mask.any() or through != cutoff:
+        rolled = {"params": cols["params"], "timestamps": ts[mask], "values": cols["values"][:, mask]}
+        for tier, seconds in TIERS.items():
+            tier_data = merge(tiers[tier], rollup(rolled, seconds), seconds)
+            tier_data["through"] = cutoff
+            if tier == "hourly" and hourly_days is not None and len(tier_data["timestamps"]):
+                keep = tier_data["timestamps"] >= stamps.max() - hourly_days * 86400
+                tier_data = {**tier_data, "timestamps": tier_data["timestamps"][keep], **{s: tier_data[s][:, keep] for s in STATS}}
+            save(directory, tank_name, tier, tier_data)
+    # Only after the tiers are saved, so an interrupted run never loses data
+    return int(mask.sum()), prune(_date(cutoff))
+
+
+def apply_all(path, backend, directory=ROLLUP_DIR, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS):
+    # One pass over every tank in the store; {tank: (rolled, pruned)}
+    lazy = hasattr(backend, "history")
+    tanks, _ = backend.load(path, with_history=False) if lazy else backend.load(path)
+    results = {}
+    for name, tank in tanks.items():
+        records = backend.history(path, name, "data") if lazy else tank.get("data", [])
+        results[name] = apply(
+            records, name, lambda before, name=name: backend.prune(path, name, before), directory, raw_days, hourly_days,
+            tank.get("raw_since")
+        )
+    return results
+
+
+def start(path, backend, directory=ROLLUP_DIR, raw_days=RAW_DAYS, interval=INTERVAL_SECONDS):
+    # Background thread running apply_all() every interval seconds, started
+    # once per process however many sessions call it
+    global _worker
+    if raw_days is None or (_worker is not None and _worker.is_alive()):
+        return _worker
+
+    def run():
+        while True:
+            try:
+                apply_all(path, backend, directory, raw_days)
+            except Exception as e:
+                print(f"Retention run failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+
+    _worker = threading.Thread(target=run, name="retention", daemon=True)
+    _worker.start()
+    return _worker
+
+
+# Reads
+
+def pick(tiers, start, end):
+    # Finest tier that covers the range from start in at most VIEW_POINTS
+    # buckets, daily otherwise
+    firsts = [int(t["timestamps"][0]) for t in tiers.values() if len(t["timestamps"])]
+    if start is None:
+        start = min(firsts, default=end)
+    for tier, seconds in TIERS.items():
+        stamps = tiers[tier]["timestamps"]
+        if len(stamps) and stamps[0] <= start and (end - start) / seconds <= VIEW_POINTS:
+            return tier
+    return "daily"
+
+
+def view(cols, tiers=None, start=None, end=None, stat="mean"):
+    # (cols, resolution): raw readings from the tiers' "through" mark on,
+    # with the range before it filled from the picked tier. stat is "mean",
+    # "min", "max", or "extremes" (a min and a max row per bucket, for
+    # range checks)
+    raw = timeseries.window(cols, start, end)
+    through = max([t["through"] for t in (tiers or {}).values() if t["through"] is not None], default=None)
+    start_s = None if start is None else int(timeseries._epoch(start))
+    if through is None or (start_s is not None and start_s >= through):
+        return raw, "raw"
+    end_s = int(timeseries._epoch(end)) if end is not None else (
+        int(raw["timestamps"][-1]) if len(raw["timestamps"]) else through
+    )
+    tier = pick(tiers, start_s, end_s)
+    data = tiers[tier]
+    mask = data["timestamps"] < through
+    if start_s is not None:
+        mask &= data["timestamps"] >= start_s
+    parts = ["min", "max"] if stat == "extremes" else [stat]
+    older = {
+        "params": data["params"],
+        "timestamps": np.concatenate([data["timestamps"][mask]] * len(parts)),
+        "values": np.concatenate([data[s][:, mask] for s in parts], axis=1),
+    }
+    order = np.argsort(older["timestamps"], kind="stable")
+    older = timeseries.take(older, order)
+    return timeseries.concat(older, raw), tier
+
+
+if __name__ == "__main__":
+    # python retention.py [reef_data.json | reef_data.db | reef_shards/manifest.json] RAW_DAYS
+    import probe_service
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    raw_days = float(sys.argv[2]) if len(sys.argv) > 2 else RAW_DAYS
+    if raw_days is None:
+        sys.exit("usage: python retention.py <store> RAW_DAYS (or set REEF_RAW_DAYS)")
+    start_time = time.perf_counter()
+    results = apply_all(path, probe_service.backend_for(path), raw_days=raw_days)
+    for name, (rolled, pruned) in results.items():
+        print(f"{name}: {rolled} readings rolled up, {pruned} pruned")
+    print(f"Done in {time.perf_counter() - start_time:.1f}s")
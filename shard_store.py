@@ -0,0 +1,327 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import sys
+
+import storage
+
+# Sharded storage backend
+#
+# A small manifest (reef_shards/manifest.json) holds every tank's metadata
+# and the custom modes; each tank's readings, maintenance and diary live in
+# their own shard under reef_shards/tanks/, with a journal of appended
+# records next to it. Opening the app reads only the manifest, a tank's
+# shard is read the first time its history is queried (and kept in memory
+# until it changes on disk), and a save rewrites only the shards and
+# manifest entries of tanks that changed.
+#
+# Same load/save/append/put_tank/put_modes and history queries as
+# sqlite_store.py. Writers lock the manifest before a shard, and every write
+# bumps the tank's revision in the manifest so sessions merge as in
+# storage.py.
+
+COLLECTIONS = storage.COLLECTIONS
+SHARD_DIR = "tanks"
+
+_shards = {}
+
+
+def shard_path(path, tank_name):
+    # Readable and filesystem safe, with a hash so distinct names never collide
+    slug = re.sub(r"[^a-z0-9]+", "-", tank_name.lower()).strip("-")[:40] or "tank"
+    digest = hashlib.sha1(tank_name.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(os.path.dirname(path), SHARD_DIR, f"{slug}-{digest}.json")
+
+
+def _meta(tank):
+    return {k: v for k, v in tank.items() if k not in COLLECTIONS}
+
+
+# Manifest
+
+def _read_manifest(path):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {"tanks": {}, "custom_modes": {}}
+
+
+def _write_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    storage.write_json(path, manifest)
+
+
+def _bump(manifest, tank_name):
+    meta = manifest["tanks"].setdefault(tank_name, {})
+    meta["revision"] = meta.get("revision", 0) + 1
+
+
+# Shards
+
+def _stamp(shard):
+    stamp = []
+    for p in (shard, storage.journal_path(shard)):
+        try:
+            st = os.stat(p)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _read_shard(shard):
+    # {collection: records} with readings in date order, cached until the
+    # shard or its journal changes
+    with storage.locked(shard, exclusive=False):
+        stamp = _stamp(shard)
+        cached = _shards.get(shard)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        doc = {}
+        if os.path.exists(shard):
+            with open(shard, "r") as f:
+                doc = json.load(f)
+        records = {c: doc.get(c, []) for c in COLLECTIONS}
+        jpath = storage.journal_path(shard)
+        if os.path.exists(jpath):
+            with open(jpath, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from an interrupted append
+                        continue
+                    records[entry["collection"]].append(entry["record"])
+    records["data"].sort(key=lambda r: str(r.get("Date")))
+    records["dates"] = [str(r.get("Date")) for r in records["data"]]
+    _shards[shard] = (stamp, records)
+    return records
+
+
+def _write_shard(shard, records):
+    os.makedirs(os.path.dirname(shard), exist_ok=True)
+    storage.write_json(shard, {c: records.get(c, []) for c in COLLECTIONS})
+    jpath = storage.journal_path(shard)
+    if os.path.exists(jpath):
+        os.remove(jpath)
+
+
+def compact(shard):
+    with storage.locked(shard):
+        records = _read_shard(shard)
+        _write_shard(shard, records)
+
+
+# Writes
+
+def _dirty(tank, described):
+    if described is None or tank.get("revision", 0) != described["revision"]:
+        return True
+    fields, removed = storage.changes(tank, described)
+    return bool(fields or removed)
+
+
+def save(path, tanks, custom_modes, base=None):
+    # Without a base every tank is written as given. With the session's base
+    # (storage.base_of) tanks it has not changed are skipped, and changed ones
+    # are merged as in storage.save; returns {tank: conflicting fields}
+    conflicts = {}
+    with storage.locked(path):
+        manifest = _read_manifest(path)
+        described = base["tanks"] if base is not None else {}
+        for name, tank in tanks.items():
+            if base is not None and not _dirty(tank, described.get(name)):
+                continue
+            shard = shard_path(path, name)
+            with storage.locked(shard):
+                current = manifest["tanks"].get(name)
+                if current is not None and any(c in tank for c in COLLECTIONS):
+                    stored = _read_shard(shard)
+                    current = {**current, **{c: list(stored[c]) for c in COLLECTIONS}}
+                if base is None:
+                    merged = dict(tank)
+                else:
+                    merged, clashes = storage.merge_tank(current, tank, described.get(name))
+                    if clashes:
+                        conflicts[name] = clashes
+                    if merged is None:
+                        continue
+                    tank["revision"] = merged["revision"]
+                if any(c in tank for c in COLLECTIONS):
+                    _write_shard(shard, merged)
+                manifest["tanks"][name] = _meta(merged)
+        if base is None:
+            for name in set(manifest["tanks"]) - set(tanks):
+                del manifest["tanks"][name]
+            manifest["custom_modes"] = custom_modes
+        else:
+            manifest["custom_modes"] = storage.merge_modes(manifest["custom_modes"], custom_modes, base["custom_modes"])
+        _write_manifest(path, manifest)
+    if base is not None:
+        base.update(storage.base_of(tanks, custom_modes))
+    return conflicts
+
+
+def append(path, tank_name, collection, record):
+    shard = shard_path(path, tank_name)
+    with storage.locked(path):
+        with storage.locked(shard):
+            os.makedirs(os.path.dirname(shard), exist_ok=True)
+            jpath = storage.journal_path(shard)
+            with open(jpath, "a") as f:
+                f.write(json.dumps({"collection": collection, "record": record}, default=str) + "\n")
+            if os.path.getsize(jpath) > storage.COMPACT_BYTES:
+                compact(shard)
+        manifest = _read_manifest(path)
+        _bump(manifest, tank_name)
+        _write_manifest(path, manifest)
+
+
+def append_many(path, tank_name, collection, records):
+    # Bulk imports rewrite the shard once, readings merged in date order
+    shard = shard_path(path, tank_name)
+    with storage.locked(path):
+        with storage.locked(shard):
+            stored = _read_shard(shard)
+            merged = {c: list(stored[c]) for c in COLLECTIONS}
+            before = len(merged[collection])
+            merged[collection].extend(records)
+            count = len(merged[collection]) - before
+            if count:
+                merged["data"].sort(key=lambda r: str(r.get("Date")))
+                _write_shard(shard, merged)
+        if count:
+            manifest = _read_manifest(path)
+            _bump(manifest, tank_name)
+            _write_manifest(path, manifest)
+    return count
+
+
+def prune(path, tank_name, before):
+    # Drop readings dated before `before` (rolled up by retention.py);
+    # returns how many were removed
+    shard = shard_path(path, tank_name)
+    with storage.locked(path):
+        with storage.locked(shard):
+            stored = _read_shard(shard)
+            kept = {c: list(stored[c]) for c in COLLECTIONS}
+            kept["data"] = [r for r in kept["data"] if not storage.pruned(r, before)]
+            removed = len(stored["data"]) - len(kept["data"])
+            if removed:
+                _write_shard(shard, kept)
+        manifest = _read_manifest(path)
+        # raw_since also records an empty prune, so retention.py knows it ran
+        if removed or manifest["tanks"].get(tank_name, {}).get("raw_since") != before:
+            _bump(manifest, tank_name)
+            manifest["tanks"][tank_name]["raw_since"] = before
+            _write_manifest(path, manifest)
+    return removed
+
+
+def put_tank(path, tank_name, fields, base=None):
+    # Metadata only; collections are written record by record
+    with storage.locked(path):
+        manifest = _read_manifest(path)
+        if base is None:
+            manifest["tanks"][tank_name] = _meta(fields)
+        else:
+            merged, _ = storage.merge_tank(manifest["tanks"].get(tank_name), _meta(fields), base["tanks"].get(tank_name))
+            if merged is None:
+                base["tanks"][tank_name] = storage.describe(fields)
+                return
+            manifest["tanks"][tank_name] = _meta(merged)
+            fields["revision"] = merged["revision"]
+        _write_manifest(path, manifest)
+    if base is not None:
+        base["tanks"][tank_name] = storage.describe(fields)
+
+
+def put_modes(path, custom_modes, base=None):
+    with storage.locked(path):
+        manifest = _read_manifest(path)
+        if base is None:
+            manifest["custom_modes"] = custom_modes
+        else:
+            manifest["custom_modes"] = storage.merge_modes(manifest["custom_modes"], custom_modes, base["custom_modes"])
+        _write_manifest(path, manifest)
+    if base is not None:
+        base["custom_modes"] = storage.base_of({}, custom_modes)["custom_modes"]
+
+
+# Reads
+
+def _in_range(records, start, end):
+    return [
+        r for r in records
+        if (start is None or str(r.get("Date")) >= str(start)) and (end is None or str(r.get("Date")) <= str(end))
+    ]
+
+
+def readings(path, tank_name, start=None, end=None, params=None):
+    stored = _read_shard(shard_path(path, tank_name))
+    lo = 0 if start is None else bisect.bisect_left(stored["dates"], str(start))
+    hi = len(stored["dates"]) if end is None else bisect.bisect_right(stored["dates"], str(end))
+    data = stored["data"][lo:hi]
+    if params:
+        keep = {"Date", *params}
+        data = [{k: v for k, v in r.items() if k in keep} for r in data]
+    return data
+
+
+def timestamps(path, tank_name):
+    return set(_read_shard(shard_path(path, tank_name))["dates"])
+
+
+def latest_reading(path, tank_name):
+    data = _read_shard(shard_path(path, tank_name))["data"]
+    return data[-1] if data else {}
+
+
+def maintenance(path, tank_name, start=None, end=None, task=None):
+    records = _in_range(_read_shard(shard_path(path, tank_name))["maintenance"], start, end)
+    if task:
+        records = [r for r in records if task.lower() in str(r.get("Task", "")).lower()]
+    return records
+
+
+def diary_page(path, tank_name, offset=0, limit=20):
+    # One page of diary entries, newest first, and the total entry count
+    diary = _read_shard(shard_path(path, tank_name))["diary"]
+    order = sorted(range(len(diary)), key=lambda i: (str(diary[i].get("Date", "")), i), reverse=True)
+    return [diary[i] for i in order[offset:offset + limit]], len(diary)
+
+
+def history(path, tank_name, collection, start=None, end=None):
+    if collection == "data":
+        return readings(path, tank_name, start, end)
+    return _in_range(_read_shard(shard_path(path, tank_name))[collection], start, end)
+
+
+def load(path, with_history=True):
+    # with_history=False reads only the manifest; the collection keys are
+    # left out so a later save() does not touch the shards
+    with storage.locked(path, exclusive=False):
+        manifest = _read_manifest(path)
+    tanks = {}
+    for name, meta in manifest["tanks"].items():
+        tank = dict(meta)
+        if with_history:
+            stored = _read_shard(shard_path(path, name))
+            tank.update({c: list(stored[c]) for c in COLLECTIONS})
+        tanks[name] = tank
+    return tanks, manifest["custom_modes"]
+
+
+def migrate(json_path, manifest_path):
+    # One-shot split of reef_data.json (plus any pending journal) into shards
+    tanks, custom_modes = storage.load(json_path)
+    save(manifest_path, tanks, custom_modes)
+    return len(tanks)
+
+
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.splitext(src)[0] + "_shards", "manifest.json")
+    print(f"Migrated {migrate(src, dst)} tanks from {src} to {dst}")
@@ -0,0 +1,430 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import storage
+
+# SQLite storage backend
+#
+# Same load/save/append/put_tank/put_modes functions as storage.py, plus
+# indexed queries so callers can fetch one tank's rows (or a time range of
+# them) without loading every tank's history.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tanks (
+    name TEXT PRIMARY KEY,
+    meta TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    tank TEXT NOT NULL,
+    entry INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    parameter TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS idx_readings_tank_time ON readings (tank, timestamp);
+CREATE INDEX IF NOT EXISTS idx_readings_entry ON readings (entry);
+CREATE TABLE IF NOT EXISTS maintenance (
+    id INTEGER PRIMARY KEY,
+    tank TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    task TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_maintenance_tank_time ON maintenance (tank, timestamp);
+CREATE TABLE IF NOT EXISTS diary (
+    id INTEGER PRIMARY KEY,
+    tank TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_diary_tank_time ON diary (tank, timestamp);
+CREATE TABLE IF NOT EXISTS custom_modes (
+    mode TEXT NOT NULL,
+    parameter TEXT NOT NULL,
+    low REAL,
+    high REAL,
+    PRIMARY KEY (mode, parameter)
+);
+"""
+
+COLLECTIONS = storage.COLLECTIONS
+# Parameter of the row that stands in for a reading with every field blank
+BLANK = ""
+
+_local = threading.local()
+_schemas = set()
+_schema_lock = threading.Lock()
+
+
+def connect(path):
+    # One connection per thread and database file, kept open and reused; the
+    # schema is created once per file (again if the file is replaced)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = os.path.abspath(path)
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        inode = None
+    cached = conns.get(key)
+    if cached is not None:
+        if cached[0] == inode:
+            return cached[1]
+        cached[1].close()
+    conn = sqlite3.connect(path)
+    inode = os.stat(path).st_ino
+    with _schema_lock:
+        if (key, inode) not in _schemas:
+            conn.executescript(SCHEMA)
+            _schemas.add((key, inode))
+    conns[key] = (inode, conn)
+    return conn
+
+
+def _meta(tank):
+    return json.dumps({k: v for k, v in tank.items() if k not in COLLECTIONS}, default=str)
+
+
+def _put_meta(conn, tank_name, meta):
+    # An upsert keeps the row's rowid, and with it the tank's place in load()
+    conn.execute(
+        "INSERT INTO tanks (name, meta) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET meta = excluded.meta",
+        (tank_name, meta)
+    )
+
+
+# Writes
+
+def _insert_reading(conn, tank_name, record, entry=None):
+    if entry is None:
+        entry = conn.execute("SELECT COALESCE(MAX(entry), 0) + 1 FROM readings").fetchone()[0]
+    timestamp = str(record.get("Date", ""))
+    rows = [
+        (tank_name, entry, timestamp, param, value)
+        for param, value in record.items()
+        if param != "Date" and value not in (None, "")
+    ]
+    if not rows:
+        # Kept as a bare dated reading, like the other backends do
+        rows = [(tank_name, entry, timestamp, BLANK, None)]
+    conn.executemany(
+        "INSERT INTO readings (tank, entry, timestamp, parameter, value) VALUES (?, ?, ?, ?, ?)", rows
+    )
+
+
+def _insert(conn, tank_name, collection, record, entry=None):
+    if collection == "data":
+        _insert_reading(conn, tank_name, record, entry)
+    elif collection == "maintenance":
+        conn.execute(
+            "INSERT INTO maintenance (tank, timestamp, task, record) VALUES (?, ?, ?, ?)",
+            (tank_name, str(record.get("Date", "")), record.get("Task", ""), json.dumps(record, default=str))
+        )
+    elif collection == "diary":
+        conn.execute(
+            "INSERT INTO diary (tank, timestamp, record) VALUES (?, ?, ?)",
+            (tank_name, str(record.get("Date", "")), json.dumps(record, default=str))
+        )
+
+
+def _write_modes(conn, custom_modes):
+    conn.execute("DELETE FROM custom_modes")
+    conn.executemany(
+        "INSERT INTO custom_modes (mode, parameter, low, high) VALUES (?, ?, ?, ?)",
+        [(mode, param, low, high) for mode, params in custom_modes.items() for param, (low, high) in params.items()]
+    )
+
+
+def _stored_form(record):
+    # A reading as _readings() returns it: text Date, numbers as floats,
+    # blanks dropped (as the REAL column stores them)
+    stored = {}
+    for param, value in record.items():
+        if param == "Date":
+            stored[param] = str(value)
+        elif value not in (None, ""):
+            try:
+                stored[param] = float(value)
+            except (TypeError, ValueError):
+                stored[param] = value
+    return stored
+
+
+def _reading_key(record):
+    return storage._canonical(_stored_form(record))
+
+
+def _merge_save(conn, tanks, custom_modes, base):
+    conflicts = {}
+    conn.execute("BEGIN IMMEDIATE")
+    for name, tank in tanks.items():
+        row = conn.execute("SELECT meta FROM tanks WHERE name = ?", (name,)).fetchone()
+        meta = {k: v for k, v in tank.items() if k not in COLLECTIONS}
+        merged, clashes = storage.merge_tank(json.loads(row[0]) if row else None, meta, base["tanks"].get(name))
+        if clashes:
+            conflicts[name] = clashes
+        if merged is not None:
+            _put_meta(conn, name, _meta(merged))
+            tank["revision"] = merged["revision"]
+        # Readings older than a retention prune stay pruned
+        since = json.loads(row[0]).get("raw_since") if row else None
+        for collection, table in zip(COLLECTIONS, ("readings", "maintenance", "diary")):
+            if collection in tank:
+                if collection == "data":
+                    new = storage._new_records(_readings(conn, name), tank[collection], key=_reading_key)
+                else:
+                    new = storage._new_records(_records(conn, table, name), tank[collection])
+                for record in new:
+                    if collection == "data" and storage.pruned(record, since):
+                        continue
+                    _insert(conn, name, collection, record)
+    current = load_modes(conn)
+    _write_modes(conn, storage.merge_modes(current, custom_modes, base["custom_modes"]))
+    return conflicts
+
+
+def save(path, tanks, custom_modes, base=None):
+    # Tanks loaded without history (see load) keep their stored rows. With
+    # the session's base (storage.base_of) only its changes are merged in,
+    # as in storage.save
+    conn = connect(path)
+    if base is not None:
+        with conn:
+            conflicts = _merge_save(conn, tanks, custom_modes, base)
+        base.update(storage.base_of(tanks, custom_modes))
+        return conflicts
+    with conn:
+        names = list(tanks)
+        conn.execute(
+            f"DELETE FROM tanks WHERE name NOT IN ({','.join('?' * len(names))})", names
+        )
+        for table in ("readings", "maintenance", "diary"):
+            conn.execute(f"DELETE FROM {table} WHERE tank NOT IN ({','.join('?' * len(names))})", names)
+        entry = conn.execute("SELECT COALESCE(MAX(entry), 0) FROM readings").fetchone()[0]
+        for name, tank in tanks.items():
+            _put_meta(conn, name, _meta(tank))
+            for collection, table in zip(COLLECTIONS, ("readings", "maintenance", "diary")):
+                if collection not in tank:
+                    continue
+                conn.execute(f"DELETE FROM {table} WHERE tank = ?", (name,))
+                for record in tank[collection]:
+                    entry += 1
+                    _insert(conn, name, collection, record, entry)
+        _write_modes(conn, custom_modes)
+    return {}
+
+
+def _bump(conn, tank_name):
+    conn.execute(
+        "UPDATE tanks SET meta = json_set(meta, '$.revision', COALESCE(json_extract(meta, '$.revision'), 0) + 1) "
+        "WHERE name = ?", (tank_name,)
+    )
+
+
+def append(path, tank_name, collection, record):
+    conn = connect(path)
+    with conn:
+        # Take the write lock before reading MAX(entry) for the new reading
+        conn.execute("BEGIN IMMEDIATE")
+        _insert(conn, tank_name, collection, record)
+        _bump(conn, tank_name)
+
+
+def append_many(path, tank_name, collection, records):
+    # records may be a generator; everything goes in one transaction
+    conn = connect(path)
+    count = 0
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        entry = conn.execute("SELECT COALESCE(MAX(entry), 0) FROM readings").fetchone()[0]
+        for record in records:
+            entry += 1
+            count += 1
+            _insert(conn, tank_name, collection, record, entry)
+        _bump(conn, tank_name)
+    return count
+
+
+def timestamps(path, tank_name):
+    conn = connect(path)
+    return {r[0] for r in conn.execute("SELECT DISTINCT timestamp FROM readings WHERE tank = ?", (tank_name,))}
+
+
+def prune(path, tank_name, before):
+    # Drop readings dated before `before` (rolled up by retention.py);
+    # returns how many were removed
+    conn = connect(path)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # Dates compared as times, as in storage.pruned, not as text
+        entries = [
+            (entry,) for entry, timestamp in
+            conn.execute("SELECT DISTINCT entry, timestamp FROM readings WHERE tank = ?", (tank_name,))
+            if storage.pruned({"Date": timestamp}, before)
+        ]
+        removed = len(entries)
+        conn.executemany("DELETE FROM readings WHERE entry = ?", entries)
+        row = conn.execute("SELECT json_extract(meta, '$.raw_since') FROM tanks WHERE name = ?", (tank_name,)).fetchone()
+        # raw_since also records an empty prune, so retention.py knows it ran
+        if removed or (row is not None and row[0] != before):
+            conn.execute("UPDATE tanks SET meta = json_set(meta, '$.raw_since', ?) WHERE name = ?", (before, tank_name))
+            _bump(conn, tank_name)
+    return removed
+
+
+def put_tank(path, tank_name, fields, base=None):
+    # With the session's base only the changed fields are merged in
+    conn = connect(path)
+    with conn:
+        if base is None:
+            _put_meta(conn, tank_name, _meta(fields))
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT meta FROM tanks WHERE name = ?", (tank_name,)).fetchone()
+            meta = {k: v for k, v in fields.items() if k not in COLLECTIONS}
+            merged, _ = storage.merge_tank(json.loads(row[0]) if row else None, meta, base["tanks"].get(tank_name))
+            if merged is not None:
+                _put_meta(conn, tank_name, _meta(merged))
+                fields["revision"] = merged["revision"]
+    if base is not None:
+        base["tanks"][tank_name] = storage.describe(fields)
+
+
+def put_modes(path, custom_modes, base=None):
+    conn = connect(path)
+    with conn:
+        if base is None:
+            _write_modes(conn, custom_modes)
+        else:
+            conn.execute("BEGIN IMMEDIATE")
+            _write_modes(conn, storage.merge_modes(load_modes(conn), custom_modes, base["custom_modes"]))
+    if base is not None:
+        base["custom_modes"] = storage.base_of({}, custom_modes)["custom_modes"]
+
+
+# Reads
+
+def _range(start, end):
+    clauses, args = [], []
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        args.append(str(start))
+    if end is not None:
+        clauses.append("timestamp <= ?")
+        args.append(str(end))
+    return "".join(f" AND {c}" for c in clauses), args
+
+
+def _readings(conn, tank_name, start=None, end=None, params=None):
+    where, args = _range(start, end)
+    if params:
+        where += f" AND parameter IN ({','.join('?' * len(params))})"
+        args += list(params)
+    rows = conn.execute(
+        f"SELECT entry, timestamp, parameter, value FROM readings WHERE tank = ?{where} ORDER BY timestamp, entry",
+        [tank_name] + args
+    )
+    records = {}
+    for entry, timestamp, param, value in rows:
+        record = records.setdefault(entry, {"Date": timestamp})
+        if param != BLANK:
+            record[param] = value
+    return list(records.values())
+
+
+def _records(conn, table, tank_name, start=None, end=None):
+    where, args = _range(start, end)
+    rows = conn.execute(f"SELECT record FROM {table} WHERE tank = ?{where} ORDER BY id", [tank_name] + args)
+    return [json.loads(r[0]) for r in rows]
+
+
+def readings(path, tank_name, start=None, end=None, params=None):
+    conn = connect(path)
+    return _readings(conn, tank_name, start, end, params)
+
+
+def latest_reading(path, tank_name):
+    conn = connect(path)
+    row = conn.execute(
+        "SELECT entry FROM readings WHERE tank = ? ORDER BY timestamp DESC, entry DESC LIMIT 1", (tank_name,)
+    ).fetchone()
+    if row is None:
+        return {}
+    record = {}
+    for timestamp, param, value in conn.execute(
+        "SELECT timestamp, parameter, value FROM readings WHERE entry = ?", (row[0],)
+    ):
+        record.setdefault("Date", timestamp)
+        if param != BLANK:
+            record[param] = value
+    return record
+
+
+def maintenance(path, tank_name, start=None, end=None, task=None):
+    conn = connect(path)
+    where, args = _range(start, end)
+    if task:
+        where += " AND task LIKE ?"
+        args.append(f"%{task}%")
+    rows = conn.execute(
+        f"SELECT record FROM maintenance WHERE tank = ?{where} ORDER BY id", [tank_name] + args
+    )
+    return [json.loads(r[0]) for r in rows]
+
+
+def diary_page(path, tank_name, offset=0, limit=20):
+    # One page of diary entries, newest first, and the total entry count
+    conn = connect(path)
+    total = conn.execute("SELECT COUNT(*) FROM diary WHERE tank = ?", (tank_name,)).fetchone()[0]
+    rows = conn.execute(
+        "SELECT record FROM diary WHERE tank = ? ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+        (tank_name, limit, offset)
+    )
+    return [json.loads(r[0]) for r in rows], total
+
+
+def history(path, tank_name, collection, start=None, end=None):
+    conn = connect(path)
+    if collection == "data":
+        return _readings(conn, tank_name, start, end)
+    return _records(conn, collection, tank_name, start, end)
+
+
+def load_modes(conn):
+    custom_modes = {}
+    for mode, param, low, high in conn.execute("SELECT mode, parameter, low, high FROM custom_modes"):
+        custom_modes.setdefault(mode, {})[param] = (low, high)
+    return custom_modes
+
+
+def load(path, with_history=True):
+    # with_history=False returns tank metadata only; the collection keys are left
+    # out so a later save() does not touch the stored rows
+    conn = connect(path)
+    tanks = {}
+    for name, meta in conn.execute("SELECT name, meta FROM tanks ORDER BY rowid"):
+        tank = json.loads(meta)
+        if with_history:
+            tank["data"] = _readings(conn, name)
+            tank["maintenance"] = _records(conn, "maintenance", name)
+            tank["diary"] = _records(conn, "diary", name)
+        tanks[name] = tank
+    return tanks, load_modes(conn)
+
+
+def migrate(json_path, db_path):
+    # One-shot import of reef_data.json (plus any pending journal) into SQLite
+    tanks, custom_modes = storage.load(json_path)
+    save(db_path, tanks, custom_modes)
+    return len(tanks)
+
+
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    dst = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0] + ".db"
+    print(f"Migrated {migrate(src, dst)} tanks from {src} to {dst}")
@@ -0,0 +1,135 @@
+import math
+import sys
+from datetime import datetime
+
+# Incremental per-parameter statistics, kept in tank["reading_stats"]
+#
+# For each parameter the last ROLLING_WINDOW readings are kept, so logging a
+# reading is O(1). summary() computes the rolling mean, standard deviation
+# and least-squares slope from that window about its means, rather than from
+# running sums, which lose precision when large values nearly cancel (e.g.
+# salinity around 1.025, or sums that have had thousands of readings added
+# and taken out). The EWMA runs over the whole history.
+
+ROLLING_WINDOW = 14
+EWMA_ALPHA = 0.3
+SECONDS_PER_DAY = 86400.0
+
+
+def empty():
+    return {"readings": 0, "origin": None, "params": {}}
+
+
+def _number(value):
+    if value in (None, "", "N/A"):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _day(state, date):
+    # Days since the first reading; a local origin keeps the sums small
+    try:
+        ts = datetime.fromisoformat(str(date)).timestamp()
+    except ValueError:
+        return None
+    if state["origin"] is None:
+        state["origin"] = ts
+    return (ts - state["origin"]) / SECONDS_PER_DAY
+
+
+def _push(acc, t, y):
+    acc["window"].append([t, y])
+    if len(acc["window"]) > ROLLING_WINDOW:
+        acc["window"].pop(0)
+    acc["ewma"] = y if acc["ewma"] is None else EWMA_ALPHA * y + (1 - EWMA_ALPHA) * acc["ewma"]
+    acc["count"] += 1
+
+
+def update(state, record):
+    state["readings"] += 1
+    t = _day(state, record.get("Date"))
+    if t is None:
+        return state
+    for param, value in record.items():
+        y = _number(value) if param != "Date" else None
+        if y is None:
+            continue
+        acc = state["params"].setdefault(param, {"window": [], "ewma": None, "count": 0})
+        _push(acc, t, y)
+    return state
+
+
+def rebuild(records):
+    state = empty()
+    for record in records:
+        update(state, record)
+    return state
+
+
+def ensure(tank):
+    # Rebuild when missing or out of step with the loaded readings
+    state = tank.get("reading_stats")
+    if "data" in tank and (not state or state.get("readings") != len(tank["data"])):
+        state = tank["reading_stats"] = rebuild(tank["data"])
+    return state or empty()
+
+
+def summary(state):
+    rows = {}
+    for param, acc in state["params"].items():
+        n = len(acc["window"])
+        if not n:
+            continue
+        mean = sum(y for _, y in acc["window"]) / n
+        mean_t = sum(t for t, _ in acc["window"]) / n
+        # Deviations from the means, so nothing large is subtracted
+        syy = sum((y - mean) ** 2 for _, y in acc["window"])
+        stt = sum((t - mean_t) ** 2 for t, _ in acc["window"])
+        sty = sum((t - mean_t) * (y - mean) for t, y in acc["window"])
+        std = math.sqrt(syy / (n - 1)) if n > 1 else 0.0
+        slope = sty / stt if n > 1 and stt > 1e-12 else 0.0
+        rows[param] = {
+            "mean": mean,
+            "std": std,
+            "ewma": acc["ewma"],
+            "slope_per_day": slope,
+            "window": n,
+            "count": acc["count"]
+        }
+    return rows
+
+
+def frame(state):
+    # summary() as a DataFrame, one row per parameter
+    import pandas as pd
+
+    return pd.DataFrame(summary(state)).T
+
+
+def verify(tank):
+    # Largest difference between the stored summary and one rebuilt from history
+    stored = summary(tank.get("reading_stats") or empty())
+    fresh = summary(rebuild(tank.get("data", [])))
+    drift = 0.0
+    for param, row in fresh.items():
+        for key, value in row.items():
+            drift = max(drift, abs(value - stored.get(param, {}).get(key, math.inf)))
+    return drift
+
+
+if __name__ == "__main__":
+    # python stats.py [reef_data.json] - rebuild every tank's statistics and
+    # report how far the incrementally maintained ones had drifted
+    import storage
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    tanks, custom_modes = storage.load(path)
+    for name, tank in tanks.items():
+        print(f"{name}: max drift {verify(tank):.3g}")
+        tank["reading_stats"] = rebuild(tank.get("data", []))
+    storage.save(path, tanks, custom_modes)
+    print(f"Rebuilt statistics for {len(tanks)} tanks in {path}")
@@ -0,0 +1,453 @@
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import packed
+import timeseries
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, writes are still atomic renames
+    fcntl = None
+
+# Journal-backed storage for reef_data.json
+#
+# The snapshot keeps the original {"tanks": ..., "custom_modes": ...} layout.
+# New readings, maintenance and diary entries are appended as one JSON line
+# to a journal next to the snapshot, and replayed on load. Once the journal
+# grows past COMPACT_BYTES it is folded back into the snapshot. A snapshot
+# path ending in .reef is written in packed.py's binary format instead.
+#
+# Several Streamlit sessions (or processes) may write at once. Writers take
+# an exclusive advisory lock on <path>.lock and readers a shared one, the
+# snapshot is replaced by an atomic rename, and every write bumps the
+# tank's "revision". Sessions pass base_of() the state they loaded to
+# save() / put_tank() / put_modes(), so only what they changed is written
+# and merged into the current state: metadata field by field, records by
+# appending the ones not stored yet.
+
+COLLECTIONS = ("data", "maintenance", "diary")
+COMPACT_BYTES = 256 * 1024
+
+_held = threading.local()
+
+
+def journal_path(path):
+    # reef_data.json -> reef_data.journal.jsonl; a packed reef_data.reef
+    # keeps its own reef_data.reef.journal.jsonl
+    if packed.is_packed(path):
+        return path + ".journal.jsonl"
+    return os.path.splitext(path)[0] + ".journal.jsonl"
+
+
+# Locking
+
+@contextmanager
+def locked(path, exclusive=True):
+    # Re-entrant per thread; other threads and processes wait for the lock
+    held = _held.__dict__.setdefault("locks", {})
+    key = os.path.abspath(path) + ".lock"
+    if key in held:
+        yield
+        return
+    os.makedirs(os.path.dirname(key), exist_ok=True)
+    with open(key, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        held[key] = True
+        try:
+            yield
+        finally:
+            del held[key]
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Change tracking
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def describe(tank):
+    return {
+        "revision": tank.get("revision", 0),
+        "fields": {k: _canonical(v) for k, v in tank.items() if k not in COLLECTIONS}
+    }
+
+
+def base_of(tanks, custom_modes):
+    # What a session loaded, to merge its later writes against
+    return {
+        "tanks": {name: describe(tank) for name, tank in tanks.items()},
+        "custom_modes": {mode: _canonical(ranges) for mode, ranges in custom_modes.items()}
+    }
+
+
+def changes(tank, described):
+    # (changed metadata fields, removed field names) since described
+    old = (described or {}).get("fields", {})
+    fields = {
+        k: v for k, v in tank.items()
+        if k not in COLLECTIONS and k != "revision" and _canonical(v) != old.get(k)
+    }
+    removed = [k for k in old if k not in tank and k != "revision"]
+    return fields, removed
+
+
+def pruned(record, since):
+    # Whether a retention prune up to since (see retention.py) removes the
+    # record; dates are compared as times, and unparseable ones are kept
+    stamp = timeseries._epoch(record.get("Date"))
+    return since is not None and stamp != timeseries.NAT and stamp < timeseries._epoch(since)
+
+
+def _new_records(stored, records, key=_canonical):
+    # records not in stored yet (as a multiset, so genuine repeats survive);
+    # key gives both sides the same form when the store changes records
+    remaining = Counter(key(r) for r in stored)
+    new = []
+    for record in records:
+        key_ = key(record)
+        if remaining[key_]:
+            remaining[key_] -= 1
+        else:
+            new.append(record)
+    return new
+
+
+def merge_tank(current, tank, described):
+    # Apply a session's changes to the stored tank (None when new); returns
+    # (merged tank or None when nothing changed, conflicting field names)
+    fields, removed = changes(tank, described)
+    current = dict(current or {})
+    if described and current.get("revision", 0) == described["revision"]:
+        # Nobody else wrote this tank since it was loaded, so the session's
+        # records are current as they are (including any reordering)
+        records = {c: tank[c] for c in COLLECTIONS if c in tank}
+        changed = any(records[c] != current.get(c, []) for c in records)
+        conflicts = []
+    else:
+        records = {
+            c: list(current.get(c, [])) + _new_records(current.get(c, []), tank[c])
+            for c in COLLECTIONS if c in tank
+        }
+        # Readings older than a retention prune (see retention.py) stay pruned
+        since = current.get("raw_since")
+        if since and "data" in records:
+            records["data"] = [r for r in records["data"] if not pruned(r, since)]
+        changed = any(len(records[c]) != len(current.get(c, [])) for c in records) or not current
+        # Fields both sides changed go to this session (last writer)
+        old = (described or {}).get("fields", {})
+        conflicts = [k for k in fields if described and k in current and _canonical(current[k]) != old.get(k)]
+    if not (changed or fields or removed):
+        return None, []
+    current.update(fields)
+    current.update(records)
+    for k in removed:
+        current.pop(k, None)
+    for c in COLLECTIONS:
+        current.setdefault(c, [])
+    current["revision"] = max(current.get("revision", 0) + 1, tank.get("revision", 0))
+    return current, conflicts
+
+
+def merge_modes(current, custom_modes, described):
+    # Modes this session added, edited or deleted since described
+    merged = dict(current)
+    for mode, ranges in custom_modes.items():
+        if _canonical(ranges) != described.get(mode):
+            merged[mode] = ranges
+    for mode in described:
+        if mode not in custom_modes:
+            merged.pop(mode, None)
+    return merged
+
+
+# Reads
+
+def _read_snapshot(path):
+    if os.path.exists(path) and packed.is_packed(path):
+        tanks, custom_modes = packed.read(path)
+        return {"tanks": tanks, "custom_modes": custom_modes}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def _apply(tanks, custom_modes, entry):
+    op = entry.get("op")
+    if op == "append":
+        tank = tanks.setdefault(entry["tank"], {})
+        tank.setdefault(entry["collection"], []).append(entry["record"])
+        tank["revision"] = tank.get("revision", 0) + 1
+    elif op == "tank":
+        tank = tanks.setdefault(entry["tank"], {})
+        tank.update(entry["fields"])
+        for k in entry.get("removed", []):
+            tank.pop(k, None)
+        if entry.get("bump"):
+            tank["revision"] = tank.get("revision", 0) + 1
+        for collection in COLLECTIONS:
+            tank.setdefault(collection, [])
+    elif op == "modes":
+        if "custom_modes" in entry:
+            custom_modes.clear()
+            custom_modes.update(entry["custom_modes"])
+        else:
+            custom_modes.update(entry.get("set", {}))
+            for mode in entry.get("deleted", []):
+                custom_modes.pop(mode, None)
+
+
+def _replay(path, tanks, custom_modes):
+    jpath = journal_path(path)
+    if not os.path.exists(jpath):
+        return
+    with open(jpath, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn final line from an interrupted append - skip it
+                continue
+            _apply(tanks, custom_modes, entry)
+
+
+def load(path):
+    # Shared lock, so a compaction cannot swap the files mid-read
+    with locked(path, exclusive=False):
+        data = _read_snapshot(path)
+        tanks = data.get("tanks", {})
+        custom_modes = data.get("custom_modes", {})
+        _replay(path, tanks, custom_modes)
+    return tanks, custom_modes
+
+
+# Writes
+
+def write_atomic(path, write, binary=False):
+    # write(f) fills a temporary file that is then renamed over path, so
+    # readers see either the old or the new file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb" if binary else "w") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_json(path, document):
+    write_atomic(path, lambda f: json.dump(document, f, indent=2, default=str))
+
+
+def _write_snapshot(path, tanks, custom_modes):
+    # The format follows the extension: reef_data.json or packed reef_data.reef
+    if packed.is_packed(path):
+        write_atomic(path, lambda f: packed.dump(f, tanks, custom_modes), binary=True)
+    else:
+        write_json(path, {
+            "tanks": tanks,
+            "custom_modes": custom_modes
+        })
+
+
+def save(path, tanks, custom_modes, base=None):
+    # A full save is a compaction: the snapshot now holds everything. With
+    # the session's base, only its changes are merged into what is stored
+    # (and base moves on to the saved state); returns {tank: conflicting fields}
+    conflicts = {}
+    with locked(path):
+        if base is None:
+            merged, merged_modes = tanks, custom_modes
+        else:
+            merged, merged_modes = load(path)
+            for name, tank in tanks.items():
+                result, clashes = merge_tank(merged.get(name), tank, base["tanks"].get(name))
+                if result is not None:
+                    merged[name] = result
+                    tank["revision"] = result["revision"]
+                if clashes:
+                    conflicts[name] = clashes
+            merged_modes = merge_modes(merged_modes, custom_modes, base["custom_modes"])
+        _write_snapshot(path, merged, merged_modes)
+        jpath = journal_path(path)
+        if os.path.exists(jpath):
+            os.remove(jpath)
+    if base is not None:
+        base.update(base_of(tanks, custom_modes))
+    return conflicts
+
+
+def compact(path):
+    with locked(path):
+        tanks, custom_modes = load(path)
+        save(path, tanks, custom_modes)
+    return tanks, custom_modes
+
+
+def _journal(path, *entries):
+    jpath = journal_path(path)
+    with locked(path):
+        with open(jpath, "a") as f:
+            f.write("".join(json.dumps(entry, default=str) + "\n" for entry in entries))
+        if os.path.getsize(jpath) > COMPACT_BYTES:
+            compact(path)
+
+
+def append(path, tank_name, collection, record):
+    _journal(path, {"op": "append", "tank": tank_name, "collection": collection, "record": record})
+
+
+def put_tank(path, tank_name, fields, base=None):
+    # Collections are journaled record by record, so only metadata goes here.
+    # With the session's base only the changed fields are written.
+    if base is None:
+        fields = {k: v for k, v in fields.items() if k not in COLLECTIONS}
+        _journal(path, {"op": "tank", "tank": tank_name, "fields": fields})
+        return
+    changed, removed = changes(fields, base["tanks"].get(tank_name))
+    if changed or removed or tank_name not in base["tanks"]:
+        _journal(path, {"op": "tank", "tank": tank_name, "fields": changed, "removed": removed, "bump": True})
+    base["tanks"][tank_name] = describe(fields)
+
+
+def put_modes(path, custom_modes, base=None):
+    if base is None:
+        _journal(path, {"op": "modes", "custom_modes": custom_modes})
+        return
+    described = base["custom_modes"]
+    changed = {m: r for m, r in custom_modes.items() if _canonical(r) != described.get(m)}
+    deleted = [m for m in described if m not in custom_modes]
+    if changed or deleted:
+        _journal(path, {"op": "modes", "set": changed, "deleted": deleted})
+    base["custom_modes"] = {m: _canonical(r) for m, r in custom_modes.items()}
+
+
+def append_many(path, tank_name, collection, records):
+    # One locked journal write session for a whole batch, compacting at most once
+    jpath = journal_path(path)
+    count = 0
+    with locked(path):
+        with open(jpath, "a") as f:
+            for record in records:
+                f.write(json.dumps({"op": "append", "tank": tank_name, "collection": collection, "record": record}, default=str) + "\n")
+                count += 1
+        if os.path.getsize(jpath) > COMPACT_BYTES:
+            compact(path)
+    return count
+
+
+def prune(path, tank_name, before):
+    # Drop readings dated before `before` (rolled up by retention.py);
+    # returns how many were removed
+    with locked(path):
+        tanks, custom_modes = load(path)
+        tank = tanks.get(tank_name)
+        if tank is None:
+            return 0
+        kept = [r for r in tank.get("data", []) if not pruned(r, before)]
+        removed = len(tank.get("data", [])) - len(kept)
+        # raw_since also records an empty prune, so retention.py knows it ran
+        if removed or tank.get("raw_since") != before:
+            tank["data"] = kept
+            tank["raw_since"] = before
+            tank["revision"] = tank.get("revision", 0) + 1
+            save(path, tanks, custom_modes)
+    return removed
+
+
+# Concurrency check
+
+BACKENDS = {"sqlite": "sqlite_store", "sharded": "shard_store"}
+
+
+def _backend(name):
+    # This module for journal / snapshot, otherwise the named backend module
+    return __import__(BACKENDS[name]) if name in BACKENDS else sys.modules[__name__]
+
+
+def _writer(args):
+    # One writer process: logs to its own tank and a shared one, editing a
+    # field of its own on the shared tank every time, like a session would
+    backend_name, path, writer, records = args
+    backend = _backend(backend_name)
+    snapshot = backend_name == "snapshot"
+    own = f"Writer {writer}"
+    for n in range(records):
+        tanks, custom_modes = backend.load(path)
+        loaded = base_of(tanks, custom_modes)
+        for name in (own, "Shared"):
+            tank = tanks.setdefault(name, {"mode": "LPS", "data": [], "maintenance": [], "diary": []})
+            reading = {"Date": f"2025-01-01 00:{writer:02d}:{n:02d}", "Writer": writer, "N": n}
+            tank["data"].append(reading)
+            if not snapshot:
+                backend.append(path, name, "data", reading)
+        tanks["Shared"][f"writer_{writer}"] = n
+        tanks[own]["last"] = n
+        if snapshot:
+            backend.save(path, tanks, custom_modes, base=loaded)
+        else:
+            backend.put_tank(path, own, tanks[own], base=loaded)
+            backend.put_tank(path, "Shared", tanks["Shared"], base=loaded)
+
+
+def stress(path, backend_name="journal", writers=8, records=25):
+    # Runs concurrent writer processes and returns a list of problems found
+    import multiprocessing
+
+    with multiprocessing.get_context("spawn").Pool(writers) as pool:
+        pool.map(_writer, [(backend_name, path, w, records) for w in range(writers)])
+    backend = _backend(backend_name)
+    # A session keeps the readings it logged as the form gave them (text,
+    # blanks); saving them back must not store them again
+    tanks, custom_modes = backend.load(path)
+    loaded = base_of(tanks, custom_modes)
+    reading = {"Date": "2025-01-02 00:00:00", "pH": "8.1", "Nitrate (ppm)": ""}
+    if backend_name != "snapshot":
+        backend.append(path, "Shared", "data", reading)
+    tanks["Shared"]["data"].append(reading)
+    for _ in range(3):
+        backend.save(path, tanks, custom_modes, base=loaded)
+    tanks, _ = backend.load(path)
+    problems = []
+    shared = tanks.get("Shared", {})
+    if len(shared.get("data", [])) != writers * records + 1:
+        problems.append(f"Shared has {len(shared.get('data', []))} readings, expected {writers * records + 1}")
+    for w in range(writers):
+        tank = tanks.get(f"Writer {w}", {})
+        if len(tank.get("data", [])) != records:
+            problems.append(f"Writer {w} has {len(tank.get('data', []))} readings, expected {records}")
+        if tank.get("last") != records - 1:
+            problems.append(f"Writer {w} field 'last' is {tank.get('last')}, expected {records - 1}")
+        if shared.get(f"writer_{w}") != records - 1:
+            problems.append(f"Shared field writer_{w} is {shared.get(f'writer_{w}')}, expected {records - 1}")
+    return problems
+
+
+if __name__ == "__main__":
+    # python storage.py stress [journal|snapshot|sqlite|sharded] [writers] [records]
+    import tempfile
+    import time
+
+    if sys.argv[1:2] != ["stress"]:
+        sys.exit("usage: python storage.py stress [journal|snapshot|sqlite|sharded] [writers] [records]")
+    backend_name = sys.argv[2] if len(sys.argv) > 2 else "journal"
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    records = int(sys.argv[4]) if len(sys.argv) > 4 else 25
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, {"sqlite": "reef_data.db", "sharded": "reef_shards/manifest.json"}.get(backend_name, "reef_data.json"))
+        start = time.perf_counter()
+        problems = stress(path, backend_name, writers, records)
+        elapsed = time.perf_counter() - start
+    print(f"{writers} {backend_name} writers x {records} records in {elapsed:.1f}s: " + ("OK" if not problems else f"{len(problems)} problems"))
+    for problem in problems:
+        print("  " + problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+import probe_service
+import shard_store
+import stats
+
+
+def reading(day, ph):
+    return {"Date": f"2025-01-{day:02d} 08:00:00", "pH": ph}
+
+
+def new_store(tmp_path, names=("Tank 1", "Tank 2")):
+    path = str(tmp_path / "reef_shards" / "manifest.json")
+    shard_store.save(path, {name: {"mode": "SPS", "data": [], "maintenance": [], "diary": []} for name in names}, {})
+    return path
+
+
+def test_flush_retries_only_unwritten_tanks(tmp_path, monkeypatch):
+    path = new_store(tmp_path)
+    append_many = shard_store.append_many
+    calls = []
+
+    def failing(path, tank_name, collection, records):
+        calls.append(tank_name)
+        if tank_name == "Tank 2" and calls.count("Tank 2") == 1:
+            raise OSError("disk full")
+        return append_many(path, tank_name, collection, records)
+
+    monkeypatch.setattr(shard_store, "append_many", failing)
+    monkeypatch.setattr(probe_service, "FLUSH_SECONDS", 0)
+
+    async def run():
+        state = probe_service.new_state(path)
+        await probe_service.add(state, "Tank 1", [reading(1, 8.1)])
+        await probe_service.add(state, "Tank 2", [reading(1, 8.2)])
+        await probe_service.flush(state)
+        assert state["pending"] == 1 and list(state["buffer"]) == ["Tank 2"]
+        await probe_service.flush(state)
+        return state
+
+    state = asyncio.run(run())
+    assert state["pending"] == 0 and state["metrics"]["flushed"] == 2
+    assert len(shard_store.readings(path, "Tank 1")) == 1
+    assert len(shard_store.readings(path, "Tank 2")) == 1
+
+
+def test_stats_rebuilt_after_failed_stats_write(tmp_path, monkeypatch):
+    path = new_store(tmp_path, ("Tank 1",))
+    put_tank = shard_store.put_tank
+    failures = [1]
+
+    def failing(*args, **kwargs):
+        if failures:
+            failures.pop()
+            raise OSError("locked")
+        return put_tank(*args, **kwargs)
+
+    monkeypatch.setattr(shard_store, "put_tank", failing)
+    monkeypatch.setattr(probe_service, "FLUSH_SECONDS", 0)
+
+    async def run():
+        state = probe_service.new_state(path)
+        await probe_service.add(state, "Tank 1", [reading(1, 8.1), reading(2, 8.3)])
+        await probe_service.flush(state)
+        # The readings were written, so only the statistics are outstanding
+        assert state["pending"] == 0 and state["stale_stats"] == {"Tank 1"}
+        await probe_service.flush(state)
+        return state
+
+    state = asyncio.run(run())
+    assert not state["stale_stats"]
+    assert len(shard_store.readings(path, "Tank 1")) == 2
+    tank = shard_store.load(path, with_history=False)[0]["Tank 1"]
+    assert stats.summary(tank["reading_stats"])["pH"]["count"] == 2
+
+
+def test_shutdown_gives_up_on_failing_store(tmp_path, monkeypatch):
+    path = new_store(tmp_path)
+
+    def failing(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(shard_store, "append_many", failing)
+    monkeypatch.setattr(probe_service, "FLUSH_SECONDS", 0)
+
+    async def run():
+        state = probe_service.new_state(path)
+        await probe_service.add(state, "Tank 1", [reading(1, 8.1)])
+        state["stopping"] = True
+        state["wake"].set()
+        await asyncio.wait_for(probe_service.flusher(state), 5)
+        return state
+
+    state = asyncio.run(run())
+    assert state["failures"] == probe_service.STOP_ATTEMPTS
+    dumps = list((tmp_path / "reef_shards").glob("manifest.json.unflushed-*.jsonl"))
+    assert len(dumps) == 1
+    assert [json.loads(line) for line in dumps[0].read_text().splitlines()] == [
+        {"tank": "Tank 1", "record": reading(1, 8.1)}
+    ]
+
+
+def test_bad_content_length_gets_400(tmp_path):
+    path = new_store(tmp_path)
+
+    async def run():
+        state = probe_service.new_state(path)
+        server = await asyncio.start_server(lambda r, w: probe_service.handle(state, r, w), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"POST /readings HTTP/1.1\r\nContent-Length: abc\r\n\r\n")
+        await writer.drain()
+        status = await reader.readline()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return status
+
+    assert asyncio.run(run()).split()[1] == b"400"
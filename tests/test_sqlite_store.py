@@ -0,0 +1,30 @@
+import sqlite_store
+import storage
+
+
+def empty_tank():
+    return {"mode": "SPS", "data": [], "maintenance": [], "diary": []}
+
+
+def test_tank_order_kept_after_put_tank(tmp_path):
+    path = str(tmp_path / "reef_data.db")
+    sqlite_store.save(path, {name: empty_tank() for name in ("Tank 1", "Tank 2", "Tank 3")}, {})
+    tanks, custom_modes = sqlite_store.load(path, with_history=False)
+    base = storage.base_of(tanks, custom_modes)
+    tanks["Tank 1"]["theme"] = "Reef"
+    sqlite_store.put_tank(path, "Tank 1", tanks["Tank 1"], base=base)
+    sqlite_store.save(path, tanks, custom_modes, base=base)
+    assert list(sqlite_store.load(path, with_history=False)[0]) == ["Tank 1", "Tank 2", "Tank 3"]
+
+
+def test_merge_save_does_not_reinsert_stored_readings(tmp_path):
+    path = str(tmp_path / "reef_data.db")
+    sqlite_store.save(path, {"Tank 1": empty_tank()}, {})
+    tanks, custom_modes = sqlite_store.load(path)
+    base = storage.base_of(tanks, custom_modes)
+    # As the app logs them: text values and blanks
+    record = {"Date": "2025-01-01 08:00:00", "pH": "8.1", "Nitrate (ppm)": ""}
+    sqlite_store.append(path, "Tank 1", "data", record)
+    tanks["Tank 1"]["data"].append(record)
+    sqlite_store.save(path, tanks, custom_modes, base=base)
+    assert sqlite_store.readings(path, "Tank 1") == [{"Date": "2025-01-01 08:00:00", "pH": 8.1}]
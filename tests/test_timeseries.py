@@ -0,0 +1,61 @@
+import numpy as np
+
+import timeseries
+
+
+def readings(days):
+    return [{"Date": f"2025-01-{d:02d} 08:00:00", "pH": 8.0 + d / 100} for d in days]
+
+
+def assert_same(cols, expected):
+    assert cols["params"] == expected["params"]
+    np.testing.assert_array_equal(cols["timestamps"], expected["timestamps"])
+    np.testing.assert_array_equal(cols["values"], expected["values"])
+
+
+def test_sync_sorted_history_after_backfill(tmp_path):
+    # A lazy backend returns history sorted by time and has no cheap count
+    path = str(tmp_path / "tank.cols")
+    history = readings(range(1, 11))
+    timeseries.sync(path, 1, lambda start: history[start:])
+    history = sorted(history + [{"Date": "2025-01-05 12:00:00", "pH": 9.99}], key=lambda r: r["Date"])
+    cols = timeseries.sync(path, 2, lambda start: history[start:])
+    assert_same(cols, timeseries.from_records(history))
+    assert_same(timeseries.load(path), timeseries.from_records(history))
+
+
+def test_sync_log_order_appends_only_new_rows(tmp_path):
+    path = str(tmp_path / "tank.cols")
+    data = readings(range(1, 11))
+    timeseries.sync(path, 1, lambda start: data[start:], len(data))
+    data.append({"Date": "2025-01-05 12:00:00", "pH": 9.99})
+    starts = []
+
+    def read(start):
+        starts.append(start)
+        return data[start:]
+
+    cols = timeseries.sync(path, 2, read, len(data))
+    assert starts == [10]
+    assert_same(cols, timeseries.from_records(data))
+
+
+def test_sync_unchanged_revision_skips_read(tmp_path):
+    path = str(tmp_path / "tank.cols")
+    data = readings(range(1, 4))
+    timeseries.sync(path, 1, lambda start: data[start:], len(data))
+
+    def read(start):
+        raise AssertionError("read for an unchanged tank")
+
+    assert len(timeseries.sync(path, 1, read, len(data))["timestamps"]) == 3
+    assert len(timeseries.sync(path, 1, read)["timestamps"]) == 3
+
+
+def test_sync_rebuilds_after_prune(tmp_path):
+    path = str(tmp_path / "tank.cols")
+    data = readings(range(1, 11))
+    timeseries.sync(path, 1, lambda start: data[start:], len(data))
+    data = data[5:] + readings([20, 21, 22, 23, 24, 25])
+    cols = timeseries.sync(path, 2, lambda start: data[start:], len(data), since="2025-01-06")
+    assert_same(cols, timeseries.from_records(data))
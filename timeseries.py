@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+
+# Columnar store for tank readings
+#
+# A tank's tank["data"] list becomes {"params", "timestamps", "values"}:
+# one int64 epoch-seconds array plus a float64 row per parameter (NaN where
+# a reading left the field blank or typed something non-numeric). Columns
+# are persisted to one binary file per tank that np.memmap can open
+# without reading it into memory.
+
+MAGIC = b"REEFCOL1"
+COLUMNS_DIR = "columns"
+NAT = np.iinfo(np.int64).min
+
+
+def discard(directory, tank_name):
+    # Drop a tank's column file, e.g. after its readings were reordered, so
+    # the next sync() rebuilds it
+    path = column_path(directory, tank_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def column_path(directory, tank_name):
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", tank_name)
+    return os.path.join(directory, f"{slug}_{zlib.crc32(tank_name.encode()):08x}.cols")
+
+
+def empty(params=()):
+    return {
+        "params": list(params),
+        "timestamps": np.empty(0, dtype=np.int64),
+        "values": np.empty((len(params), 0), dtype=np.float64)
+    }
+
+
+def _epoch(value):
+    try:
+        return np.datetime64(str(value), "s").astype(np.int64)
+    except ValueError:
+        return NAT
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def from_records(records, params=None):
+    params = list(params or [])
+    for record in records:
+        for key in record:
+            if key != "Date" and key not in params:
+                params.append(key)
+    timestamps = np.fromiter((_epoch(r.get("Date")) for r in records), dtype=np.int64, count=len(records))
+    values = np.full((len(params), len(records)), np.nan)
+    index = {p: i for i, p in enumerate(params)}
+    for j, record in enumerate(records):
+        for key, value in record.items():
+            if key != "Date":
+                values[index[key], j] = _number(value)
+    return {"params": params, "timestamps": timestamps, "values": values}
+
+
+def concat(cols, other):
+    params = list(cols["params"])
+    for p in other["params"]:
+        if p not in params:
+            params.append(p)
+    n, m = len(cols["timestamps"]), len(other["timestamps"])
+    values = np.full((len(params), n + m), np.nan)
+    for i, p in enumerate(cols["params"]):
+        values[params.index(p), :n] = cols["values"][i]
+    for i, p in enumerate(other["params"]):
+        values[params.index(p), n:] = other["values"][i]
+    return {
+        "params": params,
+        "timestamps": np.concatenate([cols["timestamps"], other["timestamps"]]),
+        "values": values
+    }
+
+
+# Binary file: magic, header length, JSON header, padding to 8 bytes,
+# int64 timestamps[rows], float64 values[params][rows]
+
+def save(path, cols):
+    # Any "meta" dict in cols is kept in the header and returned by load()
+    header = json.dumps({"params": cols["params"], "rows": len(cols["timestamps"]), "meta": cols.get("meta", {})}).encode()
+    pad = -(len(MAGIC) + 4 + len(header)) % 8
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header + b" " * pad)
+        f.write(np.ascontiguousarray(cols["timestamps"], dtype="<i8").tobytes())
+        f.write(np.ascontiguousarray(cols["values"], dtype="<f8").tobytes())
+    os.replace(tmp, path)
+
+
+def load(path, mmap=True):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a reading column file")
+        size = struct.unpack("<I", f.read(4))[0]
+        header = json.loads(f.read(size))
+    offset = len(MAGIC) + 4 + size
+    offset += -offset % 8
+    rows, params = header["rows"], header["params"]
+    if rows == 0:
+        return dict(empty(params), meta=header.get("meta", {}))
+    if mmap:
+        timestamps = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(rows,))
+        values = np.memmap(path, dtype="<f8", mode="r", offset=offset + 8 * rows, shape=(len(params), rows))
+    else:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            timestamps = np.frombuffer(f.read(8 * rows), dtype="<i8")
+            values = np.frombuffer(f.read(8 * rows * len(params)), dtype="<f8").reshape(len(params), rows)
+    return {"params": params, "timestamps": timestamps, "values": values, "meta": header.get("meta", {})}
+
+
+def sync(path, revision, read, count=None, since=None):
+    # Bring the column file up to date with a tank's readings. revision
+    # changes whenever they do and is kept in the file's header with since
+    # (the tank's last retention prune), so an unchanged tank is not read at
+    # all. count is the number of readings when the caller keeps them in
+    # log order (a JSON store's list); read(start) then returns those from
+    # index start on and only they are converted. Without count (histories a
+    # backend returns sorted by time, where a backfilled reading shifts the
+    # rest) a new revision rebuilds the file from read(0).
+    cols = load(path) if os.path.exists(path) else empty()
+    meta = cols.get("meta", {})
+    n = len(cols["timestamps"])
+    # As they come back from the JSON header
+    revision, since = json.loads(json.dumps([revision, since], default=str))
+    if "revision" in meta and meta["revision"] == revision and meta.get("since") == since and count in (None, n):
+        return cols
+    # Rebuilt when earlier readings were removed or may have moved
+    if meta.get("since") != since or count is None or count < n:
+        cols, n = empty(), 0
+    cols = concat(cols, from_records(read(n)))
+    cols["meta"] = {"revision": revision, "since": since}
+    save(path, cols)
+    return cols
+
+
+# Queries
+
+def series(cols, param):
+    if param not in cols["params"]:
+        return np.full(len(cols["timestamps"]), np.nan)
+    return cols["values"][cols["params"].index(param)]
+
+
+def window(cols, start=None, end=None):
+    ts = np.asarray(cols["timestamps"])
+    mask = ts != NAT
+    if start is not None:
+        mask &= ts >= _epoch(start)
+    if end is not None:
+        mask &= ts <= _epoch(end)
+    return {"params": cols["params"], "timestamps": ts[mask], "values": np.asarray(cols["values"])[:, mask]}
+
+
+def latest(cols):
+    if not len(cols["timestamps"]):
+        return {}
+    row = {p: cols["values"][i, -1] for i, p in enumerate(cols["params"])}
+    return {p: float(v) for p, v in row.items() if not np.isnan(v)}
+
+
+def frame(cols, params=None):
+    import pandas as pd
+
+    params = params or cols["params"]
+    return pd.DataFrame(
+        {p: series(cols, p) for p in params},
+        index=pd.DatetimeIndex(np.asarray(cols["timestamps"]).astype("datetime64[s]"), name="Date")
+    )
+
+
+# Downsampling for charts. Both methods pick row indices per parameter; the
+# union across parameters keeps one shared time index, so every series
+# keeps its own extremes and the chart has no artificial gaps. The point
+# budget is divided between the parameters, so the union stays within it.
+
+def minmax_indices(values, target):
+    # values is (params, readings); each series is cut into target / 2
+    # equal-count buckets and keeps the row of its min and max in each
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    n = values.shape[1]
+    buckets = max(target // 2, 1)
+    if n <= target:
+        return np.arange(n)
+    size = -(-n // buckets)
+    padded = np.full((values.shape[0], buckets * size), np.nan)
+    padded[:, :n] = values
+    padded = padded.reshape(values.shape[0], buckets, size)
+    missing = np.isnan(padded)
+    lo = np.where(missing, np.inf, padded).argmin(axis=2)
+    hi = np.where(missing, -np.inf, padded).argmax(axis=2)
+    present = ~missing.all(axis=2)
+    base = np.arange(buckets) * size
+    idx = np.concatenate([(base + lo)[present], (base + hi)[present], [0, n - 1]])
+    return np.unique(idx[idx < n])
+
+
+def lttb_indices(x, y, target):
+    # Largest-Triangle-Three-Buckets over the non-NaN points of one series
+    points = np.flatnonzero(~np.isnan(y))
+    n = len(points)
+    if n <= max(target, 2):
+        return points
+    if target < 3:
+        # No middle buckets; just the end points
+        return points[[0, n - 1]]
+    x = np.asarray(x, dtype=np.float64)[points]
+    y = np.asarray(y, dtype=np.float64)[points]
+    edges = (np.arange(target - 1) * ((n - 2) / (target - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    selected = np.empty(target, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            cx, cy = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        bx, by = x[start:end], y[start:end]
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return points[selected]
+
+
+def take(cols, idx):
+    return {
+        "params": cols["params"],
+        "timestamps": np.asarray(cols["timestamps"])[idx],
+        "values": np.asarray(cols["values"])[:, idx]
+    }
+
+
+def downsample(cols, target=500, method="minmax"):
+    # Readings with unparseable dates cannot be placed on a chart
+    x = np.asarray(cols["timestamps"])
+    if (x == NAT).any():
+        cols = take(cols, np.flatnonzero(x != NAT))
+        x = cols["timestamps"]
+    n = len(x)
+    if n <= target:
+        return cols
+    values = np.asarray(cols["values"], dtype=np.float64)
+    values = values[~np.isnan(values).all(axis=1)]
+    per_series = max(target // max(len(values), 1), 4)
+    if method == "lttb":
+        idx = np.unique(np.concatenate(
+            [lttb_indices(x, row, per_series) for row in values] + [[0, n - 1]]
+        ))
+    else:
+        idx = minmax_indices(values, per_series)
+    return take(cols, idx)
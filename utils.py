@@ -1,8 +1,343 @@
+import io
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import profiling
+
+
 def strip_unicode(text):
     return text.encode("latin-1", errors="ignore").decode("latin-1")
 
 
 
 
-def suggest_maintenance(tank):
-    suggestions = []
\ No newline at end of file
+# Default modes: parameter -> (low, high) acceptable range
+default_modes = {
+    "Fish Only": {
+        "Temperature (°C)": (24, 27),
+        "Salinity (SG)": (1.020, 1.026),
+        "pH": (7.8, 8.4),
+        "Ammonia (ppm)": (0, 0.25),
+        "Nitrite (ppm)": (0, 0.5),
+        "Nitrate (ppm)": (0, 40)
+    },
+    "LPS": {
+        "Temperature (°C)": (24, 26),
+        "Salinity (SG)": (1.024, 1.026),
+        "pH": (8.0, 8.4),
+        "Ammonia (ppm)": (0, 0),
+        "Nitrite (ppm)": (0, 0),
+        "Nitrate (ppm)": (0, 20),
+        "Phosphate (ppm)": (0, 0.1),
+        "Calcium (ppm)": (380, 450),
+        "Alkalinity (dKH)": (7, 12),
+        "Magnesium (ppm)": (1200, 1400)
+    },
+    "SPS": {
+        "Temperature (°C)": (25, 26),
+        "Salinity (SG)": (1.025, 1.026),
+        "pH": (8.1, 8.4),
+        "Ammonia (ppm)": (0, 0),
+        "Nitrite (ppm)": (0, 0),
+        "Nitrate (ppm)": (0, 5),
+        "Phosphate (ppm)": (0, 0.03),
+        "Calcium (ppm)": (400, 450),
+        "Alkalinity (dKH)": (7.5, 8.5),
+        "Magnesium (ppm)": (1300, 1400)
+    }
+}
+
+# Suggestion rules, compiled once at import
+# (parameter, check(value, mode), suggestion) - only applied to non-zero readings
+READING_RULES = [
+    ("Nitrate (ppm)", lambda v, mode: v > 40,
+     "Nitrate is high – perform 20–30% water change and clean filter media."),
+    ("Phosphate (ppm)", lambda v, mode: v > 0.1,
+     "Phosphate elevated – replace GFO or reduce feeding."),
+    ("Ammonia (ppm)", lambda v, mode: v > 0.25,
+     "Toxic ammonia detected – urgent water change recommended."),
+    ("pH", lambda v, mode: v < 7.9,
+     "Low pH – improve aeration or review CO₂ levels."),
+    ("Alkalinity (dKH)", lambda v, mode: (mode == "SPS" and (v < 7.5 or v > 8.5)) or (mode == "LPS" and (v < 7 or v > 12)),
+     "Alkalinity instability – dose buffer or use auto-doser."),
+]
+# Suggestions for anomalies.py findings, by kind
+ANOMALY_RULES = {
+    "drift": "{param} has been trending {direction} since {since} – retest and review dosing before it leaves range.",
+    "spike": "{param} reading is far from its recent values – retest to rule out a bad sample or probe fault.",
+    "rate": "{param} is changing faster than livestock tolerate – check dosers, heater and top-off.",
+}
+MODE_RULES = {
+    "SPS": ["SPS coral requires stable parameters – test calcium, alk, mag regularly."],
+}
+
+# Maintenance task categories: (category, keywords matched in the lower-cased task)
+TASK_CATEGORIES = [
+    ("skimmer_clean", ("skimmer",)),
+    ("water_change", ("water change",)),
+    ("gfo_swap", ("gfo",)),
+    ("carbon_swap", ("carbon",)),
+    ("filter_media", ("filter", "sock", "floss", "roller")),
+    ("heater_calibration", ("heater",)),
+    ("probe_calibration", ("probe",)),
+    ("pump_clean", ("pump",)),
+    ("glass_clean", ("glass",)),
+]
+# Overdue reminders: (category, equipment it applies to, days allowed,
+# reminder when overdue, reminder when never logged)
+OVERDUE_RULES = [
+    ("skimmer_clean", "Skimmer", 10,
+     "Skimmer last cleaned {days} days ago – clean recommended.",
+     "Skimmer installed but never cleaned – log a clean soon."),
+    ("heater_calibration", "Heater", 30,
+     "Check heater calibration monthly to avoid temperature drift.",
+     "Check heater calibration monthly to avoid temperature drift."),
+]
+
+suggestion_stats = {"hits": 0, "misses": 0}
+
+
+def _reading(latest, param):
+    value = latest.get(param)
+    if value in [None, '', 'N/A']:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def task_categories(task):
+    task = " ".join(str(task).lower().split())
+    return [category for category, keywords in TASK_CATEGORIES if any(k in task for k in keywords)]
+
+
+def index_maintenance(index, record):
+    # Fold one maintenance entry into tank["maintenance_index"]
+    index["entries"] = index.get("entries", 0) + 1
+    tasks = index.setdefault("tasks", {})
+    performed = str(record.get("Date", ""))
+    for category in task_categories(record.get("Task", "")):
+        entry = tasks.setdefault(category, {"last": performed, "count": 0})
+        entry["count"] += 1
+        # Dates are ISO (YYYY-MM-DD), so string order is date order
+        if performed > entry["last"]:
+            entry["last"] = performed
+    return index
+
+
+def build_maintenance_index(maintenance):
+    index = {"entries": 0, "tasks": {}}
+    for record in maintenance:
+        index_maintenance(index, record)
+    return index
+
+
+def ensure_maintenance_index(tank):
+    # Rebuild when missing or out of step with the loaded maintenance list
+    index = tank.get("maintenance_index")
+    if "maintenance" in tank and (not index or index.get("entries") != len(tank["maintenance"])):
+        index = tank["maintenance_index"] = build_maintenance_index(tank["maintenance"])
+    return index or build_maintenance_index([])
+
+
+def _revision_key(tank, findings=None):
+    # Writes bump tank["revision"]; the reading count, last reading date and
+    # maintenance entry count catch tanks written by another session, and
+    # the date expires the "days since" reminders at midnight
+    data = tank.get("data") or []
+    return (
+        tuple((f["param"], f["kind"], f["direction"], f["since"]) for f in findings or ()),
+        tank.get("revision", 0),
+        tank.get("mode", "Fish Only"),
+        tuple(tank.get("equipment", [])),
+        len(data),
+        data[-1].get("Date") if data else None,
+        ensure_maintenance_index(tank).get("entries"),
+        date.today()
+    )
+
+
+def _suggest(tank, findings=None):
+    suggestions = []
+
+    mode = tank.get("mode", "Fish Only")
+    equipment = tank.get("equipment", [])
+    data = tank.get("data", [])
+
+    latest = data[-1] if data else {}
+    for param, check, suggestion in READING_RULES:
+        value = _reading(latest, param)
+        if value and check(value, mode):
+            suggestions.append(suggestion)
+
+    tasks = ensure_maintenance_index(tank).get("tasks", {})
+    today = date.today()
+    for category, item, max_days, overdue, never in OVERDUE_RULES:
+        if item not in equipment:
+            continue
+        performed = tasks.get(category)
+        if not performed:
+            suggestions.append(never)
+            continue
+        days = (today - datetime.strptime(performed["last"][:10], "%Y-%m-%d").date()).days
+        if days > max_days:
+            suggestions.append(overdue.format(days=days))
+
+    for finding in findings or ():
+        suggestion = ANOMALY_RULES[finding["kind"]].format(**finding)
+        if suggestion not in suggestions:
+            suggestions.append(suggestion)
+
+    suggestions.extend(MODE_RULES.get(mode, []))
+
+    return suggestions
+
+
+@profiling.profiled()
+def suggest_maintenance(tank, name=None, findings=None, cache=None, view=None):
+    # findings: the tank's anomalies.tank_findings(), if any. With a cache
+    # (e.g. the session's state), the last result per tank is reused while
+    # its revision key is unchanged; view() gives the tank to evaluate when
+    # building it needs a store read, so a cache hit skips that read
+    key = _revision_key(tank, findings)
+    cached = cache.get(name) if cache is not None else None
+    if cached and cached[0] == key:
+        suggestion_stats["hits"] += 1
+        return list(cached[1])
+    suggestion_stats["misses"] += 1
+    suggestions = _suggest(view() if view else tank, findings)
+    if cache is not None:
+        cache[name] = (key, suggestions)
+    return list(suggestions)
+
+
+# PDF reports
+
+def render_trend_chart(cols, param, ranges=None, fmt="png"):
+    # One parameter's history as image bytes, with the mode's range shaded
+    import numpy as np
+    from matplotlib.figure import Figure
+
+    import timeseries
+
+    values = timeseries.series(cols, param)
+    dates = np.asarray(cols["timestamps"]).astype("datetime64[s]")
+    fig = Figure(figsize=(7, 2.2))
+    ax = fig.subplots()
+    if ranges and param in ranges:
+        low, high = ranges[param]
+        ax.axhspan(low, high, color="#00BFFF", alpha=0.15)
+    ax.plot(dates, values, linewidth=1)
+    ax.set_title(param, fontsize=9)
+    ax.tick_params(labelsize=7)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=110, **({"pil_kwargs": {"quality": 90}} if fmt == "jpeg" else {}))
+    return buf.getvalue()
+
+
+def _pdf_bytes(pdf):
+    out = pdf.output(dest="S")
+    return out.encode("latin-1") if isinstance(out, str) else bytes(out)
+
+
+@profiling.profiled()
+def generate_pdf_report(tank_name, tank, latest=None, cols=None, suggestions=None, ranges=None, charts=True):
+    from fpdf import FPDF
+
+    import chart_cache
+    import stats
+    import timeseries
+
+    if latest is None:
+        data = tank.get("data") or []
+        latest = data[-1] if data else {}
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(200, 10, txt=strip_unicode(f"Tank Report: {tank_name}"), ln=True)
+    pdf.cell(200, 10, txt=strip_unicode(f"Theme: {tank.get('theme', '')}"), ln=True)
+    pdf.cell(200, 10, txt=strip_unicode(f"Livestock: {tank.get('livestock', '')}"), ln=True)
+    pdf.cell(200, 10, txt=strip_unicode(f"Mode: {tank.get('mode', '')}"), ln=True)
+
+    if latest:
+        pdf.cell(200, 10, txt=strip_unicode("Latest Parameters:"), ln=True)
+        for k, v in latest.items():
+            pdf.cell(200, 8, txt=strip_unicode(f"{k}: {v}"), ln=True)
+
+    trend_rows = stats.summary(stats.ensure(tank))
+    if trend_rows:
+        pdf.cell(200, 10, txt=strip_unicode(f"Trends (last {stats.ROLLING_WINDOW} readings):"), ln=True)
+        for param, row in trend_rows.items():
+            pdf.cell(200, 8, txt=strip_unicode(
+                f"{param}: mean {row['mean']:.3g}, std {row['std']:.3g}, "
+                f"EWMA {row['ewma']:.3g}, slope {row['slope_per_day']:+.3g}/day"
+            ), ln=True)
+
+    if suggestions:
+        pdf.cell(200, 10, txt=strip_unicode("Suggested Maintenance:"), ln=True)
+        for tip in suggestions:
+            pdf.cell(200, 8, txt=strip_unicode(f"• {tip}"), ln=True)
+
+    charts_used = []
+    if charts:
+        if cols is None:
+            cols = timeseries.from_records(tank.get("data") or [])
+        if len(cols["timestamps"]):
+            revision = chart_cache.data_hash(cols)
+            cols = timeseries.downsample(cols, 500)
+            pdf.add_page()
+            pdf.cell(200, 10, txt=strip_unicode("Parameter Trends:"), ln=True)
+            for param in cols["params"]:
+                param_range = (ranges or {}).get(param)
+                key = chart_cache.chart_key(tank_name, [param], "pdf", revision, param_range, "jpeg")
+                # JPEG because PyFPDF 1.7 decodes PNG alpha channels in pure
+                # Python; both PyFPDF and fpdf2 read the cached file by path
+                path = chart_cache.file_for(
+                    key, "jpg", lambda: render_trend_chart(cols, param, {param: param_range} if param_range else None, "jpeg"),
+                    used=charts_used
+                )
+                pdf.image(path, w=190)
+
+    report = _pdf_bytes(pdf)
+    chart_cache.evict(keep=charts_used)
+    return report
+
+
+def _report_job(job):
+    name, kwargs = job
+    return name, generate_pdf_report(name, **kwargs)
+
+
+@profiling.profiled()
+def generate_fleet_reports(jobs, workers=None):
+    # jobs: {tank name: generate_pdf_report keyword arguments (tank, latest,
+    # cols, suggestions, ranges)}; reports are rendered in parallel processes.
+    # Workers are spawned rather than forked from the (threaded) Streamlit server.
+    if len(jobs) <= 1:
+        return dict(_report_job(job) for job in jobs.items())
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return dict(pool.map(_report_job, jobs.items()))
+
+
+if __name__ == "__main__":
+    # python utils.py [reef_data.json] [output dir] - weekly batch of every tank's report
+    import storage
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "reef_data.json"
+    out_dir = sys.argv[2] if len(sys.argv) > 2 else "pdf_exports"
+    tanks, _ = storage.load(path)
+    os.makedirs(out_dir, exist_ok=True)
+    reports = generate_fleet_reports({
+        name: {"tank": tank, "suggestions": suggest_maintenance(tank, name)} for name, tank in tanks.items()
+    })
+    for name, pdf in reports.items():
+        with open(os.path.join(out_dir, f"{name}_report.pdf"), "wb") as f:
+            f.write(pdf)
+    print(f"Wrote {len(reports)} reports to {out_dir}")